@@ -1,8 +1,11 @@
 import collections
+import concurrent.futures
 import numpy as np
 import matplotlib.pyplot as plt
+import os
 import sqlite3 as lite
 import sys
+import threading
 from itertools import cycle
 import matplotlib
 from matplotlib import cm
@@ -14,7 +17,8 @@ if len(sys.argv) < 2:
 
 
 def get_cursor(file_name):
-    """Connects and returns a cursor to an sqlite output file
+    """Connects and returns a cursor to an sqlite output file.
+    If the output file has a sidecar file, it is attached as 'sidecar'.
 
     Parameters
     ----------
@@ -27,7 +31,371 @@ def get_cursor(file_name):
     """
     con = lite.connect(file_name)
     con.row_factory = lite.Row
-    return con.cursor()
+    cur = con.cursor()
+    attach_sidecar(cur, file_name)
+    return cur
+
+
+def read_only_cursor(file_name):
+    """Connects and returns a cursor to an sqlite output file
+    opened read-only, attaching its sidecar file if there is one.
+    The connection may be closed from another thread.
+
+    Parameters
+    ----------
+    file_name: str
+        name of the sqlite file
+
+    Returns
+    -------
+    sqlite cursor
+    """
+    con = lite.connect('file:' + file_name + '?mode=ro', uri=True,
+                       check_same_thread=False)
+    con.row_factory = lite.Row
+    cur = con.cursor()
+    attach_sidecar(cur, file_name, True)
+    return cur
+
+
+def run_queries(cur, calls, max_workers=4):
+    """Runs independent analysis calls on a thread pool.
+    Every thread reads the output file through its own read-only
+    connection, so the queries run at the same time.
+
+    Without a sidecar file, the calls are run one after another on
+    cur instead: the summary tables (eg. agentpowersummary) are then
+    temporary tables of each connection, and every thread would
+    build its own copy with another scan of the output.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor of the output file. Calls on an in-memory
+        database or without sidecar are run one after another
+        on this cursor
+    calls: list
+        list of (function, args) tuples,
+        function is called as function(cursor, *args)
+    max_workers: int
+        number of threads
+
+    Returns
+    -------
+    results: list
+        results of the calls, in the order of calls
+    """
+    file_name = get_file_name(cur)
+    if file_name == '' or not has_table(cur, 'sidecarinfo', 'sidecar'):
+        return [function(cur, *args) for function, args in calls]
+    local = threading.local()
+    cursors = []
+
+    def call(function, args):
+        if not hasattr(local, 'cur'):
+            local.cur = read_only_cursor(file_name)
+            cursors.append(local.cur)
+        return function(local.cur, *args)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(call, function, args)
+                       for function, args in calls]
+            results = [future.result() for future in futures]
+    finally:
+        for thread_cur in cursors:
+            thread_cur.connection.close()
+    return results
+
+
+def sidecar_name(file_name):
+    """Returns the name of the sidecar file of an output file
+
+    Parameters
+    ----------
+    file_name: str
+        name of the sqlite file
+
+    Returns
+    -------
+    str
+        name of the sidecar file (eg. output.sidecar.sqlite)
+    """
+    return os.path.splitext(file_name)[0] + '.sidecar.sqlite'
+
+
+def attach_sidecar(cur, file_name, read_only=False):
+    """Attaches the sidecar file of an output file as 'sidecar',
+    if there is one and it was built from the output as it is now
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor of the output file
+    file_name: str
+        name of the sqlite file
+    read_only: bool
+        if True, the sidecar file is opened read-only
+
+    Returns
+    -------
+    bool
+        True if the sidecar file is attached
+    """
+    sidecar_file = sidecar_name(file_name)
+    if not os.path.isfile(sidecar_file):
+        return False
+    if read_only:
+        cur.execute('ATTACH DATABASE "file:' + sidecar_file +
+                    '?mode=ro" AS sidecar')
+    else:
+        cur.execute('ATTACH DATABASE "' + sidecar_file + '" AS sidecar')
+    fingerprint = None
+    if has_table(cur, 'sidecarinfo', 'sidecar'):
+        fingerprint = cur.execute('SELECT fingerprint '
+                                  'FROM sidecar.sidecarinfo').fetchone()
+    # a sidecar of an earlier output written to the same file is stale
+    if fingerprint is None or fingerprint[0] != output_fingerprint(cur):
+        cur.execute('DETACH DATABASE sidecar')
+        return False
+    return True
+
+
+def output_fingerprint(cur):
+    """Returns a fingerprint of an output file, made of its simulation id
+    and the number of rows of the tables the sidecar file summarizes
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor of the output file
+
+    Returns
+    -------
+    str
+    """
+    parts = [str(cur.execute('SELECT hex(simid) FROM main.info'
+                             ).fetchone()[0])]
+    for table in ['agententry', 'agentexit', 'resources', 'transactions',
+                  'timeseriespower']:
+        if has_table(cur, table):
+            parts.append(str(cur.execute('SELECT max(rowid) FROM main.' +
+                                         table).fetchone()[0]))
+    return ':'.join(parts)
+
+
+def has_table(cur, table, schema='main'):
+    """Returns True if a schema of the connection has a table
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    table: str
+        name of table
+    schema: str
+        'main', 'temp' or name of an attached database
+
+    Returns
+    -------
+    bool
+    """
+    if schema == 'temp':
+        master = 'sqlite_temp_master'
+    else:
+        master = schema + '.sqlite_master'
+    try:
+        found = cur.execute('SELECT name FROM ' + master + ' WHERE '
+                            'type = "table" AND name = "' + table +
+                            '" COLLATE NOCASE').fetchone()
+    except lite.OperationalError:
+        # the schema is not attached
+        return False
+    return found is not None
+
+
+def transaction_table(cur, fraction=None):
+    """Returns the table of material traded between agents, named flows,
+    with time, quantity, commodity, senderid, receiverid and qualid columns.
+
+    The pre-aggregated sidecar table is used if the sidecar file
+    is attached, otherwise resources inner joined with transactions.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    fraction: float
+        if given, only a deterministic sample of about this fraction
+        of the rows (see sample_condition)
+
+    Returns
+    -------
+    str
+        sqlite table expression to put after FROM
+    """
+    if has_table(cur, 'commodityflow', 'sidecar'):
+        if fraction is None:
+            return 'sidecar.commodityflow AS flows'
+        return ('(SELECT * FROM sidecar.commodityflow WHERE ' +
+                sample_condition('rowid', fraction) + ') AS flows')
+    sample = ''
+    if fraction is not None:
+        sample = ' WHERE ' + sample_condition('transactions.rowid', fraction)
+    return ('(SELECT time, quantity, commodity, senderid, receiverid, '
+            'qualid FROM resources INNER JOIN transactions '
+            'ON transactions.resourceid = resources.resourceid' + sample +
+            ') AS flows')
+
+
+def sample_condition(column, fraction):
+    """Returns the sqlite condition keeping a deterministic sample
+    of rows, by a multiplicative hash of an integer column
+
+    Parameters
+    ----------
+    column: str
+        integer column, eg. rowid
+    fraction: float
+        fraction of rows to keep, between 0 and 1
+
+    Returns
+    -------
+    str
+        sqlite condition
+    """
+    if not 0 < fraction <= 1:
+        raise Exception('Sample fraction must be between 0 and 1')
+    return ('((' + column + ' * 2654435761) % 4294967296) < ' +
+            str(int(round(fraction * 4294967296))))
+
+
+def composition_tables(cur):
+    """Returns the tables of canonical compositions, building them
+    if needed: qualidmap (qualid, canonid) maps every qualid to the
+    first qualid with an identical composition, and canoncompositions
+    (qualid, nucid, massfrac) holds only those canonical compositions.
+
+    The sidecar tables are used if the sidecar file is attached,
+    otherwise they are built once per connection as temporary tables.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    qualidmap: str
+        name of the qualid map table
+    canoncompositions: str
+        name of the canonical composition table
+    """
+    if has_table(cur, 'canoncompositions', 'sidecar'):
+        return 'sidecar.qualidmap', 'sidecar.canoncompositions'
+    if not has_table(cur, 'canoncompositions', 'temp'):
+        qualid_map, compositions = canonical_compositions(cur)
+        cur.execute('CREATE TEMP TABLE qualidmap '
+                    '(qualid INTEGER PRIMARY KEY, canonid INTEGER)')
+        cur.executemany('INSERT INTO temp.qualidmap VALUES (?, ?)',
+                        qualid_map)
+        cur.execute('CREATE TEMP TABLE canoncompositions '
+                    '(qualid INTEGER, nucid INTEGER, massfrac REAL)')
+        cur.executemany('INSERT INTO temp.canoncompositions '
+                        'VALUES (?, ?, ?)', compositions)
+        cur.execute('CREATE INDEX temp.canoncompositions_qualid '
+                    'ON canoncompositions (qualid, nucid)')
+    return 'temp.qualidmap', 'temp.canoncompositions'
+
+
+# named nuclide groups: key=name,
+# value=list of (first, last) atomic numbers of the group
+NUCLIDE_GROUPS = {'U': [(92, 92)],
+                  'Pu': [(94, 94)],
+                  'TRU': [(93, 118)],
+                  'MA': [(93, 93), (95, 118)],
+                  'FP': [(30, 71)]}
+
+
+def nuclide_condition(nuclides, column='nucid'):
+    """Returns the sqlite condition selecting nuclides from a nucid column
+
+    Parameters
+    ----------
+    nuclides: list
+        list of nuclides (eg. 'Pu239' or 942390000), elements (eg. 'Am')
+        or groups in NUCLIDE_GROUPS ('U', 'Pu', 'TRU' for transuranics,
+        'MA' for minor actinides, 'FP' for fission products)
+    column: str
+        column holding nucids
+
+    Returns
+    -------
+    str
+        sqlite condition
+    """
+    if len(nuclides) == 0:
+        raise Exception('Cannot filter an empty list of nuclides')
+    ranges = []
+    for nuclide in nuclides:
+        if nuclide in NUCLIDE_GROUPS:
+            ranges += [(first * 10000000, (last + 1) * 10000000 - 1)
+                       for first, last in NUCLIDE_GROUPS[nuclide]]
+            continue
+        nucid = nucname.id(nuclide)
+        if nucid % 10000000 == 0:
+            # element, every nuclide with its atomic number
+            ranges.append((nucid, nucid + 10000000 - 1))
+        else:
+            ranges.append((nucid, nucid))
+    conditions = []
+    for first, last in ranges:
+        if first == last:
+            conditions.append(column + ' = ' + str(first))
+        else:
+            conditions.append(column + ' BETWEEN ' + str(first) +
+                              ' AND ' + str(last))
+    return '(' + ' OR '.join(conditions) + ')'
+
+
+def isotope_query(cur, bucket, condition, nuclides=None):
+    """Returns the query of isotope masses traded per timestep.
+    Traded material is first summed per canonical composition,
+    so every composition is joined once per timestep.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    bucket: str
+        time bucket from time_bucket
+    condition: str
+        sqlite condition on the columns of transaction_table
+    nuclides: list
+        if given, only these nuclides, elements or groups
+        (see nuclide_condition)
+
+    Returns
+    -------
+    str
+        query selecting time, mass [kg] and nucid
+    """
+    qualidmap, compositions = composition_tables(cur)
+    nuclide_filter = ''
+    if nuclides is not None:
+        nuclide_filter = ' AND ' + nuclide_condition(nuclides,
+                                                     'compositions.nucid')
+    return ('SELECT time, sum(quantity * massfrac), nucid FROM '
+            '(SELECT ' + bucket + ' AS time, canonid, '
+            'sum(quantity) AS quantity '
+            'FROM ' + transaction_table(cur) + ' '
+            'INNER JOIN ' + qualidmap + ' AS qualidmap '
+            'ON qualidmap.qualid = flows.qualid '
+            'WHERE ' + condition + ' '
+            'GROUP BY ' + bucket + ', canonid) AS canonflows '
+            'INNER JOIN ' + compositions + ' AS compositions '
+            'ON compositions.qualid = canonflows.canonid' + nuclide_filter +
+            ' GROUP BY time, nucid')
 
 
 def get_agent_ids(cur, archetype):
@@ -49,9 +417,7 @@ def get_agent_ids(cur, archetype):
     id_list: list
         list of all agentId strings
     """
-    agents = cur.execute("SELECT agentid FROM agententry WHERE spec "
-                         "LIKE '%" + archetype + "%' COLLATE NOCASE"
-                         ).fetchall()
+    agents = cur.execute(archetype_ids(cur, archetype)).fetchall()
 
     return list(str(agent['agentid']) for agent in agents)
 
@@ -71,13 +437,131 @@ def get_prototype_id(cur, prototype):
     agent_id: list
         list of prototype agent_ids as strings
     """
-    ids = cur.execute('SELECT agentid FROM agententry '
-                      'WHERE prototype = "' +
-                      str(prototype) + '" COLLATE NOCASE').fetchall()
+    ids = cur.execute(prototype_ids(cur, [prototype])).fetchall()
 
     return list(str(agent['agentid']) for agent in ids)
 
 
+# columns and indexes of the agentarchetypes table
+ARCHETYPE_SCHEMA = ('(agentid INTEGER PRIMARY KEY, kind TEXT, spec TEXT, '
+                    'library TEXT, archetype TEXT, prototype TEXT)')
+ARCHETYPE_INDEXES = ['spec, agentid', 'archetype, agentid',
+                     'prototype, kind, agentid']
+
+
+def agent_archetypes(cur):
+    """Returns the library, archetype and prototype of every agent,
+    in lower case
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    archetypes: list
+        list of (agentid, kind, spec, library, archetype, prototype)
+    """
+    archetypes = []
+    for row in cur.execute('SELECT agentid, kind, spec, prototype '
+                           'FROM agententry').fetchall():
+        # spec is path:library:archetype, eg. :cycamore:Reactor
+        parts = str(row[2]).split(':')
+        library = parts[-2] if len(parts) > 1 else ''
+        archetypes.append((row[0], row[1], row[2], library.lower(),
+                           parts[-1].lower(), str(row[3]).lower()))
+    return archetypes
+
+
+def archetype_table(cur):
+    """Returns the table with the normalized archetype of every agent
+    (see agent_archetypes), building it if needed.
+
+    The sidecar table is used if the sidecar file is attached,
+    otherwise the table is built once per connection into an
+    indexed temporary table.
+
+    agentarchetypes table has the following format:
+        AgentId / Kind / Spec / Library / Archetype / Prototype
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    str
+        name of the archetype table (with schema)
+    """
+    if has_table(cur, 'agentarchetypes', 'sidecar'):
+        return 'sidecar.agentarchetypes'
+    if not has_table(cur, 'agentarchetypes', 'temp'):
+        cur.execute('CREATE TEMP TABLE agentarchetypes ' +
+                    ARCHETYPE_SCHEMA)
+        cur.executemany('INSERT INTO temp.agentarchetypes '
+                        'VALUES (?, ?, ?, ?, ?, ?)', agent_archetypes(cur))
+        for column in ARCHETYPE_INDEXES:
+            cur.execute('CREATE INDEX temp.agentarchetypes_' +
+                        column.split(',')[0] +
+                        ' ON agentarchetypes (' + column + ')')
+    return 'temp.agentarchetypes'
+
+
+def archetype_ids(cur, archetype):
+    """Generates sqlite query of the agentids whose spec contains
+    archetype (case insensitive), eg. 'Reactor' or 'cycamore:Sink'
+
+    The archetype is matched against the few distinct specs in
+    Python, so the query itself only looks up the spec index.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    archetype: str
+        agent's archetype specification
+
+    Returns
+    -------
+    str
+        sqlite query returning an agentid column
+    """
+    table = archetype_table(cur)
+    specs = [row[0] for row in
+             cur.execute('SELECT DISTINCT spec FROM ' + table).fetchall()
+             if str(archetype).lower() in str(row[0]).lower()]
+    return ('SELECT agentid FROM ' + table + ' WHERE spec IN (' +
+            ', '.join('"' + spec + '"' for spec in specs) + ')')
+
+
+def prototype_ids(cur, prototypes, kind=None):
+    """Generates sqlite query of the agentids of prototypes
+    (case insensitive)
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    prototypes: list
+        list of prototype names
+    kind: str
+        if given, only agents of this kind, eg. 'Region'
+
+    Returns
+    -------
+    str
+        sqlite query returning an agentid column
+    """
+    query = ('SELECT agentid FROM ' + archetype_table(cur) +
+             ' WHERE prototype IN (' +
+             ', '.join('"' + str(x).lower() + '"' for x in prototypes) + ')')
+    if kind is not None:
+        query += ' AND kind = "' + kind + '"'
+    return query
+
+
 def get_inst(cur):
     """Returns prototype and agentids of institutions
 
@@ -94,6 +578,163 @@ def get_inst(cur):
                        'WHERE kind = "Inst"').fetchall()
 
 
+# agent trees of output files: key=file name,
+# value=(number of agents when built, tree from agent_tree)
+AGENT_TREES = {}
+
+
+def agent_tree(cur):
+    """Returns the region -> institution -> facility tree of the agents,
+    built from agententry.parentid once per output file
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    tree: dictionary
+        agentid: numpy array of agentids, sorted
+        parent: numpy array of the position of the parent of every agent
+        (-1 for agents without parent)
+        kind, prototype: numpy arrays of kind and prototype of every agent
+        ancestors: numpy array of positions of the ancestors of every
+        agent (depth x agents), ancestors[0] is the parent,
+        -1 above the root
+    """
+    file_name = get_file_name(cur)
+    version = cur.execute('SELECT max(rowid) FROM agententry').fetchone()[0]
+    if file_name != '' and file_name in AGENT_TREES:
+        if AGENT_TREES[file_name][0] == version:
+            return AGENT_TREES[file_name][1]
+    agents = cur.execute('SELECT agentid, parentid, kind, prototype '
+                         'FROM agententry ORDER BY agentid').fetchall()
+    agentid = np.array([agent['agentid'] for agent in agents], dtype=int)
+    parentid = np.array([agent['parentid'] if agent['parentid'] is not None
+                         else -1 for agent in agents], dtype=int)
+    parent = np.searchsorted(agentid, parentid)
+    parent[(parentid < 0) | (parent >= len(agentid))] = -1
+    parent[parent >= 0] = np.where(
+        agentid[parent[parent >= 0]] == parentid[parent >= 0],
+        parent[parent >= 0], -1)
+    ancestors = []
+    current = parent
+    while np.any(current >= 0) and len(ancestors) < len(agentid):
+        ancestors.append(current)
+        current = np.where(current >= 0, parent[current], -1)
+    ancestors = np.array(ancestors, dtype=int).reshape(-1, len(agentid))
+    tree = {'agentid': agentid,
+            'parent': parent,
+            'kind': np.array([agent['kind'] for agent in agents]),
+            'prototype': np.array([agent['prototype'] for agent in agents]),
+            'ancestors': ancestors}
+    if file_name != '':
+        AGENT_TREES[file_name] = (version, tree)
+    return tree
+
+
+def tree_position(agentid, ids):
+    """Finds ids in the sorted agentids of agent_tree
+
+    Parameters
+    ----------
+    agentid: numpy array
+        sorted agentids of the tree
+    ids: numpy array
+        agentids to find
+
+    Returns
+    -------
+    position: numpy array
+        position of every id in agentid
+
+    Raises
+    ------
+    ValueError
+        if an id is not in agentid
+    """
+    position = np.searchsorted(agentid, ids)
+    if len(agentid) == 0:
+        unknown = ids
+    else:
+        position = np.clip(position, 0, len(agentid) - 1)
+        unknown = ids[agentid[position] != ids]
+    if len(unknown) > 0:
+        raise ValueError('Agents are not in the output: ' +
+                         ', '.join(str(agent) for agent in
+                                   np.unique(unknown)))
+    return position
+
+
+def ancestor_index(tree, agent_ids, ancestor_ids):
+    """Finds, for every agent, which of ancestor_ids is the agent
+    itself or its closest ancestor
+
+    Parameters
+    ----------
+    tree: dictionary
+        tree from agent_tree
+    agent_ids: numpy array
+        agentids to look up
+    ancestor_ids: list
+        agentids of the ancestors, eg. of all institutions
+
+    Returns
+    -------
+    index: numpy array
+        position in ancestor_ids for every agent, -1 if none
+
+    Raises
+    ------
+    ValueError
+        if an agentid or ancestor id is not in the tree
+    """
+    agentid = tree['agentid']
+    ancestor_ids = np.asarray(ancestor_ids, dtype=int)
+    # position in ancestor_ids of every agent of the tree
+    lookup = np.full(len(agentid), -1)
+    lookup[tree_position(agentid, ancestor_ids)] = np.arange(
+        len(ancestor_ids))
+    position = tree_position(agentid, np.asarray(agent_ids, dtype=int))
+    index = lookup[position]
+    for level in tree['ancestors']:
+        up = level[position]
+        found = (index < 0) & (up >= 0)
+        index[found] = lookup[up[found]]
+    return index
+
+
+def rollup(tree, agent_ids, values, ancestor_ids):
+    """Sums values of agents into their ancestors
+
+    Parameters
+    ----------
+    tree: dictionary
+        tree from agent_tree
+    agent_ids: numpy array
+        agentid of every value
+    values: numpy array
+        values to sum, one row per agentid
+    ancestor_ids: list
+        agentids to sum into, eg. of all institutions
+
+    Returns
+    -------
+    sums: numpy array
+        one row per ancestor_ids
+    has_values: numpy array
+        True for ancestors with at least one value
+    """
+    values = np.asarray(values, dtype=float)
+    index = ancestor_index(tree, agent_ids, ancestor_ids)
+    sums = np.zeros((len(ancestor_ids),) + values.shape[1:])
+    np.add.at(sums, index[index >= 0], values[index >= 0])
+    has_values = np.bincount(index[index >= 0],
+                             minlength=len(ancestor_ids)) > 0
+    return sums, has_values
+
+
 def timestep_to_years(init_year, timestep):
     """Returns list of years in simulation
 
@@ -112,7 +753,7 @@ def timestep_to_years(init_year, timestep):
     return init_year + (timestep / 12)
 
 
-def exec_string(in_list, search, request_colmn):
+def exec_string(in_list, search, request_colmn, from_table=None):
     """Generates sqlite query command to select things and
         inner join resources and transactions.
 
@@ -130,6 +771,9 @@ def exec_string(in_list, search, request_colmn):
         column (set of values) that the sqlite query should return
         This variable will be inserted as sqlite
         query arugment following the SELECT keyword
+    from_table: str
+        table to select from, eg. transaction_table(cur).
+        Defaults to resources inner joined with transactions.
 
     Returns
     -------
@@ -141,9 +785,12 @@ def exec_string(in_list, search, request_colmn):
     if type(in_list[0]) == str:
         in_list = ['"' + x + '"' for x in in_list]
 
+    if from_table is None:
+        from_table = ("resources INNER JOIN transactions"
+                      " ON transactions.resourceid = resources.resourceid")
+
     query = ("SELECT " + request_colmn +
-             " FROM resources INNER JOIN transactions"
-             " ON transactions.resourceid = resources.resourceid"
+             " FROM " + from_table +
              " WHERE (" + str(search) + ' = ' + str(in_list[0])
              )
     for item in in_list[1:]:
@@ -153,99 +800,526 @@ def exec_string(in_list, search, request_colmn):
     return query
 
 
-def get_timesteps(cur):
+def time_bin(resolution):
+    """Returns the number of months in one timestep of a resolution
+
+    Parameters
+    ----------
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    width: int
+        number of months per timestep
+    """
+    widths = {'month': 1, 'quarter': 3, 'year': 12}
+    if resolution in widths:
+        return widths[resolution]
+    if isinstance(resolution, (int, np.integer)) and resolution > 0:
+        return int(resolution)
+    raise Exception('Unknown resolution ' + str(resolution))
+
+
+def time_bucket(resolution, column='time', first=0):
+    """Returns sqlite expression that turns a time column
+    into the timestep of a resolution, for SELECT and GROUP BY
+
+    Parameters
+    ----------
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    column: str
+        time column of the query
+    first: int
+        month of the first timestep, eg. timestep[0] of a time window
+
+    Returns
+    -------
+    str
+        sqlite expression
+    """
+    width = time_bin(resolution)
+    if first != 0:
+        column = '(' + column + ' - ' + str(int(first)) + ')'
+    if width == 1:
+        return column
+    return '(' + column + ' / ' + str(width) + ')'
+
+
+def time_window(cur, start=None, end=None, in_years=False):
+    """Returns the first and last month of a time window
+    of the simulation
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    start: int
+        first month of the window, or first year if in_years,
+        the start of the simulation if None
+    end: int
+        last month of the window, or last year if in_years,
+        the end of the simulation if None
+    in_years: bool
+        if True, start and end are calendar years
+
+    Returns
+    -------
+    first: int
+        first month (simulation time) of the window
+    last: int
+        last month (simulation time) of the window
+    """
+    info = cur.execute('SELECT initialyear, initialmonth, '
+                       'duration FROM info').fetchone()
+    first = 0
+    last = info['duration'] - 1
+    if in_years:
+        # month in which every year starts
+        offset = 12 * info['initialyear'] + info['initialmonth'] - 1
+        if start is not None:
+            start = 12 * start - offset
+        if end is not None:
+            end = 12 * (end + 1) - offset - 1
+    if start is not None:
+        first = max(first, int(start))
+    if end is not None:
+        last = min(last, int(end))
+    if first > last:
+        raise Exception('Time window ' + str(start) + ' - ' + str(end) +
+                        ' is outside of the simulation')
+    return first, last
+
+
+def window_condition(cur, column='time', start=None, end=None,
+                     in_years=False):
+    """Returns the sqlite condition keeping the rows of a time window
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    column: str
+        time column of the query
+    start, end, in_years:
+        time window (see time_window)
+
+    Returns
+    -------
+    str
+        sqlite condition
+    """
+    first, last = time_window(cur, start, end, in_years)
+    return column + ' BETWEEN ' + str(first) + ' AND ' + str(last)
+
+
+def get_timesteps(cur, resolution='month', start=None, end=None,
+                  in_years=False):
     """Returns simulation start year, month, duration and
     timesteps (in numpy linspace).
 
     Parameters
     ----------
-    cur: sqlite cursor
-        sqlite cursor
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+
+    Returns
+    -------
+    init_year: int
+        start year of simulation
+    init_month: int
+        start month of simulation
+    duration: int
+        number of timesteps of the resolution in the time window
+    timestep: list
+        linspace of the first month of every timestep
+    """
+    info = cur.execute('SELECT initialyear, initialmonth, '
+                       'duration FROM info').fetchone()
+    init_year = info['initialyear']
+    init_month = info['initialmonth']
+    first, last = time_window(cur, start, end, in_years)
+    width = time_bin(resolution)
+    duration = -(-(last - first + 1) // width)
+    timestep = np.linspace(first, first + (duration - 1) * width,
+                           num=duration)
+
+    return init_year, init_month, duration, timestep
+
+
+def timestep_index(timestep, times, clip_start=False):
+    """Returns the position of the timestep each time falls in
+
+    Parameters
+    ----------
+    timestep: np.array
+        evenly spaced timestep of simulation (first month of each step)
+    times: np.array
+        times (months) to look up
+    clip_start: bool
+        if True, times before the first timestep get index 0,
+        eg. for events before a time window
+
+    Returns
+    -------
+    index: np.array
+        index of the timestep of each time, -1 where the time
+        is outside of the simulation
+    """
+    times = np.asarray(times, dtype=float)
+    if len(timestep) == 0:
+        return np.full(len(times), -1, dtype=int)
+    width = timestep[1] - timestep[0] if len(timestep) > 1 else 1
+    index = np.floor((times - timestep[0]) / width).astype(int)
+    if clip_start:
+        index = np.maximum(index, 0)
+    return np.where((index >= 0) & (index < len(timestep)), index, -1)
+
+
+# column specs of fetch_array: list of (column name, numpy dtype)
+TIMESERIES_COLUMNS = [('time', np.int64), ('value', np.float64)]
+CAPACITY_COLUMNS = [('max(value)', np.float64), ('agentid', np.int64),
+                    ('parentid', np.int64), ('entertime', np.int64),
+                    ('entertime + lifetime', np.float64)]
+ENTRY_COLUMNS = [('max(value)', np.float64), ('agentid', np.int64),
+                 ('parentid', np.int64), ('entertime', np.int64)]
+EXIT_COLUMNS = [('max(value)', np.float64), ('agentid', np.int64),
+                ('parentid', np.int64), ('exittime', np.int64)]
+ISOTOPE_COLUMNS = TIMESERIES_COLUMNS + [('nucid', np.int64)]
+
+
+def fetch_array(cur, query, columns, chunk_size=65536):
+    """Executes a query and fills a numpy structured array
+    with its rows, chunk_size rows at a time, without creating
+    an sqlite3.Row object per row
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    query: str
+        sqlite query
+    columns: list
+        list of (name, numpy dtype) of the selected columns, in order.
+        NULL values are only allowed in float columns (as nan)
+    chunk_size: int
+        number of rows fetched at once
+
+    Returns
+    -------
+    array: numpy structured array
+        one record per row, fields named after columns
+    """
+    dtype = np.dtype(columns)
+    plain_cur = cur.connection.cursor()
+    plain_cur.row_factory = None
+    plain_cur.execute(query)
+    array = np.empty(chunk_size, dtype=dtype)
+    size = 0
+    while True:
+        chunk = plain_cur.fetchmany(chunk_size)
+        if len(chunk) == 0:
+            break
+        if size + len(chunk) > len(array):
+            array = np.resize(array, 2 * len(array))
+        array[size:size + len(chunk)] = np.array(chunk, dtype=dtype)
+        size += len(chunk)
+    plain_cur.close()
+    return array[:size]
+
+
+def column_values(rows, name):
+    """Returns a column of fetched rows as a numpy array
+
+    Parameters
+    ----------
+    rows: list or numpy structured array
+        list of sqlite3.Row, or array from fetch_array
+    name: str
+        name of the column
+
+    Returns
+    -------
+    numpy array
+        values of the column
+    """
+    if isinstance(rows, np.ndarray) and rows.dtype.names is not None:
+        return rows[name]
+    return np.array([row[name] for row in rows])
+
+
+def get_timeseries(in_list, duration, kg_to_tons):
+    """returns a timeseries list from in_list data.
+
+    Parameters
+    ----------
+    in_list: list or numpy structured array
+        list of data to be created into timeseries
+        list[0] = time
+        list[1] = value, quantity
+    duration: int
+        duration of the simulation
+    kg_to_tons: bool
+        if True, list returned has units of tons
+        if False, list returned as units of kilograms
+
+    Returns
+    -------
+    timeseries list of commodities stored in in_list
+    """
+    if len(in_list) == 0:
+        return []
+    value_timeseries = time_sum(in_list, duration)
+    if kg_to_tons:
+        value_timeseries = value_timeseries * 0.001
+    return value_timeseries.tolist()
+
+
+def get_timeseries_cum(in_list, duration, kg_to_tons):
+    """returns a timeseries list from in_list data.
+
+    Parameters
+    ----------
+    in_list: list or numpy structured array
+        list of data to be created into timeseries
+        list[0] = time
+        list[1] = value, quantity
+    multiplyby: int
+        integer to multiply the value in the list by for
+        unit conversion from kilograms
+    kg_to_tons: bool
+        if True, list returned has units of tons
+        if False, list returned as units of kilograms
+
+    Returns
+    -------
+    timeseries of commodities in kg or tons
+    """
+    if len(in_list) == 0:
+        return []
+    value_timeseries = np.cumsum(time_sum(in_list, duration))
+    if kg_to_tons:
+        value_timeseries = value_timeseries * 0.001
+    return value_timeseries.tolist()
+
+
+def time_sum(in_list, duration):
+    """Sums values that fall in the same timestep
+
+    Parameters
+    ----------
+    in_list: list or numpy structured array
+        list of data to be summed up
+        list[0] = time (timestep)
+        list[1] = value, quantity
+    duration: int
+        number of timesteps
+
+    Returns
+    -------
+    value_array: numpy array
+        sum of the values of every timestep
+    """
+    if isinstance(in_list, np.ndarray) and in_list.dtype.names is not None:
+        time_values = in_list[in_list.dtype.names[0]].astype(float)
+        values = in_list[in_list.dtype.names[1]].astype(float)
+    else:
+        array = np.array([(row[0], row[1]) for row in in_list], dtype=float)
+        array = array.reshape(-1, 2)
+        time_values = array[:, 0]
+        values = array[:, 1]
+    times = time_values.astype(int)
+    inside = (times >= 0) & (times < duration) & (times == time_values)
+    return np.bincount(times[inside], weights=values[inside],
+                       minlength=duration)[:duration]
+
+
+class TimeSeries(object):
+    """Values of a quantity per timestep, fetched once.
+    Cumulative, unit and resolution views are derived from them
+    when asked for, without querying the database again.
+
+    Parameters
+    ----------
+    values: numpy array
+        value of every timestep
+    timestep: numpy array
+        timestep of simulation (months)
+    units: str
+        units of values, eg. 'kg'
+    is_cum: bool
+        True if values are cumulative
+    """
+    __slots__ = ('values', 'timestep', 'units', 'is_cum', '_cumulative')
+
+    def __init__(self, values, timestep, units='kg', is_cum=False):
+        self.values = np.asarray(values, dtype=float)
+        self.timestep = np.asarray(timestep)
+        self.units = units
+        self.is_cum = is_cum
+        self._cumulative = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __repr__(self):
+        return ('TimeSeries(' + repr(self.values) + ', units=' +
+                repr(self.units) + ', is_cum=' + repr(self.is_cum) + ')')
+
+    def tolist(self):
+        """Returns the values as a list"""
+        return self.values.tolist()
+
+    def cumulative(self):
+        """Returns the cumulative TimeSeries, computed once"""
+        if self.is_cum:
+            return self
+        if self._cumulative is None:
+            self._cumulative = TimeSeries(np.cumsum(self.values),
+                                          self.timestep, self.units, True)
+        return self._cumulative
+
+    def to_tons(self):
+        """Returns the TimeSeries in tons"""
+        if self.units == 'tons':
+            return self
+        if self.units != 'kg':
+            raise Exception('Cannot convert ' + self.units + ' to tons')
+        return TimeSeries(self.values * 0.001, self.timestep, 'tons',
+                          self.is_cum)
+
+    def resample(self, resolution):
+        """Returns the TimeSeries at a coarser time resolution.
+        Values are summed over every new timestep, cumulative
+        values take the last value of every new timestep.
+
+        Parameters
+        ----------
+        resolution: str or int
+            'month', 'quarter', 'year' or number of months per timestep
+        """
+        width = time_bin(resolution)
+        if len(self.timestep) > 1 and width % (self.timestep[1] -
+                                               self.timestep[0]) != 0:
+            raise Exception('Cannot resample to ' + str(width) +
+                            ' months per timestep')
+        # timesteps are counted from the first one, like time_bucket
+        # counts them from the start of the time window
+        first = self.timestep[0]
+        index = ((self.timestep - first) // width).astype(int)
+        if self.is_cum:
+            values = np.zeros(index[-1] + 1)
+            values[index] = self.values
+        else:
+            values = np.bincount(index, weights=self.values)
+        timestep = first + np.arange(len(values)) * width
+        return TimeSeries(values, timestep, self.units, self.is_cum)
+
+    def years(self, init_year):
+        """Returns the year of every timestep
+
+        Parameters
+        ----------
+        init_year: int
+            initial year in simulation
+        """
+        return timestep_to_years(init_year, self.timestep)
+
+
+def make_timeseries(in_list, timestep, is_cum, kg_to_tons, lazy=False):
+    """Returns the timeseries of in_list data, as a list or,
+    if lazy, as a TimeSeries in kg that is not cumulative
+
+    Parameters
+    ----------
+    in_list: list or numpy structured array
+        list[0] = time
+        list[1] = value, quantity
+    timestep: numpy array
+        timestep of simulation (months)
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    kg_to_tons: bool
+        if True, list returned has units of tons
+    lazy: bool
+        if True, return a TimeSeries and ignore is_cum and kg_to_tons
 
     Returns
     -------
-    init_year: int
-        start year of simulation
-    init_month: int
-        start month of simulation
-    duration: int
-        duration of simulation
-    timestep: list
-        linspace up to duration
+    list or TimeSeries
     """
-    info = cur.execute('SELECT initialyear, initialmonth, '
-                       'duration FROM info').fetchone()
-    init_year = info['initialyear']
-    init_month = info['initialmonth']
-    duration = info['duration']
-    timestep = np.linspace(0, duration - 1, num=duration)
-
-    return init_year, init_month, duration, timestep
+    if lazy:
+        return TimeSeries(time_sum(in_list, len(timestep)), timestep)
+    if is_cum:
+        return get_timeseries_cum(in_list, len(timestep), kg_to_tons)
+    return get_timeseries(in_list, len(timestep), kg_to_tons)
 
 
-def get_timeseries(in_list, duration, kg_to_tons):
-    """returns a timeseries list from in_list data.
+def isotope_matrix(rows, duration, is_cum, kg_to_tons=True):
+    """Sums isotope masses into a float32 matrix, one row per nuclide
 
     Parameters
     ----------
-    in_list: list
-        list of data to be created into timeseries
-        list[0] = time
-        list[1] = value, quantity
+    rows: numpy structured array
+        fetched with ISOTOPE_COLUMNS (time, value, nucid)
     duration: int
-        duration of the simulation
+        number of timesteps
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
     kg_to_tons: bool
-        if True, list returned has units of tons
-        if False, list returned as units of kilograms
+        if True, matrix has units of tons
+        if False, matrix has units of kilograms
 
     Returns
     -------
-    timeseries list of commodities stored in in_list
+    labels: list
+        nuclide names of the rows of the matrix, sorted by nucid
+    matrix: numpy array
+        float32 masses (nuclides x timesteps)
     """
-    value = 0
-    value_timeseries = []
-    array = np.array(in_list)
-    if len(in_list) > 0:
-        for i in range(0, duration):
-            value = sum(array[array[:, 0] == i][:, 1])
-            if kg_to_tons:
-                value_timeseries.append(value * 0.001)
-            else:
-                value_timeseries.append(value)
-    return value_timeseries
+    nucids, index = np.unique(rows['nucid'], return_inverse=True)
+    times = rows['time']
+    inside = (times >= 0) & (times < duration)
+    matrix = np.zeros((len(nucids), duration))
+    np.add.at(matrix, (index[inside], times[inside]), rows['value'][inside])
+    if is_cum:
+        matrix = np.cumsum(matrix, axis=1)
+    if kg_to_tons:
+        matrix = matrix * 0.001
+    return [nucname.name(nucid) for nucid in nucids], \
+        matrix.astype(np.float32)
 
 
-def get_timeseries_cum(in_list, duration, kg_to_tons):
-    """returns a timeseries list from in_list data.
+def matrix_dict(labels, matrix):
+    """Returns a dictionary view of a labeled matrix.
+    The values are rows of the matrix, not copies.
 
     Parameters
     ----------
-    in_list: list
-        list of data to be created into timeseries
-        list[0] = time
-        list[1] = value, quantity
-    multiplyby: int
-        integer to multiply the value in the list by for
-        unit conversion from kilograms
-    kg_to_tons: bool
-        if True, list returned has units of tons
-        if False, list returned as units of kilograms
+    labels: list
+        labels of the rows of the matrix
+    matrix: numpy array
+        matrix (labels x timesteps)
 
     Returns
     -------
-    timeseries of commodities in kg or tons
+    dictionary with "key=label, and value=row of matrix"
     """
-    value = 0
-    value_timeseries = []
-    array = np.array(in_list)
-    if len(in_list) > 0:
-        for i in range(0, duration):
-            value += sum(array[array[:, 0] == i][:, 1])
-            if kg_to_tons:
-                value_timeseries.append(value * 0.001)
-            else:
-                value_timeseries.append(value)
-    return value_timeseries
+    return collections.OrderedDict(zip(labels, matrix))
 
 
 def get_isotope_transactions(resources, compositions):
@@ -279,7 +1353,8 @@ def get_isotope_transactions(resources, compositions):
 
 def facility_commodity_flux(cur, agent_ids,
                             commod_list, is_outflux,
-                            is_cum=True):
+                            is_cum=True, resolution='month', lazy=False,
+                            start=None, end=None, in_years=False):
     """Returns dictionary of commodity in/outflux from agents
 
     Parameters
@@ -294,6 +1369,12 @@ def facility_commodity_flux(cur, agent_ids,
         gets outflux if True, influx if False
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    lazy: bool
+        if True, returns TimeSeries in kg (see make_timeseries)
 
     Returns
     -------
@@ -301,28 +1382,30 @@ def facility_commodity_flux(cur, agent_ids,
         dictionary with "key=commodity, and
         value=timeseries list of masses in kg"
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
     commodity_dict = collections.OrderedDict()
     for comm in commod_list:
-        query = (exec_string(agent_ids, 'receiverid',
-                             'time, sum(quantity), qualid') +
+        # outflux filters senderid instead of receiverid
+        query = (exec_string(agent_ids,
+                             'senderid' if is_outflux else 'receiverid',
+                             bucket + ' AS time, sum(quantity)',
+                             transaction_table(cur)) +
                  ' and (commodity = "' + str(comm) +
-                 '") GROUP BY time')
-        # outflux changes receiverid to senderid
-        if is_outflux:
-            query = query.replace('receiverid', 'senderid')
+                 '") AND ' + window + ' GROUP BY ' + bucket)
 
-        res = cur.execute(query).fetchall()
-        if is_cum:
-            commodity_dict[comm] = get_timeseries_cum(res, duration, True)
-        else:
-            commodity_dict[comm] = get_timeseries(res, duration, True)
+        res = fetch_array(cur, query, TIMESERIES_COLUMNS)
+        commodity_dict[comm] = make_timeseries(res, timestep, is_cum, True,
+                                               lazy)
 
     return commodity_dict
 
 
 def commodity_flux_region(cur, agent_ids, commodity_list,
-                          is_outflux, is_cum=True):
+                          is_outflux, is_cum=True, resolution='month',
+                          start=None, end=None, in_years=False):
     """Returns dictionary of timeseries of all the commodity outflux,
         that is either coming in/out of the agent
         separated by region
@@ -340,6 +1423,10 @@ def commodity_flux_region(cur, agent_ids, commodity_list,
         gets influx to agent if False
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     -------
@@ -347,41 +1434,50 @@ def commodity_flux_region(cur, agent_ids, commodity_list,
         dictionary with "key=region, and
         value= timeseries list of masses in kg"
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
     commodity_dict = collections.OrderedDict()
     commodity_list = ['"' + x + '"' for x in commodity_list]
-    query = ('SELECT time, sum(quantity), parentid '
-             'FROM transactions '
-             'INNER JOIN resources '
-             'ON resources.resourceid = '
-             'transactions.resourceid '
-             'INNER JOIN agententry '
-             'ON agententry.agentid = transactions.SENDERID '
-             'WHERE (commodity = ' +
-             ' OR commodity = '.join(commodity_list) + ') AND ('
-             'receiverid = ' +
-             ' OR receiverid = '.join(agent_ids) + ') GROUP BY '
-             'time, parentid')
+    # flux is summed by the institution of the other agent
+    agent, other = 'receiverid', 'senderid'
     if is_outflux:
-        query = query.replace('receiverid', 'senderid')
-        query = query.replace('SENDERID', 'RECEIVERID')
-    resources = cur.execute(query).fetchall()
-    govs = cur.execute('SELECT agentid, prototype FROM agententry '
-                       'WHERE kind = "Inst"').fetchall()
-    for gov in govs:
-        from_gov = [(x['time'], x['sum(quantity)'])
-                    for x in resources if x['parentid'] == gov['agentid']]
-        if is_cum:
-            commodity_dict[gov['prototype']] = get_timeseries_cum(
-                from_gov, duration, True)
+        agent, other = other, agent
+    flux = fetch_array(cur, 'SELECT ' + other + ', ' + bucket +
+                       ' AS time, sum(quantity) '
+                       'FROM ' + transaction_table(cur) +
+                       ' WHERE commodity IN (' + ', '.join(commodity_list) +
+                       ') AND ' + agent + ' IN (' + ', '.join(agent_ids) +
+                       ') AND ' + window +
+                       ' GROUP BY ' + other + ', ' + bucket,
+                       [('agentid', np.int64)] + TIMESERIES_COLUMNS)
+    inside = (flux['time'] >= 0) & (flux['time'] < duration)
+    flux = flux[inside]
+    govs = get_inst(cur)
+    index = ancestor_index(agent_tree(cur), flux['agentid'],
+                           [gov['agentid'] for gov in govs])
+    found = index >= 0
+    sums = np.zeros((len(govs), duration))
+    np.add.at(sums, (index[found], flux['time'][found]),
+              flux['value'][found])
+    has_values = np.bincount(index[found], minlength=len(govs)) > 0
+    for gov, values, has_flux in zip(govs, sums, has_values):
+        if not has_flux:
+            commodity_dict[gov['prototype']] = []
+        elif is_cum:
+            commodity_dict[gov['prototype']] = (np.cumsum(values) *
+                                                0.001).tolist()
         else:
-            commodity_dict[gov['prototype']] = get_timeseries(
-                from_gov, duration, True)
+            commodity_dict[gov['prototype']] = (values * 0.001).tolist()
     return commodity_dict
 
 
 def facility_commodity_flux_isotopics(cur, agent_ids,
-                                      commod_list, is_outflux, is_cum=True):
+                                      commod_list, is_outflux, is_cum=True,
+                                      resolution='month', compact=False,
+                                      nuclides=None,
+                                      start=None, end=None, in_years=False):
     """Returns timeseries isotoptics of commodity in/outflux
     from agents
 
@@ -397,6 +1493,16 @@ def facility_commodity_flux_isotopics(cur, agent_ids,
         gets outflux if True, influx if False
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    compact: bool
+        if True, the timeseries are float32 rows of one
+        nuclide x timestep matrix (see isotope_matrix)
+    nuclides: list
+        if given, only these nuclides, elements or groups
+        (see nuclide_condition)
 
     Returns
     -------
@@ -404,25 +1510,24 @@ def facility_commodity_flux_isotopics(cur, agent_ids,
         dictionary with "key=isotope, and
         value=timeseries list of masses in kg"
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
     iso_dict = collections.defaultdict(list)
-    for comm in commod_list:
-        query = ('SELECT time, sum(quantity)*massfrac, nucid '
-                 'FROM transactions INNER JOIN resources '
-                 'ON resources.resourceid = transactions.resourceid '
-                 'LEFT OUTER JOIN compositions '
-                 'ON compositions.qualid = resources.qualid '
-                 'WHERE (receiverid = ' +
-                 ' OR receiverid = '.join(agent_ids) +
-                 ') AND (commodity = "' + str(comm) +
-                 '") GROUP BY time, nucid')
-        # outflux changes receiverid to senderid
-        if is_outflux:
-            query = query.replace('receiverid', 'senderid')
-
-        res = cur.execute(query).fetchall()
-        for time, amount, nucid in res:
-            iso_dict[nucname.name(nucid)].append((time, amount))
+    # outflux filters senderid instead of receiverid
+    agent = 'senderid' if is_outflux else 'receiverid'
+    query = isotope_query(cur, bucket,
+                          agent + ' IN (' + ', '.join(agent_ids) + ') '
+                          'AND commodity IN ("' +
+                          '", "'.join(str(comm) for comm in commod_list) +
+                          '") AND ' + window, nuclides)
+    if compact:
+        return matrix_dict(*isotope_matrix(
+            fetch_array(cur, query, ISOTOPE_COLUMNS), duration, is_cum))
+    res = cur.execute(query).fetchall()
+    for time, amount, nucid in res:
+        iso_dict[nucname.name(nucid)].append((time, amount))
     for key in iso_dict:
         if is_cum:
             iso_dict[key] = get_timeseries_cum(iso_dict[key], duration, True)
@@ -431,7 +1536,8 @@ def facility_commodity_flux_isotopics(cur, agent_ids,
     return iso_dict
 
 
-def get_stockpile(cur, facility, is_cum=True):
+def get_stockpile(cur, facility, is_cum=True, resolution='month',
+                  lazy=False, start=None, end=None, in_years=False):
     """gets inventory timeseries in a fuel facility
 
     Parameters
@@ -442,6 +1548,12 @@ def get_stockpile(cur, facility, is_cum=True):
         name of facility
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    lazy: bool
+        if True, returns TimeSeries in kg (see make_timeseries)
 
     Returns
     -------
@@ -451,20 +1563,24 @@ def get_stockpile(cur, facility, is_cum=True):
     """
     pile_dict = collections.OrderedDict()
     agentid = get_agent_ids(cur, facility)
-    query = exec_string(agentid, 'agentid', 'timecreated, quantity, qualid')
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    query = exec_string(agentid, 'agentid',
+                        time_bucket(resolution, 'timecreated',
+                                    timestep[0]) +
+                        ' AS timecreated, quantity')
     query = query.replace('transactions', 'agentstateinventories')
-    stockpile = cur.execute(query).fetchall()
-    init_year, init_month, duration, timestep = get_timesteps(cur)
-    if is_cum:
-        stock_timeseries = get_timeseries_cum(stockpile, duration, True)
-    else:
-        stock_timeseries = get_timeseries(stockpile, duration, True)
-    pile_dict[facility] = stock_timeseries
+    query += ' AND ' + window_condition(cur, 'timecreated', start, end,
+                                        in_years)
+    stockpile = fetch_array(cur, query, TIMESERIES_COLUMNS)
+    pile_dict[facility] = make_timeseries(stockpile, timestep, is_cum, True,
+                                          lazy)
 
     return pile_dict
 
 
-def get_swu_dict(cur, is_cum=True):
+def get_swu_dict(cur, is_cum=True, resolution='month',
+                 start=None, end=None, in_years=False):
     """returns dictionary of swu timeseries for each enrichment plant
 
     Parameters
@@ -473,6 +1589,10 @@ def get_swu_dict(cur, is_cum=True):
         sqlite cursor
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     -------
@@ -481,29 +1601,88 @@ def get_swu_dict(cur, is_cum=True):
         value=swu timeseries list"
     """
     swu_dict = collections.OrderedDict()
-    agentid = get_agent_ids(cur, 'Enrichment')
-    init_year, init_month, duration, timestep = get_timesteps(cur)
-    for num in agentid:
-        swu_data = cur.execute('SELECT time, value '
-                               'FROM timeseriesenrichmentswu '
-                               'WHERE agentid = ' + str(num)).fetchall()
-        if is_cum:
-            swu_timeseries = get_timeseries_cum(swu_data, duration, False)
-        else:
-            swu_timeseries = get_timeseries(swu_data, duration, False)
-
-        swu_dict['Enrichment_' + str(num)] = swu_timeseries
+    agentid, swu_matrix = get_swu_matrix(cur, is_cum=is_cum,
+                                         resolution=resolution,
+                                         start=start, end=end,
+                                         in_years=in_years)
+    for num, swu_timeseries in zip(agentid, swu_matrix):
+        swu_dict['Enrichment_' + str(num)] = swu_timeseries.tolist()
 
     return swu_dict
 
 
-def get_power_dict(cur):
+def get_swu_matrix(cur, with_feed=False, is_cum=True, resolution='month',
+                   start=None, end=None, in_years=False):
+    """returns swu timeseries of all enrichment plants as one matrix,
+    from a single grouped query
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    with_feed: bool
+        if True, also returns the matching matrix of natural
+        uranium feed from timeseriesenrichmentfeed
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+
+    Returns
+    -------
+    agentid: list
+        agentids of enrichment plants (rows of the matrices)
+    swu_matrix: numpy array
+        swu timeseries (enrichment plants x timesteps)
+    feed_matrix: numpy array
+        only if with_feed, feed timeseries [tons]
+        (enrichment plants x timesteps)
+    """
+    agentid = get_agent_ids(cur, 'Enrichment')
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    tables = ['timeseriesenrichmentswu']
+    if with_feed:
+        tables.append('timeseriesenrichmentfeed')
+    row_index = dict((int(num), i) for i, num in enumerate(agentid))
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
+    matrices = []
+    for table in tables:
+        data = fetch_array(cur, 'SELECT agentid, ' + bucket +
+                           ' AS time, sum(value) FROM ' + table +
+                           ' WHERE ' + window +
+                           ' GROUP BY agentid, ' + bucket,
+                           [('agentid', np.int64)] + TIMESERIES_COLUMNS)
+        rows = np.array([row_index.get(num, -1) for num in
+                         data['agentid'].tolist()], dtype=int)
+        times = data['time']
+        inside = (rows >= 0) & (times >= 0) & (times < duration)
+        matrix = np.zeros((len(agentid), duration))
+        np.add.at(matrix, (rows[inside], times[inside]),
+                  data['value'][inside])
+        if is_cum:
+            matrix = np.cumsum(matrix, axis=1)
+        matrices.append(matrix)
+    if with_feed:
+        return agentid, matrices[0], matrices[1] * 0.001
+    return agentid, matrices[0]
+
+
+def get_power_dict(cur, resolution='month',
+                   start=None, end=None, in_years=False):
     """Gets dictionary of power capacity by calling capacity_calc
 
     Parameters
     ----------
     cur: sqlite cursor
         sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     ------
@@ -511,48 +1690,71 @@ def get_power_dict(cur):
         "dictionary with key=government, and
         value=timeseries list of installed capacity"
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    first, last = time_window(cur, start, end, in_years)
     governments = get_inst(cur)
 
     # get power cap values
-    entry_exit = cur.execute('SELECT max(value), timeseriespower.agentid, '
-                             'parentid, entertime, entertime + lifetime'
-                             ' FROM agententry '
-                             'INNER JOIN timeseriespower '
-                             'ON agententry.agentid = timeseriespower.agentid '
-                             'GROUP BY timeseriespower.agentid').fetchall()
+    entry_exit = fetch_array(cur, 'SELECT maxpower, agentid, parentid, '
+                             'entertime, entertime + lifetime '
+                             'FROM ' + power_summary(cur) +
+                             ' WHERE entertime <= ' + str(last),
+                             CAPACITY_COLUMNS)
 
     return capacity_calc(governments, timestep, entry_exit)
 
 
-def get_power_dict_of_region(cur, region_name):
-    """Gets dictionary of power capacity of a specific region
+def get_power_dict_of_region(cur, region_names, resolution='month',
+                             start=None, end=None, in_years=False):
+    """Gets dictionary of power capacity of the institutions
+    in one or more regions by calling capacity_calc
 
     Parameters
     ----------
     cur: sqlite cursor
-    region_name: str
-        name of region to serach for
+        sqlite cursor
+    region_names: str or list
+        name (prototype) of region, or list of names of regions,
+        to search for
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     -------
     power_dict: dictionary
-        "dictionary with key=government and
+        "dictionary with key=government, and
         value=timeseries list of installed capacity"
+        only the governments in the given regions are included
     """
-    parentid = cur.exectue('SELECT agentid FROM agententry WHERE '
-                           'Prototype LIKE "%' + region_name + '%" '
-                           'AND Kind = "Inst"').fetchone()
+    if isinstance(region_names, str):
+        region_names = [region_names]
+    if len(region_names) == 0:
+        raise Exception('Cannot get power of an empty list of regions')
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    first, last = time_window(cur, start, end, in_years)
+    inst_query = ('SELECT agentid FROM agententry '
+                  'WHERE kind = "Inst" AND parentid IN (' +
+                  prototype_ids(cur, region_names, 'Region') + ')')
+    governments = cur.execute('SELECT prototype, agentid FROM agententry '
+                              'WHERE agentid IN (' + inst_query +
+                              ')').fetchall()
+
+    entry_exit = fetch_array(cur, 'SELECT maxpower, agentid, parentid, '
+                             'entertime, entertime + lifetime '
+                             'FROM ' + power_summary(cur) +
+                             ' WHERE entertime <= ' + str(last) +
+                             ' AND parentid IN (' + inst_query + ')',
+                             CAPACITY_COLUMNS)
+
+    return capacity_calc(governments, timestep, entry_exit)
 
-    entry_exit = cur.execute('SELECT max(value), timeseriespower.agentid, '
-                             'parentid, entrytime, entertime + lifetime'
-                             ' FROM agententry '
-                             'INNER JOIN timeseriespower '
-                             'ON agententry.agentid = timeseriespower.agentid '
-                             'GROUP BY timeseriespower.agentid '
-                             'WHERE parentid = %i' %parentid[0]).fetchall()
 
-def get_deployment_dict(cur):
+def get_deployment_dict(cur, resolution='month',
+                        start=None, end=None, in_years=False):
     """Gets dictionary of reactors deployed over time
     by calling reactor_deployments
 
@@ -560,6 +1762,10 @@ def get_deployment_dict(cur):
     ----------
     cur: sqlite cursor
         sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     ------
@@ -567,27 +1773,195 @@ def get_deployment_dict(cur):
         "dictionary with key=government, and
         value=timeseries list of number of reactors"
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    first, last = time_window(cur, start, end, in_years)
     governments = get_inst(cur)
 
     # get power cap values
-    entry = cur.execute('SELECT max(value), timeseriespower.agentid, '
-                        'parentid, entertime FROM agententry '
-                        'INNER JOIN timeseriespower '
-                        'ON agententry.agentid = timeseriespower.agentid '
-                        'GROUP BY timeseriespower.agentid').fetchall()
-
-    exit_step = cur.execute('SELECT max(value), timeseriespower.agentid, '
-                            'parentid, exittime FROM agentexit '
-                            'INNER JOIN timeseriespower '
-                            'ON agentexit.agentid = timeseriespower.agentid'
-                            ' INNER JOIN agententry '
-                            'ON agentexit.agentid = agententry.agentid '
-                            'GROUP BY timeseriespower.agentid').fetchall()
+    summary = power_summary(cur)
+    entry = fetch_array(cur, 'SELECT maxpower, agentid, parentid, '
+                        'entertime FROM ' + summary +
+                        ' WHERE entertime <= ' + str(last), ENTRY_COLUMNS)
+
+    exit_step = fetch_array(cur, 'SELECT maxpower, agentid, parentid, '
+                            'exittime FROM ' + summary +
+                            ' WHERE exittime <= ' + str(last),
+                            EXIT_COLUMNS)
     return reactor_deployments(governments, timestep, entry, exit_step)
 
 
-def fuel_usage_timeseries(cur, fuel_list, is_cum=True):
+def power_summary(cur):
+    """Returns the table with the power summary of every agent
+    that has produced power, building it if needed.
+
+    The sidecar table is used if the sidecar file is attached,
+    otherwise the summary is built once per connection into a
+    temporary table with a single scan of timeseriespower.
+
+    agentpowersummary table has the following format:
+        AgentId / ParentId / Prototype / Spec / EnterTime / Lifetime /
+        ExitTime / MaxPower / FirstPowerTime / LastPowerTime
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    str
+        name of the summary table (with schema)
+    """
+    if has_table(cur, 'agentpowersummary', 'sidecar'):
+        return 'sidecar.agentpowersummary'
+    if not has_table(cur, 'agentpowersummary', 'temp'):
+        cur.execute('CREATE TEMP TABLE agentpowersummary AS ' +
+                    power_summary_query())
+    return 'temp.agentpowersummary'
+
+
+def power_summary_query():
+    """Generates sqlite query that summarizes the power of every agent
+
+    Returns
+    -------
+    str
+        sqlite query command.
+    """
+    return ('SELECT agententry.agentid AS agentid, parentid, prototype, '
+            'spec, entertime, lifetime, exittime, maxpower, '
+            'firstpowertime, lastpowertime FROM agententry '
+            'INNER JOIN (SELECT agentid, max(value) AS maxpower, '
+            'min(time) AS firstpowertime, max(time) AS lastpowertime '
+            'FROM timeseriespower GROUP BY agentid) AS power '
+            'ON agententry.agentid = power.agentid '
+            'LEFT OUTER JOIN agentexit '
+            'ON agententry.agentid = agentexit.agentid')
+
+
+def build_sidecar(file_name):
+    """Writes the sidecar file of an output file, which holds
+    pre-aggregated tables the analysis functions use instead
+    of the output tables:
+
+    agentpowersummary: power summary of every agent (see power_summary)
+    qualidmap: QualId / CanonId, canonical composition of every qualid
+    canoncompositions: QualId / NucId / MassFrac of canonical compositions
+    commodityflow: Commodity / SenderId / ReceiverId / Time / QualId /
+        Quantity, total quantity traded, with canonical qualids
+    agentarchetypes: normalized archetype of every agent
+        (see archetype_table)
+    sidecarinfo: Fingerprint of the output the sidecar was built from
+        (see output_fingerprint), a sidecar that does not match
+        the output is not attached
+
+    transactions and resources are read in a single scan.
+
+    Parameters
+    ----------
+    file_name: str
+        name of the sqlite file
+
+    Returns
+    -------
+    str
+        name of the sidecar file
+    """
+    sidecar_file = sidecar_name(file_name)
+    if os.path.isfile(sidecar_file):
+        os.remove(sidecar_file)
+    con = lite.connect(file_name)
+    con.execute('ATTACH DATABASE "' + sidecar_file + '" AS sidecar')
+    with con:
+        con.execute('CREATE TABLE sidecar.agentpowersummary AS ' +
+                    power_summary_query())
+        con.execute('CREATE INDEX sidecar.agentpowersummary_parentid '
+                    'ON agentpowersummary (parentid)')
+
+        qualid_map, compositions = canonical_compositions(con.cursor())
+        con.execute('CREATE TABLE sidecar.qualidmap '
+                    '(qualid INTEGER PRIMARY KEY, canonid INTEGER)')
+        con.executemany('INSERT INTO sidecar.qualidmap VALUES (?, ?)',
+                        qualid_map)
+        con.execute('CREATE TABLE sidecar.canoncompositions '
+                    '(qualid INTEGER, nucid INTEGER, massfrac REAL)')
+        con.executemany('INSERT INTO sidecar.canoncompositions '
+                        'VALUES (?, ?, ?)', compositions)
+        con.execute('CREATE INDEX sidecar.canoncompositions_qualid '
+                    'ON canoncompositions (qualid, nucid)')
+
+        con.execute('CREATE TABLE sidecar.commodityflow AS '
+                    'SELECT commodity, senderid, receiverid, time, '
+                    'coalesce(canonid, resources.qualid) AS qualid, '
+                    'sum(quantity) AS quantity '
+                    'FROM transactions INNER JOIN resources '
+                    'ON transactions.resourceid = resources.resourceid '
+                    'LEFT OUTER JOIN sidecar.qualidmap '
+                    'ON qualidmap.qualid = resources.qualid '
+                    'GROUP BY commodity, senderid, receiverid, time, '
+                    'coalesce(canonid, resources.qualid)')
+        for column in ['commodity, time', 'senderid', 'receiverid']:
+            con.execute('CREATE INDEX sidecar.commodityflow_' +
+                        column.replace(', ', '_') +
+                        ' ON commodityflow (' + column + ')')
+
+        con.execute('CREATE TABLE sidecar.agentarchetypes ' +
+                    ARCHETYPE_SCHEMA)
+        con.executemany('INSERT INTO sidecar.agentarchetypes '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        agent_archetypes(con.cursor()))
+        for column in ARCHETYPE_INDEXES:
+            con.execute('CREATE INDEX sidecar.agentarchetypes_' +
+                        column.split(',')[0] +
+                        ' ON agentarchetypes (' + column + ')')
+
+        con.execute('CREATE TABLE sidecar.sidecarinfo (fingerprint TEXT)')
+        con.execute('INSERT INTO sidecar.sidecarinfo VALUES (?)',
+                    (output_fingerprint(con.cursor()),))
+    con.close()
+    return sidecar_file
+
+
+def canonical_compositions(cur):
+    """Maps every qualid to the first qualid with a numerically
+    identical composition
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    qualid_map: list
+        list of (qualid, canonical qualid) tuples
+    compositions: list
+        list of (canonical qualid, nucid, massfrac) tuples
+        of the canonical compositions
+    """
+    rows = cur.execute('SELECT qualid, nucid, massfrac FROM compositions '
+                       'ORDER BY qualid, nucid').fetchall()
+    canon_ids = {}
+    qualid_map = []
+    compositions = []
+    start = 0
+    for i in range(1, len(rows) + 1):
+        if i < len(rows) and rows[i][0] == rows[start][0]:
+            continue
+        qualid = rows[start][0]
+        vector = tuple((row[1], row[2]) for row in rows[start:i])
+        canon_id = canon_ids.setdefault(vector, qualid)
+        qualid_map.append((qualid, canon_id))
+        if canon_id == qualid:
+            compositions.extend((qualid, nucid, massfrac)
+                                for nucid, massfrac in vector)
+        start = i
+    return qualid_map, compositions
+
+
+def fuel_usage_timeseries(cur, fuel_list, is_cum=True, resolution='month',
+                          lazy=False, start=None, end=None, in_years=False):
     """Calculates total fuel usage over time
 
     Parameters
@@ -599,6 +1973,12 @@ def fuel_usage_timeseries(cur, fuel_list, is_cum=True):
         to consider in fuel usage.
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    lazy: bool
+        if True, returns TimeSeries in kg (see make_timeseries)
 
     Returns
     -------
@@ -607,20 +1987,22 @@ def fuel_usage_timeseries(cur, fuel_list, is_cum=True):
         value=timeseries list of fuel amount [kg]"
     """
     fuel_dict = collections.OrderedDict()
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
     for fuel in fuel_list:
         temp_list = [fuel]
-        fuel_quantity = cur.execute(exec_string(temp_list, 'commodity',
-                                                'time, sum(quantity)') +
-                                    ' GROUP BY time').fetchall()
+        fuel_quantity = fetch_array(cur, exec_string(temp_list, 'commodity',
+                                                     bucket + ' AS time, '
+                                                     'sum(quantity)',
+                                                     transaction_table(cur)) +
+                                    ' AND ' + window +
+                                    ' GROUP BY ' + bucket, TIMESERIES_COLUMNS)
         quantity_timeseries = []
         try:
-            if is_cum:
-                quantity_timeseries = get_timeseries_cum(
-                    fuel_quantity, duration, True)
-            else:
-                quantity_timeseries = get_timeseries(
-                    fuel_quantity, duration, True)
+            quantity_timeseries = make_timeseries(
+                fuel_quantity, timestep, is_cum, True, lazy)
             fuel_dict[fuel] = quantity_timeseries
         except:
             print(str(fuel) + ' has not been used.')
@@ -628,7 +2010,8 @@ def fuel_usage_timeseries(cur, fuel_list, is_cum=True):
     return fuel_dict
 
 
-def nat_u_timeseries(cur, is_cum=True):
+def nat_u_timeseries(cur, is_cum=True, resolution='month', lazy=False,
+                     start=None, end=None, in_years=False):
     """Finds natural uranium supply from source
         Since currently the source supplies all its capacity,
         the timeseriesenrichmentfeed is used.
@@ -639,6 +2022,12 @@ def nat_u_timeseries(cur, is_cum=True):
         sqlite cursor
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    lazy: bool
+        if True, returns TimeSeries in kg (see make_timeseries)
 
     Returns
     -------
@@ -646,21 +2035,24 @@ def nat_u_timeseries(cur, is_cum=True):
         calls a function that returns timeseries list of natural U
         demand from enrichment [MTHM]
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
 
     # Get Nat U feed to enrichment from timeseriesenrichmentfeed
-    feed = cur.execute('SELECT time, sum(value) '
+    feed = fetch_array(cur, 'SELECT ' + bucket + ' AS time, sum(value) '
                        'FROM timeseriesenrichmentfeed '
-                       'GROUP BY time').fetchall()
-    if is_cum:
-        return get_timeseries_cum(feed, duration, True)
-    else:
-        return get_timeseries(feed, duration, True)
+                       'WHERE ' + window +
+                       ' GROUP BY ' + bucket, TIMESERIES_COLUMNS)
+    return make_timeseries(feed, timestep, is_cum, True, lazy)
 
 
 def get_trade_dict(cur, sender, receiver,
                    is_prototype, do_isotopic,
-                   is_cum=True):
+                   is_cum=True, resolution='month', compact=False,
+                   lazy=False, nuclides=None,
+                   start=None, end=None, in_years=False):
     """Returns trade timeseries between two prototypes' or facilities
     with or without isotopics
 
@@ -679,6 +2071,18 @@ def get_trade_dict(cur, sender, receiver,
         if True, perform isotopics (takes significantly longer)
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    lazy: bool
+        if True, returns TimeSeries in kg (see make_timeseries)
+    compact: bool
+        if True and do_isotopic, the timeseries are float32 rows
+        of one nuclide x timestep matrix (see isotope_matrix)
+    nuclides: list
+        if given and do_isotopic, only these nuclides, elements
+        or groups (see nuclide_condition)
 
     Returns:
     --------
@@ -694,7 +2098,10 @@ def get_trade_dict(cur, sender, receiver,
                         between two prototypes"
 
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
     iso_dict = collections.defaultdict(list)
     return_dict = collections.defaultdict()
 
@@ -706,26 +2113,25 @@ def get_trade_dict(cur, sender, receiver,
         receiver_id = get_agent_ids(cur, receiver)
 
     if do_isotopic:
-        trade = cur.execute('SELECT time, sum(quantity)*massfrac, nucid '
-                            'FROM transactions INNER JOIN resources ON '
-                            'resources.resourceid = transactions.resourceid '
-                            'LEFT OUTER JOIN compositions '
-                            'ON compositions.qualid = resources.qualid '
-                            'WHERE (senderid = ' +
-                            ' OR senderid = '.join(sender_id) +
-                            ') AND (receiverid = ' +
-                            ' OR receiverid = '.join(receiver_id) +
-                            ') GROUP BY time, nucid').fetchall()
+        query = isotope_query(cur, bucket,
+                              'senderid IN (' + ', '.join(sender_id) +
+                              ') AND receiverid IN (' +
+                              ', '.join(receiver_id) + ') AND ' +
+                              window, nuclides)
+        if compact:
+            return matrix_dict(*isotope_matrix(
+                fetch_array(cur, query, ISOTOPE_COLUMNS), duration, is_cum))
+        trade = cur.execute(query).fetchall()
     else:
-        trade = cur.execute('SELECT time, sum(quantity), qualid '
-                            'FROM transactions INNER JOIN resources ON '
-                            'resources.resourceid = transactions.resourceid'
+        trade = cur.execute('SELECT ' + bucket + ' AS time, '
+                            'sum(quantity), qualid '
+                            'FROM ' + transaction_table(cur) +
                             ' WHERE (senderid = ' +
                             ' OR senderid = '.join(sender_id) +
                             ') AND (receiverid = ' +
                             ' OR receiverid = '.join(receiver_id) +
-                            ') GROUP BY time').fetchall(
-        )
+                            ') AND ' + window +
+                            ' GROUP BY ' + bucket).fetchall()
     if do_isotopic:
         for time, amount, nucid in trade:
             iso_dict[nucname.name(nucid)].append((time, amount))
@@ -738,10 +2144,8 @@ def get_trade_dict(cur, sender, receiver,
         return iso_dict
     else:
         key_name = str(sender)[:5] + ' to ' + str(receiver)[:5]
-        if is_cum:
-            return_dict[key_name] = get_timeseries_cum(trade, duration, True)
-        else:
-            return_dict[key_name] = get_timeseries(trade, duration, True)
+        return_dict[key_name] = make_timeseries(trade, timestep, is_cum,
+                                                True, lazy)
         return return_dict
 
 
@@ -798,7 +2202,197 @@ def final_stockpile(cur, facility):
     return outstring
 
 
-def fuel_into_reactors(cur, is_cum=True):
+def mass_balance(cur, resolution='month',
+                 start=None, end=None, in_years=False):
+    """Returns the inflow, outflow and net balance of every agent
+    for every timestep, from one grouped pass over the traded material
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+
+    Returns
+    -------
+    balance: dictionary
+        agentid: numpy array of agentids, sorted
+        prototype: numpy array of the prototype of every agent
+        inflow, outflow, net: numpy arrays of masses [kg]
+        (agents x timesteps)
+        first, last: first and last month of the time window
+    """
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    first, last = time_window(cur, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
+    agents = cur.execute('SELECT agentid, prototype FROM agententry '
+                         'ORDER BY agentid').fetchall()
+    agentid = np.array([agent['agentid'] for agent in agents], dtype=int)
+    flows = fetch_array(cur, 'SELECT senderid, receiverid, ' + bucket +
+                        ' AS time, sum(quantity) '
+                        'FROM ' + transaction_table(cur) +
+                        ' WHERE ' + window +
+                        ' GROUP BY senderid, receiverid, ' + bucket,
+                        [('senderid', np.int64), ('receiverid', np.int64)] +
+                        TIMESERIES_COLUMNS)
+    inside = (flows['time'] >= 0) & (flows['time'] < duration)
+    flows = flows[inside]
+    inflow = np.zeros((len(agentid), duration))
+    outflow = np.zeros((len(agentid), duration))
+    np.add.at(inflow, (np.searchsorted(agentid, flows['receiverid']),
+                       flows['time']), flows['value'])
+    np.add.at(outflow, (np.searchsorted(agentid, flows['senderid']),
+                        flows['time']), flows['value'])
+    balance = collections.OrderedDict()
+    balance['agentid'] = agentid
+    balance['prototype'] = np.array([agent['prototype'] for agent in agents])
+    balance['inflow'] = inflow
+    balance['outflow'] = outflow
+    balance['net'] = inflow - outflow
+    balance['first'] = first
+    balance['last'] = last
+    return balance
+
+
+def prototype_balance(balance):
+    """Sums the mass balance of agents by prototype
+
+    Parameters
+    ----------
+    balance: dictionary
+        mass balance from mass_balance
+
+    Returns
+    -------
+    proto_dict: dictionary
+        "dictionary with key=prototype, and value=dictionary
+        with inflow, outflow and net timeseries [kg]"
+    """
+    prototypes, index = np.unique(balance['prototype'], return_inverse=True)
+    proto_dict = collections.OrderedDict()
+    sums = {}
+    for key in ['inflow', 'outflow', 'net']:
+        sums[key] = np.zeros((len(prototypes), balance[key].shape[1]))
+        np.add.at(sums[key], index, balance[key])
+    for i, prototype in enumerate(prototypes):
+        proto_dict[prototype] = collections.OrderedDict(
+            (key, sums[key][i]) for key in ['inflow', 'outflow', 'net'])
+    return proto_dict
+
+
+def inventory_violations(cur, balance, rtol=1e-6, atol=1e-3,
+                         resolution='month'):
+    """Compares the inventories recorded in agentstateinventories
+    with the cumulative net balance of the agents
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    balance: dictionary
+        mass balance from mass_balance, with the same resolution.
+        It must start at the first month of the simulation, as the
+        inventories include what was traded before its window.
+        At a coarser resolution than month, only the inventories
+        recorded in the last month of every timestep are checked.
+    rtol: float
+        relative tolerance
+    atol: float
+        absolute tolerance [kg]
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    violations: list
+        list of (agentid, prototype, simtime, inventory, cumulative net)
+        of every inventory that does not match the balance
+    """
+    if not has_table(cur, 'agentstateinventories'):
+        raise Exception('Output has no agentstateinventories table, '
+                        'run Cyclus with explicit_inventory on')
+    if balance['first'] != 0:
+        raise Exception('Inventories can only be checked against a mass '
+                        'balance starting at the first month')
+    width = time_bin(resolution)
+    # inventories after the window have trades the balance is missing,
+    # except the one recorded at the end of the simulation
+    duration = cur.execute('SELECT duration FROM info').fetchone()[0]
+    last = balance['last'] if balance['last'] < duration - 1 else duration
+    # an inventory recorded partway through a timestep misses the
+    # trades of the rest of it, so only timestep ends are compared
+    ends = ('((simtime + 1) % ' + str(width) + ' = 0 OR simtime >= ' +
+            str(min(balance['last'], duration - 1)) + ')')
+    inventories = fetch_array(cur, 'SELECT agentstateinventories.agentid, '
+                              'simtime, sum(quantity) '
+                              'FROM agentstateinventories '
+                              'INNER JOIN resources ON resources.resourceid '
+                              '= agentstateinventories.resourceid '
+                              'WHERE simtime <= ' + str(last) +
+                              ' AND ' + ends +
+                              ' GROUP BY agentstateinventories.agentid, '
+                              'simtime',
+                              [('agentid', np.int64), ('simtime', np.int64),
+                               ('value', np.float64)])
+    cum_net = np.cumsum(balance['net'], axis=1)
+    rows = np.searchsorted(balance['agentid'], inventories['agentid'])
+    # inventories are recorded after the trades of their timestep
+    times = np.clip(inventories['simtime'] // width, 0, cum_net.shape[1] - 1)
+    expected = cum_net[rows, times]
+    inventory = inventories['value']
+    with np.errstate(invalid='ignore'):
+        wrong = ~np.isclose(inventory, expected, rtol=rtol, atol=atol)
+    violations = []
+    for i in np.nonzero(wrong)[0]:
+        violations.append((int(inventories['agentid'][i]),
+                           str(balance['prototype'][rows[i]]),
+                           int(inventories['simtime'][i]),
+                           float(inventory[i]), float(expected[i])))
+    return violations
+
+
+def audit(cur, resolution='month'):
+    """Prints the mass balance of every prototype and the inventories
+    that do not match it
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    violations: list
+        list from inventory_violations, empty if the output
+        has no inventories
+    """
+    balance = mass_balance(cur, resolution)
+    for prototype, flows in prototype_balance(balance).items():
+        print(prototype + ': in ' + str(flows['inflow'].sum()) +
+              ' kg, out ' + str(flows['outflow'].sum()) +
+              ' kg, net ' + str(flows['net'].sum()) + ' kg')
+    # Cyclus only records inventories with explicit_inventory on
+    if not has_table(cur, 'agentstateinventories'):
+        print('Inventories are not checked: output has no '
+              'agentstateinventories table')
+        return []
+    violations = inventory_violations(cur, balance, resolution=resolution)
+    for agent, prototype, simtime, inventory, expected in violations:
+        print('Agent ' + str(agent) + ' (' + prototype + ') holds ' +
+              str(inventory) + ' kg at time ' + str(simtime) +
+              ', balance is ' + str(expected) + ' kg')
+    return violations
+
+
+def fuel_into_reactors(cur, is_cum=True, resolution='month', lazy=False,
+                       start=None, end=None, in_years=False):
     """Finds timeseries of mass of fuel received by reactors
 
     Parameters
@@ -807,33 +2401,40 @@ def fuel_into_reactors(cur, is_cum=True):
         sqlite cursor
     is_cum: bool
         gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    lazy: bool
+        if True, returns TimeSeries in kg (see make_timeseries)
 
     Returns
     -------
     timeseries list of fuel into reactors [tons]
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
-    fuel = cur.execute('SELECT time, sum(quantity) FROM transactions '
-                       'INNER JOIN resources ON '
-                       'resources.resourceid = transactions.resourceid '
-                       'INNER JOIN agententry ON '
-                       'transactions.receiverid = agententry.agentid '
-                       'WHERE spec LIKE "%Reactor%" '
-                       'GROUP BY time').fetchall()
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
+    fuel = fetch_array(cur, 'SELECT ' + bucket + ' AS time, sum(quantity) '
+                       'FROM ' + transaction_table(cur) +
+                       ' WHERE receiverid IN (' +
+                       archetype_ids(cur, 'Reactor') + ') AND ' + window +
+                       ' GROUP BY ' + bucket, TIMESERIES_COLUMNS)
 
-    if is_cum:
-        return get_timeseries_cum(fuel, duration, True)
-    else:
-        return get_timeseries(fuel, duration, True)
+    return make_timeseries(fuel, timestep, is_cum, True, lazy)
 
 
-def u_util_calc(cur):
+def u_util_calc(cur, cache=None):
     """Returns fuel utilization factor of fuel cycle
 
     Parameters
     ----------
     cur: sqlite cursor
         sqlite cursor
+    cache: dictionary
+        metric cache shared with other evaluate_metrics calls,
+        so natural uranium and fuel timeseries are reused
 
     Returns
     -------
@@ -841,90 +2442,314 @@ def u_util_calc(cur):
         Timeseries of Uranium utilization factor
     Prints simulation average Uranium Utilization
     """
-    # timeseries of natural uranium
-    u_supply_timeseries = np.array(nat_u_timeseries(cur))
-
-    # timeseries of fuel into reactors
-    fuel_timeseries = np.array(fuel_into_reactors(cur))
-
-    # timeseries of Uranium utilization
-    u_util_timeseries = np.nan_to_num(fuel_timeseries / u_supply_timeseries)
+    # timeseries of Uranium utilization, from the cumulative
+    # natural uranium and fuel into reactors timeseries
+    u_util_timeseries = evaluate_metrics(cur, ['u_util'], cache)['u_util']
     print('The Average Fuel Utilization Factor is: ')
     print(sum(u_util_timeseries) / len(u_util_timeseries))
 
-    return u_util_timeseries
+    return u_util_timeseries
+
+
+def where_comm(cur, commodity, prototypes, is_cum=True, resolution='month',
+               lazy=False, start=None, end=None, in_years=False):
+    """Returns dict of where a commodity is from
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    commodity: str
+        name of commodity
+    prototypes: list
+        list of prototypes that provide the commodity
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+    lazy: bool
+        if True, returns TimeSeries in kg (see make_timeseries)
+
+    Returns
+    -------
+    trade_dict: dictioary
+        "dictionary with key=prototype name, and
+        value=timeseries list of commodity sent from prototypes"
+    """
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    bucket = time_bucket(resolution, 'time', timestep[0])
+    window = window_condition(cur, 'time', start, end, in_years)
+    query = ('SELECT ' + bucket + ' AS time, sum(quantity) '
+             'FROM ' + transaction_table(cur) + ' '
+             'WHERE commodity = "' +
+             str(commodity) + '" AND (senderid '
+             '= 9999) AND ' + window + ' GROUP BY ' + bucket)
+    trade_dict = collections.OrderedDict()
+    for agent in prototypes:
+        agent_id = get_prototype_id(cur, agent)
+        from_agent = fetch_array(cur, query.replace(
+            '9999', ' OR senderid = '.join(agent_id)), TIMESERIES_COLUMNS)
+        trade_dict[agent] = make_timeseries(from_agent, timestep, is_cum,
+                                            True, lazy)
+    return trade_dict
+
+
+def commod_per_inst(cur, commodity, timestep=10000):
+    """Outputs outflux of commodity per institution
+        before timestep
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    commodity: str
+        commodity to search for
+
+    Returns
+    -------
+    inst_output_dict: dictionary
+        key = institution
+        value = timeseries list of outflux of commodity
+    """
+
+    institutions = get_inst(cur)
+    inst_output_dict = collections.OrderedDict()
+    outflux = fetch_array(cur, 'SELECT senderid, sum(quantity) '
+                          'FROM ' + transaction_table(cur) +
+                          ' WHERE commodity = "' + commodity +
+                          '" AND time < ' + str(timestep) +
+                          ' GROUP BY senderid',
+                          [('agentid', np.int64), ('value', np.float64)])
+    sums, has_values = rollup(agent_tree(cur), outflux['agentid'],
+                              outflux['value'],
+                              [inst['agentid'] for inst in institutions])
+    for inst, value, has_outflux in zip(institutions, sums, has_values):
+        inst_output_dict[inst['prototype']] = (float(value) if has_outflux
+                                               else None)
+
+    return inst_output_dict
+
+
+def sampled_flux(cur, condition, fraction=None, stride=None,
+                 resolution='month', start=None, end=None, in_years=False):
+    """Estimates traded mass per timestep from a sample of the traded
+    material, for a quick look at large outputs
+
+    With fraction, about that fraction of the rows is read (by rowid
+    hash) and every sampled row counts 1 / fraction times. With stride,
+    only every stride-th month is read and every timestep is scaled
+    by its number of months over its number of sampled months, or
+    holds the last sampled month if it has none.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    condition: str
+        sqlite condition on the columns of transaction_table
+    fraction: float
+        fraction of rows to sample, between 0 and 1
+    stride: int
+        read one month out of stride
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+
+    Returns
+    -------
+    estimate: numpy array
+        estimated mass of every timestep [kg]
+    error: numpy array
+        standard error of the estimate [kg], nan where it
+        cannot be estimated
+    """
+    if (fraction is None) == (stride is None):
+        raise Exception('Give either a sample fraction or a time stride')
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    first, last = time_window(cur, start, end, in_years)
+    width = time_bin(resolution)
+    window = window_condition(cur, 'time', start, end, in_years)
+    if fraction is not None:
+        bucket = time_bucket(resolution, 'time', first)
+        rows = fetch_array(cur, 'SELECT ' + bucket + ' AS time, '
+                           'sum(quantity), sum(quantity * quantity) '
+                           'FROM ' + transaction_table(cur, fraction) +
+                           ' WHERE ' + condition + ' AND ' + window +
+                           ' GROUP BY ' + bucket,
+                           TIMESERIES_COLUMNS + [('square', np.float64)])
+        total = time_sum(rows, duration)
+        squares = time_sum(rows[['time', 'square']], duration)
+        # Horvitz-Thompson estimate of a Bernoulli sample
+        return (total / fraction,
+                np.sqrt((1 - fraction) * squares) / fraction)
+    months = np.arange(first, last + 1)
+    sampled = months[months % stride == 0]
+    rows = fetch_array(cur, 'SELECT time, sum(quantity) '
+                       'FROM ' + transaction_table(cur) +
+                       ' WHERE ' + condition + ' AND ' + window +
+                       ' AND time % ' + str(int(stride)) + ' = 0 '
+                       'GROUP BY time', TIMESERIES_COLUMNS)
+    monthly = np.zeros(len(sampled))
+    np.add.at(monthly, np.searchsorted(sampled, rows['time']),
+              rows['value'])
+    month_index = (months - first) // width
+    size = np.bincount(month_index, minlength=duration)
+    index = (sampled - first) // width
+    count = np.bincount(index, minlength=duration)
+    total = np.bincount(index, weights=monthly, minlength=duration)
+    squares = np.bincount(index, weights=monthly ** 2, minlength=duration)
+    # timesteps without a sampled month hold the last sampled month
+    held = monthly[np.maximum(np.searchsorted(sampled, months, 'right') - 1,
+                              0)] if len(sampled) else np.zeros(len(months))
+    estimate = np.bincount(month_index, weights=held, minlength=duration)
+    error = np.full(duration, np.nan)
+    has_sample = count > 0
+    estimate[has_sample] = (total[has_sample] * size[has_sample] /
+                            count[has_sample])
+    # finite population estimate from the spread of the sampled months
+    spread = count > 1
+    variance = ((squares[spread] - total[spread] ** 2 / count[spread]) /
+                (count[spread] - 1))
+    error[spread] = np.sqrt(np.maximum(variance, 0) *
+                            size[spread] ** 2 / count[spread] *
+                            (1 - count[spread] / size[spread]))
+    error[count == size] = 0
+    return estimate, error
+
+
+def preview_commodity_flux(cur, agent_ids, commod_list, is_outflux,
+                           fraction=0.1, stride=None, is_cum=True,
+                           resolution='month', start=None, end=None,
+                           in_years=False):
+    """Quick look at facility_commodity_flux from a sample
+    of the traded material (see sampled_flux)
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    agent_ids: list
+        list of agentids
+    commod_list: list
+        list of commodities
+    is_outflux: bool
+        gets outflux if True, influx if False
+    fraction: float
+        fraction of rows to sample, None to sample by stride
+    stride: int
+        read one month out of stride
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+
+    Returns
+    -------
+    commodity_dict: dictionary
+        dictionary with "key=commodity, and
+        value=estimated timeseries of masses in tons"
+    error_dict: dictionary
+        dictionary with "key=commodity, and
+        value=standard error of the estimate in tons"
+    """
+    agent = 'senderid' if is_outflux else 'receiverid'
+    commodity_dict = collections.OrderedDict()
+    error_dict = collections.OrderedDict()
+    for comm in commod_list:
+        estimate, error = sampled_flux(
+            cur, agent + ' IN (' + ', '.join(agent_ids) + ') '
+            'AND commodity = "' + str(comm) + '"', fraction, stride,
+            resolution, start, end, in_years)
+        commodity_dict[comm], error_dict[comm] = sample_timeseries(
+            estimate, error, is_cum)
+    return commodity_dict, error_dict
 
 
-def where_comm(cur, commodity, prototypes, is_cum=True):
-    """Returns dict of where a commodity is from
+def preview_trade(cur, sender, receiver, is_prototype, fraction=0.1,
+                  stride=None, is_cum=True, resolution='month', start=None,
+                  end=None, in_years=False):
+    """Quick look at get_trade_dict (without isotopics) from a sample
+    of the traded material (see sampled_flux)
 
     Parameters
     ----------
     cur: sqlite cursor
         sqlite cursor
-    commodity: str
-        name of commodity
-    prototypes: list
-        list of prototypes that provide the commodity
+    sender: str
+        name of sender as facility type or prototype name
+    receiver: str
+        name of receiver as facility type or prototype name
+    is_prototype: bool
+        if True, search sender and receiver as prototype,
+        if False, as facility type from spec.
+    fraction: float
+        fraction of rows to sample, None to sample by stride
+    stride: int
+        read one month out of stride
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     -------
-    trade_dict: dictioary
-        "dictionary with key=prototype name, and
-        value=timeseries list of commodity sent from prototypes"
+    trade_dict: dictionary
+        dictionary with "key=string, sender to receiver,
+        value=estimated timeseries of mass traded in tons"
+    error_dict: dictionary
+        dictionary with "key=string, sender to receiver,
+        value=standard error of the estimate in tons"
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
-    query = ('SELECT time, sum(quantity) FROM transactions '
-             'INNER JOIN resources ON resources.resourceid = '
-             'transactions.resourceid WHERE commodity = "' +
-             str(commodity) + '" AND senderid '
-             '= 9999 GROUP BY time')
+    if is_prototype:
+        sender_id = get_prototype_id(cur, sender)
+        receiver_id = get_prototype_id(cur, receiver)
+    else:
+        sender_id = get_agent_ids(cur, sender)
+        receiver_id = get_agent_ids(cur, receiver)
+    estimate, error = sampled_flux(
+        cur, 'senderid IN (' + ', '.join(sender_id) + ') '
+        'AND receiverid IN (' + ', '.join(receiver_id) + ')',
+        fraction, stride, resolution, start, end, in_years)
+    key_name = str(sender)[:5] + ' to ' + str(receiver)[:5]
     trade_dict = collections.OrderedDict()
-    for agent in prototypes:
-        agent_id = get_prototype_id(cur, agent)
-        from_agent = cur.execute(query.replace(
-            '9999', ' OR senderid = '.join(agent_id))).fetchall()
-        if is_cum:
-            trade_dict[agent] = get_timeseries_cum(from_agent, duration, True)
-        else:
-            trade_dict[agent] = get_timeseries(from_agent, duration, True)
-    return trade_dict
+    error_dict = collections.OrderedDict()
+    trade_dict[key_name], error_dict[key_name] = sample_timeseries(
+        estimate, error, is_cum)
+    return trade_dict, error_dict
 
 
-def commod_per_inst(cur, commodity, timestep=10000):
-    """Outputs outflux of commodity per institution
-        before timestep
+def sample_timeseries(estimate, error, is_cum):
+    """Converts a sampled estimate and its error to tons,
+    and to cumulative values if is_cum
 
     Parameters
     ----------
-    cur: sqlite cursor
-        sqlite cursor
-    commodity: str
-        commodity to search for
+    estimate: numpy array
+        estimate of every timestep [kg]
+    error: numpy array
+        standard error of every timestep [kg]
+    is_cum: bool
+        if True, cumulative estimate and error
 
     Returns
     -------
-    inst_output_dict: dictionary
-        key = institution
-        value = timeseries list of outflux of commodity
+    estimate: list
+        estimate [tons]
+    error: list
+        standard error [tons]
     """
-
-    institutions = get_inst(cur)
-    inst_output_dict = collections.OrderedDict()
-    for inst in institutions:
-        inst_id = inst[1]
-        inst_name = inst[0]
-        facilities = cur.execute('SELECT agentid FROM agententry '
-                                 'WHERE parentid = ' + str(inst_id)).fetchall()
-        facilities_list = []
-        for fac in facilities:
-            facilities_list.append(fac[0])
-        query = exec_string(facilities_list, 'senderid', 'sum(quantity)')
-        query += ' AND commodity = "' + commodity + \
-            '" and time < ' + str(timestep)
-        inst_output_dict[inst_name] = cur.execute(query).fetchone()[0]
-
-    return inst_output_dict
+    if is_cum:
+        # the timesteps are sampled independently
+        estimate = np.cumsum(estimate)
+        error = np.sqrt(np.cumsum(error ** 2))
+    return (estimate * 0.001).tolist(), (error * 0.001).tolist()
 
 
 def get_waste_dict(isotope_list, mass_list, time_list, duration):
@@ -985,19 +2810,25 @@ def capacity_calc(governments, timestep, entry_exit):
         value=timeseries list capacity"
     """
     power_dict = collections.OrderedDict()
+    timestep = np.asarray(timestep)
+    power = column_values(entry_exit, 'max(value)').astype(float) * 0.001
+    parent = column_values(entry_exit, 'parentid')
+    enter = column_values(entry_exit, 'entertime')
+    leave = column_values(entry_exit, 'entertime + lifetime')
+    # agents that entered or left before the first timestep
+    # count from the first timestep
+    enter_index = timestep_index(timestep, enter, True)
+    leave_index = timestep_index(timestep, leave, True)
+    # agents with lifetime -1 are never decommissioned
+    leaves = leave >= enter
     for gov in governments:
-        capacity = []
-        cap = 0
-        for t in timestep:
-            for agent in entry_exit:
-                if (agent['entertime'] == t and
-                        agent['parentid'] == gov['agentid']):
-                    cap += agent['max(value)'] * 0.001
-                if (agent['entertime + lifetime'] == t and
-                        agent['parentid'] == gov['agentid']):
-                    cap -= agent['max(value)'] * 0.001
-            capacity.append(cap)
-        power_dict[gov['prototype']] = np.asarray(capacity)
+        change = np.zeros(len(timestep))
+        is_gov = parent == gov['agentid']
+        entered = is_gov & (enter_index >= 0)
+        left = is_gov & leaves & (leave_index >= 0)
+        np.add.at(change, enter_index[entered], power[entered])
+        np.subtract.at(change, leave_index[left], power[left])
+        power_dict[gov['prototype']] = np.cumsum(change)
 
     return power_dict
 
@@ -1027,20 +2858,21 @@ def reactor_deployments(governments, timestep, entry, exit_step):
         value=timeseries number of reactors"
     """
     deployment = collections.OrderedDict()
+    timestep = np.asarray(timestep)
+    enter_parent = column_values(entry, 'parentid')
+    exit_parent = column_values(exit_step, 'parentid')
+    exit_time = column_values(exit_step, 'exittime')
+    enter_index = timestep_index(timestep, column_values(entry, 'entertime'),
+                                 True)
+    exit_index = timestep_index(timestep, exit_time, True)
     for gov in governments:
-        num_reactors = []
-        count = 0
-        for t in timestep:
-            for enter in entry:
-                if (enter['entertime'] == t and
-                        enter['parentid'] == gov['agentid']):
-                    count += 1
-            for dec in exit_step:
-                if (dec['exittime'] == t and
-                        dec['parentid'] == gov['agentid']):
-                    count -= 1
-            num_reactors.append(count)
-        deployment[gov['prototype']] = np.asarray(num_reactors)
+        change = np.zeros(len(timestep), dtype=int)
+        entered = (enter_parent == gov['agentid']) & (enter_index >= 0)
+        left = ((exit_parent == gov['agentid']) & (exit_time >= 0) &
+                (exit_index >= 0))
+        np.add.at(change, enter_index[entered], 1)
+        np.subtract.at(change, exit_index[left], 1)
+        deployment[gov['prototype']] = np.cumsum(change)
 
     return deployment
 
@@ -1420,7 +3252,7 @@ def stacked_bar_chart(dictionary, timestep,
     plt.close()
 
 
-def plot_power(cur):
+def plot_power(cur, resolution='month', start=None, end=None, in_years=False):
     """Gets capacity vs time for every country
         in stacked bar chart.
 
@@ -1428,25 +3260,32 @@ def plot_power(cur):
     ----------
     cur: sqlite cursor
         sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     -------
     """
-    init_year, init_month, duration, timestep = get_timesteps(cur)
-    power_dict = get_power_dict(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    power_dict, deployment_dict = run_queries(
+        cur, [(get_power_dict, (resolution, start, end, in_years)),
+              (get_deployment_dict, (resolution, start, end, in_years))])
     stacked_bar_chart(power_dict, timestep,
                       'Years', 'Net_Capacity [GWe]',
                       'Net Capacity vs Time',
                       'power_plot', init_year)
 
-    deployment_dict = get_deployment_dict(cur)
     stacked_bar_chart(deployment_dict, timestep,
                       'Years', 'Number of Reactors',
                       'Number of Reactors vs Time',
                       'num_plot', init_year)
 
 
-def plot_in_out_flux(cur, facility, influx_bool, title, outputname):
+def plot_in_out_flux(cur, facility, influx_bool, title, outputname,
+                     nuclides=None):
     """plots timeseries influx/ outflux from facility name in kg.
 
     Parameters
@@ -1462,51 +3301,43 @@ def plot_in_out_flux(cur, facility, influx_bool, title, outputname):
         title of the multi line plot
     outputname: str
         filename of the multi line plot file
+    nuclides: list
+        if given, only these nuclides, elements or groups
+        (see nuclide_condition)
 
     Returns
     -------
     """
     agent_ids = get_agent_ids(cur, facility)
-    if influx_bool is True:
-        resources = cur.execute(exec_string(agent_ids,
-                                            'transactions.receiverId',
-                                            'time, sum(quantity), '
-                                            'qualid') +
-                                ' GROUP BY time, qualid').fetchall()
-    else:
-        resources = cur.execute(exec_string(agent_ids,
-                                            'transactions.senderId',
-                                            'time, sum(quantity), '
-                                            'qualid') +
-                                ' GROUP BY time, qualid').fetchall()
-
-    compositions = cur.execute('SELECT qualid, nucid, massfrac '
-                               'FROM compositions').fetchall()
-
+    agent = 'receiverid' if influx_bool is True else 'senderid'
     init_year, init_month, duration, timestep = get_timesteps(cur)
-    transactions = get_isotope_transactions(resources, compositions)
-    waste_dict = get_waste_dict(transactions.keys(),
-                                transactions.values()[0],
-                                transactions.values()[1],
-                                duration)
+    rows = fetch_array(cur, isotope_query(cur, 'time', agent + ' IN (' +
+                                          ', '.join(agent_ids) + ')',
+                                          nuclides), ISOTOPE_COLUMNS)
+    waste_dict = matrix_dict(*isotope_matrix(rows, duration, True, False))
 
     if influx_bool is False:
         stacked_bar_chart(waste_dict, timestep,
                           'Years', 'Mass [kg]',
                           title, outputname, init_year)
     else:
-        multi_line_plot(waste_dict, timestep,
-                        'Years', 'Mass [kg]',
-                        title, outputname, init_year)
+        multiple_line_plots(waste_dict, timestep,
+                            'Years', 'Mass [kg]',
+                            title, outputname, init_year)
 
 
-def entered_power(cur):
+def entered_power(cur, resolution='month',
+                  start=None, end=None, in_years=False):
     """Returns dictionary of power entered into simulation.
 
     Parameters
     ---------
     cur: sqlite cursor
         sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
 
     Returns
     -------
@@ -1515,17 +3346,22 @@ def entered_power(cur):
         value: timeseries of power entered (non-cumulative)
     """
     power_dict = {}
-    entered = cur.execute('SELECT entertime, max(value) FROM '
-                          'agententry INNER JOIN timeseriespower '
-                          'ON agententry.agentid = timeseriespower.agentid '
-                          'WHERE spec LIKE "%reactor%" '
-                          'GROUP BY agententry.agentid').fetchall()
-    init_year, init_month, duration, timestep = get_timesteps(cur)
+    init_year, init_month, duration, timestep = get_timesteps(
+        cur, resolution, start, end, in_years)
+    entered = cur.execute('SELECT ' +
+                          time_bucket(resolution, 'entertime',
+                                      timestep[0]) +
+                          ' AS entertime, maxpower FROM ' +
+                          power_summary(cur) +
+                          ' WHERE agentid IN (' +
+                          archetype_ids(cur, 'reactor') + ') AND ' +
+                          window_condition(cur, 'entertime', start, end,
+                                           in_years)).fetchall()
     power_dict['power'] = get_timeseries(entered, duration, False)
     return power_dict
 
 
-def source_throughput(cur, duration, frac_prod, frac_tail):
+def source_throughput(cur, duration, frac_prod, frac_tail, cache=None):
     """Calculates throughput required for nat_u source before enrichment
     by calculating the average mass of fuel gone into reactors over
     simulation. Assuming natural uranium is put as feed
@@ -1540,14 +3376,627 @@ def source_throughput(cur, duration, frac_prod, frac_tail):
         mass fraction of U235 in fuel after enrichment in decimals
     frac_tail: float
         mass fraction of U235 in tailings after enrichment in decimals
+    cache: dictionary
+        metric cache shared with other evaluate_metrics calls,
+        so the fuel into reactors timeseries is reused
 
     Returns
     -------
     throughput: float
         appropriate nat_u throughput for source
     """
-    avg_fuel_used = fuel_into_reactors(cur)[-1] * 1000 / duration
+    fuel = evaluate_metrics(cur, ['fuel_into_reactors_cum'], cache)
+    avg_fuel_used = fuel['fuel_into_reactors_cum'][-1] * 1000 / duration
     feed_factor = (frac_prod - frac_tail) / (0.00711 - frac_tail)
     print('Throughput should be at least: ' +
           str(feed_factor * avg_fuel_used) + ' [kg]')
     return feed_factor * avg_fuel_used
+
+
+def get_file_name(cur):
+    """Returns the file name of the main database of a cursor
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    file_name: str
+        path of the sqlite file ('' for in-memory databases)
+    """
+    for database in cur.execute('PRAGMA database_list').fetchall():
+        if database[1] == 'main':
+            return database[2]
+    return ''
+
+
+# registry of metrics: key=metric name,
+# value=(names of the metrics it needs, function computing it)
+METRICS = collections.OrderedDict()
+
+
+def metric(name, inputs=()):
+    """Registers a function as a metric that evaluate_metrics can compute
+
+    The function is called with the cursor followed by the values
+    of the input metrics, in the order they are declared.
+
+    Parameters
+    ----------
+    name: str
+        name of the metric
+    inputs: tuple
+        names of the metrics this metric is derived from
+
+    Returns
+    -------
+    register: function
+        decorator that adds the function to METRICS
+    """
+    def register(func):
+        METRICS[name] = (tuple(inputs), func)
+        return func
+    return register
+
+
+def evaluate_metrics(cur, names, cache=None):
+    """Evaluates metrics, computing every metric and the
+    intermediates it depends on only once per output file
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    names: list
+        names of metrics (keys of METRICS) to evaluate
+    cache: dictionary
+        results of earlier evaluations, keyed by output file name.
+        Pass the same dictionary to reuse intermediates between calls.
+
+    Returns
+    -------
+    metric_dict: dictionary
+        dictionary with "key=metric name, and
+        value=value of the metric"
+    """
+    if cache is None:
+        cache = {}
+    results = cache.setdefault(get_file_name(cur), {})
+
+    def evaluate(name, dependents):
+        if name in results:
+            return results[name]
+        if name in dependents:
+            raise Exception('Metric ' + name + ' depends on itself')
+        if name not in METRICS:
+            raise Exception('Unknown metric ' + name)
+        inputs, func = METRICS[name]
+        values = [evaluate(x, dependents + (name,)) for x in inputs]
+        results[name] = func(cur, *values)
+        return results[name]
+
+    metric_dict = collections.OrderedDict()
+    for name in names:
+        metric_dict[name] = evaluate(name, ())
+    return metric_dict
+
+
+@metric('timesteps')
+def timesteps_metric(cur):
+    return get_timesteps(cur)
+
+
+@metric('institutions')
+def institutions_metric(cur):
+    return get_inst(cur)
+
+
+@metric('fuel_into_reactors')
+def fuel_into_reactors_metric(cur):
+    return fuel_into_reactors(cur, False, lazy=True).to_tons().values
+
+
+@metric('fuel_into_reactors_cum', ('fuel_into_reactors',))
+def fuel_into_reactors_cum_metric(cur, fuel):
+    return np.cumsum(fuel)
+
+
+@metric('nat_u')
+def nat_u_metric(cur):
+    return nat_u_timeseries(cur, False, lazy=True).to_tons().values
+
+
+@metric('nat_u_cum', ('nat_u',))
+def nat_u_cum_metric(cur, nat_u):
+    return np.cumsum(nat_u)
+
+
+@metric('agent_max_power')
+def agent_max_power_metric(cur):
+    return cur.execute('SELECT maxpower AS "max(value)", agentid, '
+                       'parentid, spec, entertime, '
+                       'entertime + lifetime AS "entertime + lifetime" '
+                       'FROM ' + power_summary(cur)).fetchall()
+
+
+@metric('agent_exit')
+def agent_exit_metric(cur):
+    return cur.execute('SELECT agentid, parentid, exittime '
+                       'FROM ' + power_summary(cur) +
+                       ' WHERE exittime IS NOT NULL').fetchall()
+
+
+@metric('power', ('institutions', 'timesteps', 'agent_max_power'))
+def power_metric(cur, governments, timesteps, entry_exit):
+    return capacity_calc(governments, timesteps[3], entry_exit)
+
+
+@metric('deployment', ('institutions', 'timesteps',
+                       'agent_max_power', 'agent_exit'))
+def deployment_metric(cur, governments, timesteps, entry, exit_step):
+    return reactor_deployments(governments, timesteps[3], entry, exit_step)
+
+
+@metric('entered_power', ('timesteps',))
+def entered_power_metric(cur, timesteps):
+    entered = fetch_array(cur, 'SELECT entertime, maxpower FROM ' +
+                          power_summary(cur) + ' WHERE agentid IN (' +
+                          archetype_ids(cur, 'reactor') + ')',
+                          TIMESERIES_COLUMNS)
+    # zero in every timestep when no reactor entered
+    return time_sum(entered, timesteps[2])
+
+
+@metric('u_util', ('nat_u_cum', 'fuel_into_reactors_cum'))
+def u_util_metric(cur, nat_u, fuel):
+    return np.nan_to_num(fuel / nat_u)
+
+
+def attach_outputs(file_list):
+    """Connects to several output files through one connection,
+    attaching every file as its own schema (scenario0, scenario1, ..)
+
+    sqlite limits the number of attached files (10 by default).
+
+    Parameters
+    ----------
+    file_list: list
+        list of Cyclus output files (.sqlite) to compare
+
+    Returns
+    -------
+    cur: sqlite cursor
+        sqlite cursor of a connection with all files attached
+    schemas: list
+        schema names of the attached files, in order of file_list
+    """
+    con = lite.connect(':memory:')
+    con.row_factory = lite.Row
+    cur = con.cursor()
+    schemas = []
+    for num, file_name in enumerate(file_list):
+        schema = 'scenario' + str(num)
+        cur.execute('ATTACH DATABASE "' + file_name + '" AS ' + schema)
+        schemas.append(schema)
+    return cur, schemas
+
+
+def scenario_query(schemas, query):
+    """Generates one sqlite query that runs a query on every
+    attached output, adding the scenario number as first column
+
+    Parameters
+    ----------
+    schemas: list
+        schema names from attach_outputs
+    query: str
+        sqlite query with '{db}.' in front of every table name
+
+    Returns
+    -------
+    str
+        sqlite query command.
+    """
+    if len(schemas) == 0:
+        raise Exception('Cannot create a scenario_query without outputs')
+    return ' UNION ALL '.join('SELECT ' + str(num) + ' AS scenario, * '
+                              'FROM (' + query.replace('{db}', schema) + ')'
+                              for num, schema in enumerate(schemas))
+
+
+def scenario_timesteps(cur, schemas, resolution='month'):
+    """Returns start years, duration and timesteps of attached outputs
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from attach_outputs
+    schemas: list
+        schema names from attach_outputs
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    init_years: numpy array
+        start year of every scenario
+    duration: int
+        number of timesteps of the resolution in the longest scenario
+    timestep: list
+        linspace of the first month of every timestep
+    """
+    info = cur.execute(scenario_query(
+        schemas, 'SELECT initialyear, duration FROM {db}.info')).fetchall()
+    init_years = np.array([row['initialyear'] for row in info])
+    width = time_bin(resolution)
+    duration = -(-max(row['duration'] for row in info) // width)
+    timestep = np.linspace(0, (duration - 1) * width, num=duration)
+    return init_years, duration, timestep
+
+
+def scenario_timeseries(cur, schemas, query, is_cum=True,
+                        kg_to_tons=True, resolution='month'):
+    """Runs a timeseries query on all attached outputs at once
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from attach_outputs
+    schemas: list
+        schema names from attach_outputs
+    query: str
+        sqlite query returning (time, value) rows, with '{db}.'
+        in front of every table name, and time already in
+        timesteps of the resolution
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    kg_to_tons: bool
+        if True, values are converted from kilograms to tons
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    scenario_array: numpy array
+        timeseries of every scenario (scenarios x timesteps)
+    """
+    init_years, duration, timestep = scenario_timesteps(cur, schemas,
+                                                        resolution)
+    rows = np.array([tuple(row)[:3] for row in
+                     cur.execute(scenario_query(schemas, query)).fetchall()],
+                    dtype=float).reshape(-1, 3)
+    scenario = rows[:, 0].astype(int)
+    times = rows[:, 1].astype(int)
+    inside = (times >= 0) & (times < duration)
+    scenario_array = np.zeros((len(schemas), duration))
+    np.add.at(scenario_array, (scenario[inside], times[inside]),
+              rows[inside, 2])
+    if is_cum:
+        scenario_array = np.cumsum(scenario_array, axis=1)
+    if kg_to_tons:
+        scenario_array = scenario_array * 0.001
+    return scenario_array
+
+
+def compare_commodity_flux(cur, schemas, commodity, is_cum=True,
+                           resolution='month'):
+    """Returns timeseries of a commodity traded in every attached output
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from attach_outputs
+    schemas: list
+        schema names from attach_outputs
+    commodity: str
+        name of commodity
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    scenario_array: numpy array
+        timeseries of mass traded [tons] (scenarios x timesteps)
+    """
+    bucket = time_bucket(resolution)
+    query = ('SELECT ' + bucket + ' AS time, sum(quantity) '
+             'FROM {db}.transactions INNER JOIN {db}.resources '
+             'ON {db}.resources.resourceid = {db}.transactions.resourceid '
+             'WHERE commodity = "' + str(commodity) + '" '
+             'GROUP BY ' + bucket)
+    return scenario_timeseries(cur, schemas, query, is_cum, True,
+                               resolution)
+
+
+def compare_fuel_into_reactors(cur, schemas, is_cum=True,
+                               resolution='month'):
+    """Returns timeseries of fuel received by reactors
+    in every attached output
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from attach_outputs
+    schemas: list
+        schema names from attach_outputs
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    scenario_array: numpy array
+        timeseries of fuel into reactors [tons] (scenarios x timesteps)
+    """
+    bucket = time_bucket(resolution)
+    query = ('SELECT ' + bucket + ' AS time, sum(quantity) '
+             'FROM {db}.transactions INNER JOIN {db}.resources '
+             'ON {db}.resources.resourceid = {db}.transactions.resourceid '
+             'WHERE receiverid IN (SELECT agentid FROM {db}.agententry '
+             'WHERE spec LIKE "%Reactor%") '
+             'GROUP BY ' + bucket)
+    return scenario_timeseries(cur, schemas, query, is_cum, True,
+                               resolution)
+
+
+def compare_nat_u(cur, schemas, is_cum=True, resolution='month'):
+    """Returns timeseries of natural uranium feed to enrichment
+    in every attached output
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from attach_outputs
+    schemas: list
+        schema names from attach_outputs
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    scenario_array: numpy array
+        timeseries of natural uranium [MTHM] (scenarios x timesteps)
+    """
+    bucket = time_bucket(resolution)
+    query = ('SELECT ' + bucket + ' AS time, sum(value) '
+             'FROM {db}.timeseriesenrichmentfeed '
+             'GROUP BY ' + bucket)
+    return scenario_timeseries(cur, schemas, query, is_cum, True,
+                               resolution)
+
+
+def compare_swu(cur, schemas, is_cum=True, resolution='month'):
+    """Returns timeseries of swu of all enrichment plants
+    in every attached output
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from attach_outputs
+    schemas: list
+        schema names from attach_outputs
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    scenario_array: numpy array
+        timeseries of swu (scenarios x timesteps)
+    """
+    bucket = time_bucket(resolution)
+    query = ('SELECT ' + bucket + ' AS time, sum(value) '
+             'FROM {db}.timeseriesenrichmentswu '
+             'GROUP BY ' + bucket)
+    return scenario_timeseries(cur, schemas, query, is_cum, False,
+                               resolution)
+
+
+def compare_power(cur, schemas, resolution='month'):
+    """Returns timeseries of total installed capacity
+    in every attached output
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from attach_outputs
+    schemas: list
+        schema names from attach_outputs
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+
+    Returns
+    -------
+    scenario_array: numpy array
+        timeseries of installed capacity (scenarios x timesteps)
+    """
+    init_years, duration, timestep = scenario_timesteps(cur, schemas,
+                                                        resolution)
+    query = ('SELECT max(value), entertime, entertime + lifetime '
+             'FROM {db}.agententry INNER JOIN {db}.timeseriespower '
+             'ON {db}.agententry.agentid = {db}.timeseriespower.agentid '
+             'GROUP BY {db}.timeseriespower.agentid')
+    rows = np.array([tuple(row) for row in
+                     cur.execute(scenario_query(schemas, query)).fetchall()],
+                    dtype=float).reshape(-1, 4)
+    scenario = rows[:, 0].astype(int)
+    power = rows[:, 1] * 0.001
+    enter_index = timestep_index(timestep, rows[:, 2])
+    leave_index = timestep_index(timestep, rows[:, 3])
+    change = np.zeros((len(schemas), duration))
+    entered = enter_index >= 0
+    left = leave_index >= 0
+    np.add.at(change, (scenario[entered], enter_index[entered]),
+              power[entered])
+    np.subtract.at(change, (scenario[left], leave_index[left]), power[left])
+    return np.cumsum(change, axis=1)
+
+
+def metric_series(name, value):
+    """Splits the value of a metric into named timeseries
+
+    Parameters
+    ----------
+    name: str
+        name of the metric
+    value: numpy array or dictionary
+        timeseries, or "dictionary with key=name, and
+        value=timeseries" (eg. power by government)
+
+    Returns
+    -------
+    series_dict: dictionary
+        dictionary with "key=metric name or metric name/key, and
+        value=timeseries as numpy array"
+    """
+    series_dict = collections.OrderedDict()
+    if isinstance(value, dict):
+        for key, values in value.items():
+            series_dict[name + '/' + str(key)] = np.asarray(values,
+                                                            dtype=float)
+    elif np.ndim(value) == 1:
+        series_dict[name] = np.asarray(value, dtype=float)
+    else:
+        raise Exception('Metric ' + name + ' is not a timeseries')
+    return series_dict
+
+
+def scenario_diff(cur, other_cur, names, cache=None, rtol=1e-3, atol=0.0):
+    """Compares metrics of a baseline output and a variant output
+    on a common calendar time axis
+
+    The outputs may start in different years or months: every
+    timeseries is placed by its calendar month, and months only one
+    of the outputs covers are nan in the other one. Series only
+    one output has (eg. a government the other has not) are zero
+    in the other one.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor of the baseline output
+    other_cur: sqlite cursor
+        sqlite cursor of the variant output
+    names: list
+        names of monthly timeseries metrics (keys of METRICS)
+    cache: dictionary
+        evaluate_metrics cache. Pass the same dictionary to compare
+        many pairs while computing every output's metrics once.
+    rtol: float
+        relative difference (to the baseline) above which
+        the outputs have diverged
+    atol: float
+        absolute difference above which the outputs have diverged
+
+    Returns
+    -------
+    diff: dictionary
+        labels: names of the compared timeseries (see metric_series)
+        years: calendar time of every column, in decimal years
+        baseline, variant: timeseries (labels x years)
+        difference: variant - baseline
+        relative: difference / abs(baseline), nan where baseline is 0
+        divergence: first year the outputs differ by more than
+            atol + rtol * abs(baseline), nan if they never do
+    """
+    if cache is None:
+        cache = {}
+    starts = []
+    series = []
+    for scenario_cur in (cur, other_cur):
+        metric_dict = evaluate_metrics(scenario_cur,
+                                       ['timesteps'] + list(names), cache)
+        init_year, init_month, duration, timestep = metric_dict['timesteps']
+        starts.append(12 * init_year + init_month - 1)
+        series_dict = collections.OrderedDict()
+        for name in names:
+            series_dict.update(metric_series(name, metric_dict[name]))
+        series.append(series_dict)
+    labels = list(series[0])
+    labels += [label for label in series[1] if label not in series[0]]
+    first = min(starts)
+    last = max(start + len(values)
+               for start, series_dict in zip(starts, series)
+               for values in series_dict.values())
+    matrices = []
+    for start, series_dict in zip(starts, series):
+        matrix = np.full((len(labels), last - first), np.nan)
+        length = max([len(values) for values in series_dict.values()] +
+                     [0])
+        matrix[:, start - first:start - first + length] = 0
+        for row, label in enumerate(labels):
+            if label in series_dict:
+                values = series_dict[label]
+                matrix[row, start - first:start - first + len(values)] = \
+                    values
+        matrices.append(matrix)
+    baseline, variant = matrices
+    difference = variant - baseline
+    relative = np.full(difference.shape, np.nan)
+    np.divide(difference, np.abs(baseline), out=relative,
+              where=baseline != 0)
+    with np.errstate(invalid='ignore'):
+        diverged = np.abs(difference) > atol + rtol * np.abs(baseline)
+    months = np.arange(first, last)
+    divergence = np.where(diverged.any(axis=1),
+                          months[np.argmax(diverged, axis=1)] / 12.0,
+                          np.nan)
+    diff = collections.OrderedDict()
+    diff['labels'] = labels
+    diff['years'] = months / 12.0
+    diff['baseline'] = baseline
+    diff['variant'] = variant
+    diff['difference'] = difference
+    diff['relative'] = relative
+    diff['divergence'] = divergence
+    return diff
+
+
+def diff_outputs(baseline, variant_list, names, cache=None, **kwargs):
+    """Compares a baseline output with every variant output
+    (see scenario_diff), computing the metrics of each output once
+
+    Parameters
+    ----------
+    baseline: str
+        baseline Cyclus output file (.sqlite)
+    variant_list: list
+        list of variant Cyclus output files (.sqlite)
+    names: list
+        names of monthly timeseries metrics (keys of METRICS)
+    cache: dictionary
+        evaluate_metrics cache, reused between calls if given
+    kwargs: rtol and atol of scenario_diff
+
+    Returns
+    -------
+    diff_dict: dictionary
+        dictionary with "key=variant file, and
+        value=diff from scenario_diff"
+    """
+    if cache is None:
+        cache = {}
+    diff_dict = collections.OrderedDict()
+    cur = read_only_cursor(baseline)
+    for file_name in variant_list:
+        other_cur = read_only_cursor(file_name)
+        diff_dict[file_name] = scenario_diff(cur, other_cur, names, cache,
+                                             **kwargs)
+        other_cur.connection.close()
+    cur.connection.close()
+    return diff_dict
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'build-sidecar':
+        print('Wrote ' + build_sidecar(sys.argv[2]))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'audit':
+        audit(get_cursor(sys.argv[2]))
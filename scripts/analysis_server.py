@@ -0,0 +1,306 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import numpy as np
+import sys
+import analysis as an
+
+
+# metrics the service answers: key=metric name,
+# value=analysis function called with a cursor and the request kwargs
+SERVED = {'timesteps': an.get_timesteps,
+          'power': an.get_power_dict,
+          'power_of_region': an.get_power_dict_of_region,
+          'deployment': an.get_deployment_dict,
+          'entered_power': an.entered_power,
+          'fuel_usage': an.fuel_usage_timeseries,
+          'fuel_into_reactors': an.fuel_into_reactors,
+          'nat_u': an.nat_u_timeseries,
+          'swu': an.get_swu_dict,
+          'stockpile': an.get_stockpile,
+          'trade': an.get_trade_dict,
+          'where_comm': an.where_comm,
+          'commodity_flux': an.facility_commodity_flux,
+          'commodity_flux_region': an.commodity_flux_region,
+          'isotopics': an.facility_commodity_flux_isotopics}
+
+
+def new_service():
+    """Returns the state of an analysis service
+
+    Returns
+    -------
+    service: dictionary
+        cursors: key=output file, value=warm read-only cursor
+        executors: key=output file, value=thread running its queries
+        cache: key=request key, value=json ready result
+        pending: key=request key, value=future of a running request
+    """
+    return {'cursors': {},
+            'executors': {},
+            'cache': {},
+            'pending': {}}
+
+
+def register_output(service, file_name):
+    """Opens a warm read-only connection to an output file
+
+    Parameters
+    ----------
+    service: dictionary
+        service from new_service
+    file_name: str
+        Cyclus output file (.sqlite)
+    """
+    if file_name in service['cursors']:
+        return
+    service['cursors'][file_name] = an.read_only_cursor(file_name)
+    # every file gets its own thread, so its cursor is never shared
+    service['executors'][file_name] = \
+        concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+def close_service(service):
+    """Closes the connections and threads of a service
+
+    Parameters
+    ----------
+    service: dictionary
+        service from new_service
+    """
+    for executor in service['executors'].values():
+        executor.shutdown()
+    for cur in service['cursors'].values():
+        cur.connection.close()
+    service['cursors'].clear()
+    service['executors'].clear()
+    service['cache'].clear()
+
+
+def to_json(value):
+    """Converts analysis results to json serializable values
+
+    Parameters
+    ----------
+    value: object
+        result of an analysis function
+
+    Returns
+    -------
+    object made of dicts, lists, numbers and strings
+
+    Raises
+    ------
+    TypeError
+        if the result holds values that cannot be sent as json
+    """
+    if isinstance(value, dict):
+        return collections.OrderedDict((str(key), to_json(val))
+                                       for key, val in value.items())
+    if isinstance(value, an.TimeSeries):
+        value = value.values
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return to_json(value.tolist())
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [to_json(val) for val in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError('Cannot send ' + type(value).__name__ + ' as json')
+
+
+def request_key(request):
+    """Returns the key identifying the result of a request
+
+    Parameters
+    ----------
+    request: dictionary
+        request with 'file', 'metric' and optional 'kwargs'
+
+    Returns
+    -------
+    str
+        key used for the cache and to coalesce requests
+    """
+    return json.dumps([request['file'], request['metric'],
+                       request.get('kwargs', {})], sort_keys=True)
+
+
+async def handle_request(service, request):
+    """Answers one request, from the cache if possible
+
+    Requests asking for a result that is already being computed
+    wait for that computation instead of starting their own.
+
+    Parameters
+    ----------
+    service: dictionary
+        service from new_service
+    request: dictionary
+        'file': output file, 'metric': key of SERVED,
+        'kwargs': keyword arguments of the analysis function
+
+    Returns
+    -------
+    response: dictionary
+        'result': json ready result, or 'error': message
+    """
+    if request.get('metric') not in SERVED:
+        return {'error': 'Unknown metric ' + str(request.get('metric'))}
+    if request.get('file') not in service['cursors']:
+        return {'error': 'Output file is not registered: ' +
+                str(request.get('file'))}
+    key = request_key(request)
+    if key in service['cache']:
+        return {'result': service['cache'][key]}
+    if key not in service['pending']:
+        loop = asyncio.get_event_loop()
+        cur = service['cursors'][request['file']]
+        kwargs = request.get('kwargs', {})
+
+        def compute():
+            return to_json(SERVED[request['metric']](cur, **kwargs))
+
+        service['pending'][key] = loop.run_in_executor(
+            service['executors'][request['file']], compute)
+    future = service['pending'][key]
+    try:
+        result = await asyncio.shield(future)
+    except Exception as error:
+        return {'error': str(error)}
+    finally:
+        service['pending'].pop(key, None)
+    service['cache'][key] = result
+    return {'result': result}
+
+
+async def handle_client(service, reader, writer):
+    """Answers json requests sent one per line by a client
+
+    A request with a 'register' key opens that output file,
+    every other request is answered by handle_request.
+
+    Parameters
+    ----------
+    service: dictionary
+        service from new_service
+    reader: asyncio StreamReader
+    writer: asyncio StreamWriter
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        try:
+            request = json.loads(line.decode())
+            if 'register' in request:
+                register_output(service, request['register'])
+                response = {'result': request['register']}
+            else:
+                response = await handle_request(service, request)
+            message = json.dumps(response)
+        except Exception as error:
+            message = json.dumps({'error': str(error)})
+        writer.write((message + '\n').encode())
+        await writer.drain()
+    writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8765, path=None):
+    """Starts the service on a local tcp port or unix socket
+
+    Parameters
+    ----------
+    service: dictionary
+        service from new_service
+    host: str
+        address to listen on
+    port: int
+        tcp port to listen on
+    path: str
+        if given, listen on this unix socket instead of tcp
+
+    Returns
+    -------
+    server: asyncio Server
+    """
+    def client(reader, writer):
+        return handle_client(service, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(client, path=path)
+    return await asyncio.start_server(client, host, port)
+
+
+async def send_request(request, host='127.0.0.1', port=8765, path=None):
+    """Sends one request to a running service
+
+    Parameters
+    ----------
+    request: dictionary
+        request for handle_client
+    host: str
+        address of the service
+    port: int
+        tcp port of the service
+    path: str
+        unix socket of the service, used instead of tcp if given
+
+    Returns
+    -------
+    response: dictionary
+        'result' or 'error' sent back by the service
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps(request) + '\n').encode())
+    await writer.drain()
+    response = json.loads((await reader.readline()).decode())
+    writer.close()
+    return response
+
+
+def run(coroutine):
+    """Runs a coroutine to completion in a new event loop
+    (asyncio.run needs python 3.7)
+
+    Parameters
+    ----------
+    coroutine: coroutine
+        eg. handle_request(service, request)
+
+    Returns
+    -------
+    result of the coroutine
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def main(file_list, host='127.0.0.1', port=8765):
+    service = new_service()
+    for file_name in file_list:
+        register_output(service, file_name)
+    server = await serve(service, host, port)
+    print('Serving ' + str(len(file_list)) + ' outputs on ' +
+          host + ':' + str(port))
+    return server
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python analysis_server.py [cyclus_output_file ...]')
+    else:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(main(sys.argv[1:]))
+        loop.run_forever()
@@ -0,0 +1,346 @@
+import collections
+import hashlib
+import numpy as np
+import sqlite3 as lite
+import zlib
+import analysis as an
+
+
+# number of timesteps stored per compressed chunk
+CHUNK_SIZE = 120
+
+# units of the metrics archive_output stores: key=metric name, value=units
+ARCHIVE_UNITS = {'fuel_into_reactors': 'tons',
+                 'fuel_into_reactors_cum': 'tons',
+                 'nat_u': 'tons',
+                 'nat_u_cum': 'tons',
+                 'power': 'GWe',
+                 'deployment': 'reactors',
+                 'entered_power': 'MWe',
+                 'u_util': ''}
+
+
+def open_archive(file_name):
+    """Connects to an archive file, creating its tables if needed
+
+    An archive is an sqlite file with two tables:
+    arrays: ArrayId / Scenario / Metric / Key / Units / InitYear /
+        InitMonth / Fingerprint / DType / Length / ChunkSize,
+        the index of the stored timeseries
+    chunks: ArrayId / Chunk / Data, every chunk_size timesteps of a
+        timeseries, byte shuffled and zlib compressed
+
+    Parameters
+    ----------
+    file_name: str
+        name of the archive file
+
+    Returns
+    -------
+    sqlite cursor
+    """
+    con = lite.connect(file_name)
+    con.row_factory = lite.Row
+    cur = con.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS arrays '
+                '(arrayid INTEGER PRIMARY KEY, scenario TEXT, metric TEXT, '
+                'key TEXT, units TEXT, inityear INTEGER, initmonth INTEGER, '
+                'fingerprint TEXT, dtype TEXT, length INTEGER, '
+                'chunksize INTEGER, UNIQUE (metric, scenario, key))')
+    cur.execute('CREATE TABLE IF NOT EXISTS chunks '
+                '(arrayid INTEGER, chunk INTEGER, data BLOB, '
+                'PRIMARY KEY (arrayid, chunk)) WITHOUT ROWID')
+    con.commit()
+    return cur
+
+
+def file_fingerprint(file_name, block_size=1 << 20):
+    """Returns the sha1 hash of a file's content
+
+    Parameters
+    ----------
+    file_name: str
+        name of the file
+    block_size: int
+        number of bytes hashed at once
+
+    Returns
+    -------
+    str
+        hexadecimal sha1 hash
+    """
+    sha = hashlib.sha1()
+    with open(file_name, 'rb') as src:
+        for block in iter(lambda: src.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def compress_chunk(values, level=6):
+    """Compresses an array, grouping the bytes of equal significance
+    (byte shuffle) so smooth timeseries compress better
+
+    Parameters
+    ----------
+    values: numpy array
+        1d array
+    level: int
+        zlib compression level
+
+    Returns
+    -------
+    bytes
+    """
+    shuffled = values.view(np.uint8).reshape(-1, values.dtype.itemsize).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+
+def decompress_chunk(data, dtype):
+    """Reverses compress_chunk
+
+    Parameters
+    ----------
+    data: bytes
+        compressed chunk
+    dtype: str
+        dtype of the array
+
+    Returns
+    -------
+    numpy array
+    """
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    return np.ascontiguousarray(
+        shuffled.reshape(dtype.itemsize, -1).T).view(dtype).reshape(-1)
+
+
+def write_array(cur, scenario, metric, values, key='', units='',
+                init_year=None, init_month=1, fingerprint='',
+                chunk_size=CHUNK_SIZE, level=6):
+    """Stores a timeseries in an archive, replacing the stored
+    timeseries of the same scenario, metric and key
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from open_archive
+    scenario: str
+        name of the scenario
+    metric: str
+        name of the metric
+    values: list or numpy array
+        timeseries
+    key: str
+        key of the timeseries in the metric, eg. government
+    units: str
+        units of the values
+    init_year: int
+        start year of the scenario
+    init_month: int
+        start month of the scenario
+    fingerprint: str
+        fingerprint of the output file (see file_fingerprint)
+    chunk_size: int
+        number of timesteps per chunk
+    level: int
+        zlib compression level
+    """
+    values = np.asarray(values)
+    values = values.astype(values.dtype.newbyteorder('<')).reshape(-1)
+    old = cur.execute('SELECT arrayid FROM arrays WHERE scenario = ? AND '
+                      'metric = ? AND key = ?',
+                      (scenario, metric, str(key))).fetchone()
+    if old is not None:
+        cur.execute('DELETE FROM chunks WHERE arrayid = ?', (old[0],))
+        cur.execute('DELETE FROM arrays WHERE arrayid = ?', (old[0],))
+    cur.execute('INSERT INTO arrays (scenario, metric, key, units, '
+                'inityear, initmonth, fingerprint, dtype, length, '
+                'chunksize) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (scenario, metric, str(key), units, init_year, init_month,
+                 fingerprint, values.dtype.str, len(values), chunk_size))
+    array_id = cur.lastrowid
+    cur.executemany('INSERT INTO chunks VALUES (?, ?, ?)',
+                    ((array_id, num,
+                      compress_chunk(values[start:start + chunk_size],
+                                     level))
+                     for num, start in enumerate(range(0, len(values),
+                                                       chunk_size))))
+
+
+def write_result(cur, scenario, metric, result, **kwargs):
+    """Stores the result of an analysis function in an archive
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from open_archive
+    scenario: str
+        name of the scenario
+    metric: str
+        name of the metric
+    result: numpy array or dictionary
+        timeseries, or "dictionary with key=name, and
+        value=timeseries" (eg. power by government)
+    kwargs: units, init_year, init_month, fingerprint, chunk_size
+        and level of write_array
+    """
+    if isinstance(result, dict):
+        for key, values in result.items():
+            write_array(cur, scenario, metric, values, key, **kwargs)
+    elif np.ndim(result) == 1:
+        write_array(cur, scenario, metric, result, **kwargs)
+    else:
+        raise Exception('Metric ' + metric + ' is not a timeseries')
+
+
+def archive_output(archive_file, output_file, names, scenario=None,
+                   cache=None):
+    """Stores metrics of a Cyclus output in an archive
+
+    Parameters
+    ----------
+    archive_file: str
+        name of the archive file
+    output_file: str
+        Cyclus output file (.sqlite)
+    names: list
+        names of monthly timeseries metrics (keys of METRICS)
+    scenario: str
+        name of the scenario, the output file name if None
+    cache: dictionary
+        evaluate_metrics cache, reused between calls if given
+    """
+    if scenario is None:
+        scenario = output_file
+    out_cur = an.read_only_cursor(output_file)
+    metric_dict = an.evaluate_metrics(out_cur, ['timesteps'] + list(names),
+                                      cache)
+    out_cur.connection.close()
+    init_year, init_month, duration, timestep = metric_dict['timesteps']
+    fingerprint = file_fingerprint(output_file)
+    cur = open_archive(archive_file)
+    with cur.connection:
+        for name in names:
+            write_result(cur, scenario, name, metric_dict[name],
+                         units=ARCHIVE_UNITS.get(name, ''),
+                         init_year=init_year, init_month=init_month,
+                         fingerprint=fingerprint)
+    cur.connection.close()
+
+
+def archive_index(cur, scenario=None, metric=None):
+    """Returns the index of the timeseries stored in an archive
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from open_archive
+    scenario: str
+        if given, only timeseries of this scenario
+    metric: str
+        if given, only timeseries of this metric
+
+    Returns
+    -------
+    sqlite query result (list of rows of the arrays table)
+    """
+    conditions = []
+    params = []
+    for column, value in [('scenario', scenario), ('metric', metric)]:
+        if value is not None:
+            conditions.append(column + ' = ?')
+            params.append(value)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return cur.execute('SELECT * FROM arrays' + where +
+                       ' ORDER BY arrayid', params).fetchall()
+
+
+def read_array(cur, scenario, metric, key='', start=None, end=None,
+               in_years=False):
+    """Reads a timeseries, or the timesteps start to end of it,
+    decompressing only the chunks holding them
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from open_archive
+    scenario: str
+        name of the scenario
+    metric: str
+        name of the metric
+    key: str
+        key of the timeseries in the metric
+    start: int
+        first timestep read, the first timestep if None
+    end: int
+        timestep after the last one read, the end if None
+    in_years: bool
+        if True, start and end are calendar years, both included
+
+    Returns
+    -------
+    values: numpy array
+        timeseries
+    """
+    row = cur.execute('SELECT arrayid, dtype, length, chunksize, '
+                      'inityear, initmonth FROM arrays WHERE scenario = ? '
+                      'AND metric = ? AND key = ?',
+                      (scenario, metric, str(key))).fetchone()
+    if row is None:
+        raise Exception('Archive has no ' + metric + ' ' + str(key) +
+                        ' of scenario ' + scenario)
+    if in_years:
+        offset = 12 * row['inityear'] + row['initmonth'] - 1
+        if start is not None:
+            start = max(12 * start - offset, 0)
+        if end is not None:
+            end = max(12 * (end + 1) - offset, 0)
+    start, end, step = slice(start, end).indices(row['length'])
+    if end <= start:
+        return np.zeros(0, dtype=row['dtype'])
+    first = start // row['chunksize']
+    last = (end - 1) // row['chunksize']
+    chunks = cur.execute('SELECT data FROM chunks WHERE arrayid = ? '
+                         'AND chunk BETWEEN ? AND ? ORDER BY chunk',
+                         (row['arrayid'], first, last)).fetchall()
+    values = np.concatenate([decompress_chunk(chunk[0], row['dtype'])
+                             for chunk in chunks])
+    offset = first * row['chunksize']
+    return values[start - offset:end - offset]
+
+
+def read_metric(cur, scenario, metric, start=None, end=None,
+                in_years=False):
+    """Reads every timeseries of a metric (see read_array)
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor from open_archive
+    scenario: str
+        name of the scenario
+    metric: str
+        name of the metric
+    start: int
+        first timestep read, the first timestep if None
+    end: int
+        timestep after the last one read, the end if None
+    in_years: bool
+        if True, start and end are calendar years, both included
+
+    Returns
+    -------
+    result: numpy array or dictionary
+        timeseries, or "dictionary with key=name, and
+        value=timeseries" if the metric was stored as a dictionary
+    """
+    rows = archive_index(cur, scenario, metric)
+    if len(rows) == 0:
+        raise Exception('Archive has no ' + metric + ' of scenario ' +
+                        scenario)
+    if len(rows) == 1 and rows[0]['key'] == '':
+        return read_array(cur, scenario, metric, '', start, end, in_years)
+    return collections.OrderedDict(
+        (row['key'], read_array(cur, scenario, metric, row['key'],
+                                start, end, in_years)) for row in rows)
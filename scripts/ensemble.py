@@ -0,0 +1,230 @@
+import collections
+import numpy as np
+import analysis as an
+
+
+def new_sketch(duration, size=100):
+    """Returns an empty quantile sketch for timeseries of a given length
+
+    The sketch keeps at most 2 * size weighted centroids per timestep,
+    so memory does not grow with the number of runs added to it.
+
+    Parameters
+    ----------
+    duration: int
+        number of timesteps of the timeseries
+    size: int
+        number of centroids kept per timestep after compression
+
+    Returns
+    -------
+    sketch: dictionary
+        "dictionary with key=field, and value=numpy array"
+        means, weights: centroids (duration x centroids)
+        min, max: smallest and largest value per timestep
+        size: compression size
+        count: number of runs added
+    """
+    return {'means': np.zeros((duration, 0)),
+            'weights': np.zeros((duration, 0)),
+            'min': np.full(duration, np.inf),
+            'max': np.full(duration, -np.inf),
+            'size': size,
+            'count': 0}
+
+
+def compress_sketch(means, weights, size):
+    """Merges centroids so every timestep keeps at most size centroids
+
+    Centroids are sorted and merged by their cumulative weight using
+    the arcsine scale function, which keeps the tails (eg. the 5%
+    and 95% quantiles) finer than the middle of the distribution.
+
+    Parameters
+    ----------
+    means: numpy array
+        centroid means (timesteps x centroids)
+    weights: numpy array
+        centroid weights (timesteps x centroids)
+    size: int
+        number of centroids to keep per timestep
+
+    Returns
+    -------
+    means: numpy array
+        merged centroid means (timesteps x size)
+    weights: numpy array
+        merged centroid weights (timesteps x size)
+    """
+    rows = np.arange(means.shape[0])[:, np.newaxis]
+    order = np.argsort(means, axis=1)
+    means = means[rows, order]
+    weights = weights[rows, order]
+    total = weights.sum(axis=1, keepdims=True)
+    total[total == 0] = 1
+    mid = (np.cumsum(weights, axis=1) - weights / 2) / total
+    bins = np.floor(size * (np.arcsin(2 * mid - 1) / np.pi + 0.5))
+    bins = np.clip(bins, 0, size - 1).astype(int)
+    index = (rows * size + bins).ravel()
+    new_weights = np.zeros(means.shape[0] * size)
+    new_means = np.zeros(means.shape[0] * size)
+    np.add.at(new_weights, index, weights.ravel())
+    np.add.at(new_means, index, (means * weights).ravel())
+    filled = new_weights > 0
+    new_means[filled] /= new_weights[filled]
+    return (new_means.reshape(-1, size),
+            new_weights.reshape(-1, size))
+
+
+def add_run(sketch, values):
+    """Adds the timeseries of one run to a sketch
+
+    Parameters
+    ----------
+    sketch: dictionary
+        sketch from new_sketch
+    values: list or numpy array
+        timeseries of the run, one value per timestep
+
+    Returns
+    -------
+    sketch: dictionary
+        the updated sketch
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) != len(sketch['min']):
+        raise Exception('Run has ' + str(len(values)) + ' timesteps, '
+                        'sketch has ' + str(len(sketch['min'])))
+    sketch['means'] = np.hstack((sketch['means'], values[:, np.newaxis]))
+    sketch['weights'] = np.hstack((sketch['weights'],
+                                   np.ones((len(values), 1))))
+    sketch['min'] = np.minimum(sketch['min'], values)
+    sketch['max'] = np.maximum(sketch['max'], values)
+    sketch['count'] += 1
+    if sketch['means'].shape[1] > 2 * sketch['size']:
+        sketch['means'], sketch['weights'] = compress_sketch(
+            sketch['means'], sketch['weights'], sketch['size'])
+    return sketch
+
+
+def merge_sketches(sketch1, sketch2):
+    """Merges two sketches, eg. built by different worker processes
+
+    Parameters
+    ----------
+    sketch1: dictionary
+        sketch from new_sketch
+    sketch2: dictionary
+        sketch from new_sketch with the same number of timesteps
+
+    Returns
+    -------
+    sketch: dictionary
+        new sketch holding the runs of both sketches
+    """
+    if len(sketch1['min']) != len(sketch2['min']):
+        raise Exception('Cannot merge sketches of different durations')
+    sketch = {'means': np.hstack((sketch1['means'], sketch2['means'])),
+              'weights': np.hstack((sketch1['weights'],
+                                    sketch2['weights'])),
+              'min': np.minimum(sketch1['min'], sketch2['min']),
+              'max': np.maximum(sketch1['max'], sketch2['max']),
+              'size': min(sketch1['size'], sketch2['size']),
+              'count': sketch1['count'] + sketch2['count']}
+    if sketch['means'].shape[1] > 2 * sketch['size']:
+        sketch['means'], sketch['weights'] = compress_sketch(
+            sketch['means'], sketch['weights'], sketch['size'])
+    return sketch
+
+
+def sketch_quantiles(sketch, quantiles):
+    """Returns quantile timeseries estimated from a sketch
+
+    Parameters
+    ----------
+    sketch: dictionary
+        sketch from new_sketch
+    quantiles: list
+        quantiles to estimate, between 0 and 1
+
+    Returns
+    -------
+    quantile_array: numpy array
+        estimated values (quantiles x timesteps)
+    """
+    if sketch['count'] == 0:
+        raise Exception('Cannot get quantiles of an empty sketch')
+    quantiles = np.asarray(quantiles, dtype=float)
+    duration = len(sketch['min'])
+    quantile_array = np.zeros((len(quantiles), duration))
+    for t in range(duration):
+        weights = sketch['weights'][t]
+        filled = weights > 0
+        order = np.argsort(sketch['means'][t][filled])
+        means = sketch['means'][t][filled][order]
+        weights = weights[filled][order]
+        mid = (np.cumsum(weights) - weights / 2) / weights.sum()
+        # the exact extremes anchor both ends of the distribution
+        mid = np.concatenate(([0], mid, [1]))
+        means = np.concatenate(([sketch['min'][t]], means,
+                                [sketch['max'][t]]))
+        quantile_array[:, t] = np.interp(quantiles, mid, means)
+    return quantile_array
+
+
+def percentile_bands(sketch, percentiles=(5, 50, 95)):
+    """Returns percentile bands of a sketch for plotting
+
+    Parameters
+    ----------
+    sketch: dictionary
+        sketch from new_sketch
+    percentiles: list
+        percentiles to estimate, between 0 and 100
+
+    Returns
+    -------
+    band_dict: dictionary
+        "dictionary with key=percentile (eg. '5%'), and
+        value=timeseries of the percentile"
+    """
+    quantile_array = sketch_quantiles(sketch,
+                                      np.asarray(percentiles) / 100.0)
+    band_dict = collections.OrderedDict()
+    for percentile, values in zip(percentiles, quantile_array):
+        band_dict[str(percentile) + '%'] = values
+    return band_dict
+
+
+def ensemble_sketches(file_list, size=100):
+    """Builds capacity and deployment sketches from Cyclus outputs,
+    reading one output file at a time
+
+    Parameters
+    ----------
+    file_list: list
+        list of Cyclus output files (.sqlite) of the same duration
+    size: int
+        number of centroids kept per timestep
+
+    Returns
+    -------
+    sketch_dict: dictionary
+        "dictionary with key=metric ('capacity', 'deployment'), and
+        value=sketch of the total of all governments"
+    """
+    sketch_dict = collections.OrderedDict()
+    for file_name in file_list:
+        cur = an.get_cursor(file_name)
+        metrics = an.evaluate_metrics(cur, ['timesteps', 'power',
+                                            'deployment'])
+        duration = metrics['timesteps'][2]
+        if len(sketch_dict) == 0:
+            sketch_dict['capacity'] = new_sketch(duration, size)
+            sketch_dict['deployment'] = new_sketch(duration, size)
+        add_run(sketch_dict['capacity'],
+                sum(metrics['power'].values(), np.zeros(duration)))
+        add_run(sketch_dict['deployment'],
+                sum(metrics['deployment'].values(), np.zeros(duration)))
+        cur.connection.close()
+    return sketch_dict
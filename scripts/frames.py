@@ -0,0 +1,362 @@
+import numpy as np
+import analysis as an
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+# column specs of read_frame: list of (column name, dtype)
+FLUX_COLUMNS = [('time', 'int32'), ('commodity', 'category'),
+                ('mass', 'float32')]
+PROTOTYPE_COLUMNS = [('time', 'int32'), ('prototype', 'category'),
+                     ('mass', 'float32')]
+TRADE_COLUMNS = [('time', 'int32'), ('sender', 'category'),
+                 ('receiver', 'category'), ('commodity', 'category'),
+                 ('mass', 'float32')]
+MASS_COLUMNS = [('time', 'int32'), ('mass', 'float32')]
+
+
+def read_frame(cur, query, columns, chunk_size=65536, max_bytes=None):
+    """Executes a query and builds a DataFrame from its rows,
+    converting every chunk of chunk_size rows to compact dtypes
+    before the next one is read
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    query: str
+        sqlite query
+    columns: list
+        list of (name, dtype) of the selected columns, in order,
+        eg. ('time', 'int32') or ('commodity', 'category')
+    chunk_size: int
+        number of rows fetched at once
+    max_bytes: int
+        if given, raise MemoryError when the frame grows larger
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        one row per row of the query
+    """
+    if pd is None:
+        raise ImportError('pandas is needed to build DataFrames')
+    names = [name for name, dtype in columns]
+    dtypes = dict(columns)
+    # categories seen so far of every categorical column
+    categories = dict((name, pd.Index([])) for name, dtype in columns
+                      if dtype == 'category')
+    plain_cur = cur.connection.cursor()
+    plain_cur.row_factory = None
+    plain_cur.execute(query)
+    frames = []
+    size = 0
+    while True:
+        chunk = plain_cur.fetchmany(chunk_size)
+        if len(chunk) == 0:
+            break
+        frame = pd.DataFrame.from_records(chunk, columns=names)
+        frame = frame.astype(dtypes)
+        # every chunk gets the same categories so concat keeps them
+        for name in categories:
+            new = frame[name].cat.categories.difference(categories[name])
+            categories[name] = categories[name].append(new)
+            frame[name] = frame[name].cat.set_categories(categories[name])
+        size += frame.memory_usage(deep=True).sum()
+        if max_bytes is not None and size > max_bytes:
+            plain_cur.close()
+            raise MemoryError('Query result is larger than ' +
+                              str(max_bytes) + ' bytes')
+        frames.append(frame)
+    plain_cur.close()
+    if len(frames) == 0:
+        return pd.DataFrame(columns=names).astype(dtypes)
+    # earlier chunks lack the categories found after them
+    for frame in frames:
+        for name in categories:
+            frame[name] = frame[name].cat.set_categories(categories[name])
+    return pd.concat(frames, ignore_index=True)
+
+
+def dict_frame(result_dict, key_name, value_name, dtype='float32'):
+    """Converts a dictionary of timeseries into a long DataFrame
+
+    Parameters
+    ----------
+    result_dict: dictionary
+        "dictionary with key=name, and value=timeseries"
+    key_name: str
+        name of the column holding the keys
+    value_name: str
+        name of the column holding the values
+    dtype: str
+        dtype of the values
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time, key and value columns
+    """
+    if pd is None:
+        raise ImportError('pandas is needed to build DataFrames')
+    keys = list(result_dict.keys())
+    values = [np.asarray(result_dict[key]) for key in keys]
+    lengths = [len(value) for value in values]
+    return pd.DataFrame(
+        {'time': np.concatenate([np.arange(n, dtype=np.int32)
+                                 for n in lengths] +
+                                [np.zeros(0, dtype=np.int32)]),
+         key_name: pd.Categorical(np.repeat(keys, lengths),
+                                  categories=keys),
+         value_name: np.concatenate(values + [np.zeros(0)]).astype(dtype)})
+
+
+def window_bucket(cur, resolution='month', start=None, end=None,
+                  in_years=False):
+    """Returns the time bucket and window condition of a frame query,
+    with timesteps counted from the start of the window
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+
+    Returns
+    -------
+    bucket: str
+        sqlite expression of the timestep of the time column
+    window: str
+        sqlite condition keeping the rows of the time window
+    """
+    timestep = an.get_timesteps(cur, resolution, start, end, in_years)[3]
+    return (an.time_bucket(resolution, 'time', timestep[0]),
+            an.window_condition(cur, 'time', start, end, in_years))
+
+
+def commodity_flux_frame(cur, agent_ids, commod_list, is_outflux,
+                         resolution='month', start=None, end=None,
+                         in_years=False, **kwargs):
+    """Returns commodity in/outflux from agents as a DataFrame,
+    like facility_commodity_flux
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    agent_ids: list
+        list of agentids
+    commod_list: list
+        list of commodities
+    is_outflux: bool
+        gets outflux if True, influx if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+    kwargs: chunk_size and max_bytes of read_frame
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time (timestep index), commodity and mass [kg]
+        of every timestep with a flux
+    """
+    bucket, window = window_bucket(cur, resolution, start, end, in_years)
+    agent = 'senderid' if is_outflux else 'receiverid'
+    query = ('SELECT ' + bucket + ', commodity, sum(quantity) '
+             'FROM ' + an.transaction_table(cur) +
+             ' WHERE ' + agent + ' IN (' + ', '.join(agent_ids) + ') '
+             'AND commodity IN ("' + '", "'.join(commod_list) + '") '
+             'AND ' + window + ' GROUP BY ' + bucket + ', commodity')
+    return read_frame(cur, query, FLUX_COLUMNS, **kwargs)
+
+
+def trade_frame(cur, sender, receiver, is_prototype, resolution='month',
+                start=None, end=None, in_years=False, **kwargs):
+    """Returns trade between two prototypes' or facilities
+    as a DataFrame, like get_trade_dict
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    sender: str
+        name of sender as facility type or prototype name
+    receiver: str
+        name of receiver as facility type or prototype name
+    is_prototype: bool
+        if True, search sender and receiver as prototype,
+        if False, as facility type from spec.
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+    kwargs: chunk_size and max_bytes of read_frame
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time (timestep index), sender and receiver prototypes,
+        commodity and mass [kg]
+    """
+    if is_prototype:
+        sender_id = an.get_prototype_id(cur, sender)
+        receiver_id = an.get_prototype_id(cur, receiver)
+    else:
+        sender_id = an.get_agent_ids(cur, sender)
+        receiver_id = an.get_agent_ids(cur, receiver)
+    bucket, window = window_bucket(cur, resolution, start, end, in_years)
+    query = ('SELECT ' + bucket + ', senders.prototype, '
+             'receivers.prototype, commodity, sum(quantity) '
+             'FROM ' + an.transaction_table(cur) + ' '
+             'INNER JOIN agententry AS senders '
+             'ON senders.agentid = flows.senderid '
+             'INNER JOIN agententry AS receivers '
+             'ON receivers.agentid = flows.receiverid '
+             'WHERE senderid IN (' + ', '.join(sender_id) + ') '
+             'AND receiverid IN (' + ', '.join(receiver_id) + ') '
+             'AND ' + window + ' GROUP BY ' + bucket + ', senders.prototype, '
+             'receivers.prototype, commodity')
+    return read_frame(cur, query, TRADE_COLUMNS, **kwargs)
+
+
+def where_comm_frame(cur, commodity, prototypes, resolution='month',
+                     start=None, end=None, in_years=False, **kwargs):
+    """Returns the outflux of a commodity from prototypes
+    as a DataFrame, like where_comm
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    commodity: str
+        name of commodity
+    prototypes: list
+        list of prototypes that provide the commodity
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+    kwargs: chunk_size and max_bytes of read_frame
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time (timestep index), prototype and mass [kg]
+    """
+    bucket, window = window_bucket(cur, resolution, start, end, in_years)
+    query = ('SELECT ' + bucket + ', prototype, sum(quantity) '
+             'FROM ' + an.transaction_table(cur) + ' '
+             'INNER JOIN agententry ON agententry.agentid = flows.senderid '
+             'WHERE commodity = "' + str(commodity) + '" '
+             'AND senderid IN (' + an.prototype_ids(cur, prototypes) + ') '
+             'AND ' + window + ' GROUP BY ' + bucket + ', prototype')
+    return read_frame(cur, query, PROTOTYPE_COLUMNS, **kwargs)
+
+
+def fuel_into_reactors_frame(cur, resolution='month', start=None,
+                             end=None, in_years=False, **kwargs):
+    """Returns mass of fuel received by reactors as a DataFrame,
+    like fuel_into_reactors
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+    kwargs: chunk_size and max_bytes of read_frame
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time (timestep index) and mass [kg]
+    """
+    bucket, window = window_bucket(cur, resolution, start, end, in_years)
+    query = ('SELECT ' + bucket + ', sum(quantity) '
+             'FROM ' + an.transaction_table(cur) +
+             ' WHERE receiverid IN (' + an.archetype_ids(cur, 'Reactor') +
+             ') AND ' + window + ' GROUP BY ' + bucket)
+    return read_frame(cur, query, MASS_COLUMNS, **kwargs)
+
+
+def nat_u_frame(cur, resolution='month', start=None, end=None,
+                in_years=False, **kwargs):
+    """Returns natural uranium feed to enrichment as a DataFrame,
+    like nat_u_timeseries
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+    kwargs: chunk_size and max_bytes of read_frame
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time (timestep index) and mass [kg]
+    """
+    bucket, window = window_bucket(cur, resolution, start, end, in_years)
+    query = ('SELECT ' + bucket + ', sum(value) '
+             'FROM timeseriesenrichmentfeed '
+             'WHERE ' + window + ' GROUP BY ' + bucket)
+    return read_frame(cur, query, MASS_COLUMNS, **kwargs)
+
+
+def power_frame(cur, resolution='month', start=None, end=None,
+                in_years=False):
+    """Returns installed capacity of every government as a DataFrame,
+    like get_power_dict
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time (timestep index), government and power [GWe]
+    """
+    power_dict = an.get_power_dict(cur, resolution, start, end, in_years)
+    return dict_frame(power_dict, 'government', 'power')
+
+
+def deployment_frame(cur, resolution='month', start=None, end=None,
+                     in_years=False):
+    """Returns number of reactors of every government as a DataFrame,
+    like get_deployment_dict
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see an.time_window), the whole simulation if None
+
+    Returns
+    -------
+    frame: pandas DataFrame
+        time (timestep index), government and number of reactors
+    """
+    deployment = an.get_deployment_dict(cur, resolution, start, end,
+                                        in_years)
+    return dict_frame(deployment, 'government', 'reactors', 'int32')
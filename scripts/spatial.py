@@ -0,0 +1,344 @@
+import collections
+import csv
+import numpy as np
+import matplotlib.pyplot as plt
+import analysis as an
+
+
+def pris_coordinates(pris_file):
+    """Reads reactor coordinates from a PRIS file with latitude and
+    longitude columns (eg. reactors_pris_2016.csv from merge_coordinates)
+
+    Reactors are named like predicting_the_past_import.write_reactors
+    names their prototypes, with spaces replaced by underscores.
+    Reactors without coordinates are left out.
+
+    Parameters
+    ----------
+    pris_file: str
+        path to the PRIS csv file
+
+    Returns
+    -------
+    coordinates: dictionary
+        "dictionary with key=prototype name, and
+        value=(latitude, longitude)"
+    """
+    coordinates = {}
+    with open(pris_file, 'r', encoding='utf-8', errors='replace') as src:
+        for row in csv.DictReader(src):
+            try:
+                lat = float(row['Latitude'])
+                lon = float(row['Longitude'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            coordinates[row['Reactor Unit'].replace(' ', '_')] = (lat, lon)
+    return coordinates
+
+
+def coordinate_tables(cur):
+    """Returns the agent state tables with latitude and longitude columns
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+
+    Returns
+    -------
+    tables: list
+        list of table names
+    """
+    tables = []
+    for row in cur.execute('SELECT name FROM sqlite_master WHERE '
+                           'type = "table" AND name LIKE "agentstate%"'
+                           ).fetchall():
+        columns = [column[1].lower() for column in
+                   cur.execute('PRAGMA table_info(' + row[0] + ')')]
+        if 'latitude' in columns and 'longitude' in columns:
+            tables.append(row[0])
+    return tables
+
+
+def agent_coordinates(cur, coordinates=None):
+    """Returns the coordinates of every facility that has them
+
+    Coordinates are read from the agent states the archetypes
+    record (eg. cycamore Reactor latitude and longitude), or,
+    if coordinates is given, looked up by prototype name.
+    Facilities at latitude and longitude 0 (the placeholder
+    write_reactors uses for unknown coordinates) are left out.
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    coordinates: dictionary
+        "dictionary with key=prototype name, and
+        value=(latitude, longitude)", eg. from pris_coordinates
+
+    Returns
+    -------
+    agent_ids: numpy array
+        sorted agentids of the facilities
+    latitude: numpy array
+        latitude of every facility
+    longitude: numpy array
+        longitude of every facility
+    """
+    located = {}
+    if coordinates is None:
+        for table in coordinate_tables(cur):
+            for row in cur.execute('SELECT agentid, latitude, longitude '
+                                   'FROM ' + table +
+                                   ' GROUP BY agentid').fetchall():
+                located[row[0]] = (row[1], row[2])
+    else:
+        lookup = dict((str(name).lower(), coordinate)
+                      for name, coordinate in coordinates.items())
+        for row in cur.execute('SELECT agentid, prototype FROM agententry '
+                               'WHERE kind = "Facility"').fetchall():
+            if str(row[1]).lower() in lookup:
+                located[row[0]] = lookup[str(row[1]).lower()]
+    agent_ids = np.array(sorted(agent for agent, coordinate in
+                                located.items()
+                                if coordinate[0] or coordinate[1]),
+                         dtype=np.int64)
+    points = np.array([located[agent] for agent in agent_ids],
+                      dtype=float).reshape(-1, 2)
+    return agent_ids, points[:, 0], points[:, 1]
+
+
+def site_index(latitude, longitude, grid=None, decimals=3):
+    """Groups coordinates into sites or grid cells
+
+    Without grid, facilities with the same coordinates (rounded to
+    decimals, about 100 m for 3) make one site, eg. the units of a
+    plant. With grid, the coordinates are hashed into cells of grid
+    degrees, and every cell holding facilities is a site placed at
+    the center of the cell.
+
+    Parameters
+    ----------
+    latitude: numpy array
+        latitude of every facility
+    longitude: numpy array
+        longitude of every facility
+    grid: float
+        size of the grid cells in degrees, None to group by site
+    decimals: int
+        decimals the coordinates are rounded to when grouping by site
+
+    Returns
+    -------
+    site_lat: numpy array
+        latitude of every site
+    site_lon: numpy array
+        longitude of every site
+    index: numpy array
+        site of every facility
+    """
+    if grid is None:
+        cells = np.column_stack((np.round(latitude, decimals),
+                                 np.round(longitude, decimals)))
+    else:
+        cells = np.column_stack((np.floor((latitude + 90) / grid),
+                                 np.floor((longitude + 180) / grid)))
+    sites, index = np.unique(cells.reshape(-1, 2), axis=0,
+                             return_inverse=True)
+    index = index.reshape(-1)
+    if grid is None:
+        return sites[:, 0], sites[:, 1], index
+    return ((sites[:, 0] + 0.5) * grid - 90,
+            (sites[:, 1] + 0.5) * grid - 180, index)
+
+
+def locate(agent_ids, ids):
+    """Finds agentids in the sorted agentids of agent_coordinates
+
+    Parameters
+    ----------
+    agent_ids: numpy array
+        sorted agentids
+    ids: numpy array
+        agentids to find
+
+    Returns
+    -------
+    position: numpy array
+        position of every id in agent_ids
+    located: numpy array
+        True where the id is in agent_ids
+    """
+    position = np.searchsorted(agent_ids, ids)
+    located = np.zeros(len(ids), dtype=bool)
+    inside = position < len(agent_ids)
+    located[inside] = agent_ids[position[inside]] == ids[inside]
+    return position, located
+
+
+def site_dict(site_lat, site_lon, values):
+    """Returns site results in the format of the spatial functions
+
+    Parameters
+    ----------
+    site_lat: numpy array
+        latitude of every site
+    site_lon: numpy array
+        longitude of every site
+    values: numpy array
+        results (sites x timesteps)
+
+    Returns
+    -------
+    sites: dictionary
+        latitude, longitude: coordinates of every site
+        values: results (sites x timesteps)
+    """
+    sites = collections.OrderedDict()
+    sites['latitude'] = site_lat
+    sites['longitude'] = site_lon
+    sites['values'] = values
+    return sites
+
+
+def spatial_capacity(cur, coordinates=None, grid=None,
+                     resolution='month', start=None, end=None,
+                     in_years=False):
+    """Returns installed capacity of every site or grid cell,
+    like get_power_dict with sites instead of governments
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    coordinates: dictionary
+        coordinates by prototype name (see agent_coordinates)
+    grid: float
+        size of the grid cells in degrees, None to group by site
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+
+    Returns
+    -------
+    sites: dictionary
+        latitude, longitude: coordinates of every site
+        values: installed capacity [GWe] (sites x timesteps)
+    """
+    init_year, init_month, duration, timestep = an.get_timesteps(
+        cur, resolution, start, end, in_years)
+    first, last = an.time_window(cur, start, end, in_years)
+    agent_ids, latitude, longitude = agent_coordinates(cur, coordinates)
+    site_lat, site_lon, index = site_index(latitude, longitude, grid)
+    entry_exit = an.fetch_array(cur, 'SELECT maxpower, agentid, parentid, '
+                                'entertime, entertime + lifetime '
+                                'FROM ' + an.power_summary(cur) +
+                                ' WHERE entertime <= ' + str(last),
+                                an.CAPACITY_COLUMNS)
+    position, located = locate(agent_ids, entry_exit['agentid'])
+    site = index[position[located]]
+    power = entry_exit['max(value)'][located] * 0.001
+    enter_index = an.timestep_index(timestep,
+                                    entry_exit['entertime'][located], True)
+    leave_index = an.timestep_index(
+        timestep, entry_exit['entertime + lifetime'][located], True)
+    change = np.zeros((len(site_lat), duration))
+    entered = enter_index >= 0
+    # agents with lifetime -1 are never decommissioned
+    left = ((entry_exit['entertime + lifetime'][located] >=
+             entry_exit['entertime'][located]) & (leave_index >= 0))
+    np.add.at(change, (site[entered], enter_index[entered]), power[entered])
+    np.subtract.at(change, (site[left], leave_index[left]), power[left])
+    return site_dict(site_lat, site_lon, np.cumsum(change, axis=1))
+
+
+def spatial_discharge(cur, commod_list=None, coordinates=None, grid=None,
+                      is_cum=True, resolution='month', start=None,
+                      end=None, in_years=False):
+    """Returns spent fuel discharged by the reactors of every site
+    or grid cell
+
+    Parameters
+    ----------
+    cur: sqlite cursor
+        sqlite cursor
+    commod_list: list
+        commodities counted as spent fuel, every reactor outflux if None
+    coordinates: dictionary
+        coordinates by prototype name (see agent_coordinates)
+    grid: float
+        size of the grid cells in degrees, None to group by site
+    is_cum: bool
+        gets cumulative timeseris if True, monthly value if False
+    resolution: str or int
+        'month', 'quarter', 'year' or number of months per timestep
+    start, end, in_years:
+        time window (see time_window), the whole simulation if None
+
+    Returns
+    -------
+    sites: dictionary
+        latitude, longitude: coordinates of every site
+        values: spent fuel discharged [tons] (sites x timesteps)
+    """
+    init_year, init_month, duration, timestep = an.get_timesteps(
+        cur, resolution, start, end, in_years)
+    agent_ids, latitude, longitude = agent_coordinates(cur, coordinates)
+    site_lat, site_lon, index = site_index(latitude, longitude, grid)
+    bucket = an.time_bucket(resolution, 'time', timestep[0])
+    condition = ('senderid IN (' + an.archetype_ids(cur, 'Reactor') +
+                 ') AND ' + an.window_condition(cur, 'time', start, end,
+                                                in_years))
+    if commod_list is not None:
+        condition += (' AND commodity IN ("' + '", "'.join(commod_list) +
+                      '")')
+    rows = an.fetch_array(cur, 'SELECT senderid, ' + bucket + ' AS time, '
+                          'sum(quantity) FROM ' + an.transaction_table(cur) +
+                          ' WHERE ' + condition +
+                          ' GROUP BY senderid, ' + bucket,
+                          [('agentid', np.int64)] + an.TIMESERIES_COLUMNS)
+    position, located = locate(agent_ids, rows['agentid'])
+    located &= (rows['time'] >= 0) & (rows['time'] < duration)
+    values = np.zeros((len(site_lat), duration))
+    np.add.at(values, (index[position[located]], rows['time'][located]),
+              rows['value'][located] * 0.001)
+    if is_cum:
+        values = np.cumsum(values, axis=1)
+    return site_dict(site_lat, site_lon, values)
+
+
+def plot_sites(sites, step, label, title, outputname):
+    """Scatter map of site results at one timestep,
+    with markers sized by value
+
+    Parameters
+    ----------
+    sites: dictionary
+        result of spatial_capacity or spatial_discharge
+    step: int
+        timestep to plot
+    label: str
+        label of the colorbar
+    title: str
+        title of the plot
+    outputname: str
+        name of the png file
+    """
+    values = sites['values'][:, step]
+    shown = values > 0
+    largest = values.max() if shown.any() else 1
+    fig, ax = plt.subplots(figsize=(15, 7))
+    points = ax.scatter(sites['longitude'][shown], sites['latitude'][shown],
+                        s=10 + 200 * values[shown] / largest,
+                        c=values[shown], cmap='viridis', alpha=0.7)
+    fig.colorbar(points, ax=ax, label=label)
+    ax.set_xlim(-180, 180)
+    ax.set_ylim(-90, 90)
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    ax.set_title(title)
+    ax.grid(True)
+    plt.savefig(outputname + '.png', format='png', bbox_inches='tight')
+    plt.close(fig)
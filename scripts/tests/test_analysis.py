@@ -3,6 +3,7 @@ import pytest
 import collections
 import sqlite3 as lite
 import os
+import shutil
 import sys
 path = os.path.realpath(__file__)
 sys.path.append(os.path.dirname(os.path.dirname(path)))
@@ -81,8 +82,8 @@ def test_facility_commodity_flux_isotopics():
     answer_y = collections.OrderedDict()
     answer_x['U235'] = [0, 0, 0, 2.639e-05, 2.639e-05, 6.279e-05,
                         6.279e-05, 8.919e-05, 8.919e-05, 8.919e-05]
-    answer_y['U235'] = [0, 0, 9.599e-3, 9.599e-3, 2.959e-2, 2.959e-2,
-                        3.919e-2, 3.919e-2, 3.919e-2, 3.919e-2]
+    answer_y['U235'] = [0, 0, 1.320e-2, 1.320e-2, 3.140e-2, 3.140e-2,
+                        4.460e-2, 4.460e-2, 4.460e-2, 4.460e-2]
     assert len(x['U235']) == len(answer_x['U235'])
     assert len(y['U235']) == len(answer_y['U235'])
     for expected, actual in zip(x['U235'], answer_x['U235']):
@@ -271,3 +272,629 @@ def test_capacity_calc():
     for key in power_dict:
         assert np.array_equal(
             power_dict[key], answer_power[key]) == True
+
+
+def test_get_power_dict_of_region():
+    """Tests if get_power_dict_of_region only returns the
+       governments of the given regions"""
+    cur = get_sqlite()
+    power_dict = an.get_power_dict_of_region(cur, ['USA'])
+    answer = an.get_power_dict(cur)
+    assert list(power_dict.keys()) == list(answer.keys())
+    for key in answer:
+        assert np.array_equal(power_dict[key], answer[key])
+    assert len(an.get_power_dict_of_region(cur, 'France')) == 0
+
+
+def test_timestep_index():
+    """Test if timestep_index finds the position of times
+       and marks times outside of the simulation"""
+    timestep = np.linspace(0, 9, num=10)
+    x = an.timestep_index(timestep, [-1, 0, 4, 9, 10])
+    answer = np.array([-1, 0, 4, 9, -1])
+    assert np.array_equal(x, answer)
+
+
+def test_evaluate_metrics():
+    """Tests if evaluate_metrics computes derived metrics
+       and reuses the intermediates from the cache"""
+    cur = get_sqlite()
+    cache = {}
+    x = an.evaluate_metrics(cur, ['u_util', 'power'], cache)
+    answer = an.get_power_dict(cur)
+    for key in answer:
+        assert np.array_equal(x['power'][key], answer[key])
+    results = cache[an.get_file_name(cur)]
+    for name in ['nat_u', 'fuel_into_reactors', 'agent_max_power']:
+        assert name in results
+    duration = an.get_timesteps(cur)[2]
+    assert len(results['nat_u']) == duration
+    assert len(results['fuel_into_reactors']) == duration
+    fuel = results['fuel_into_reactors']
+    y = an.evaluate_metrics(cur, ['fuel_into_reactors'], cache)
+    assert y['fuel_into_reactors'] is fuel
+    assert np.allclose(an.u_util_calc(cur, cache), x['u_util'])
+
+
+def test_evaluate_metrics_entered_power():
+    """Tests if the entered_power metric matches entered_power"""
+    cur = get_sqlite()
+    x = an.evaluate_metrics(cur, ['entered_power'])
+    answer = an.entered_power(cur)['power']
+    assert np.allclose(x['entered_power'], answer)
+
+
+def test_evaluate_metrics_entered_power_empty(tmpdir):
+    """Tests if the entered_power metric is zero in every timestep
+       of an output without reactors"""
+    file_name = str(tmpdir.join('output.sqlite'))
+    shutil.copy(test_sqlite_path, file_name)
+    con = lite.connect(file_name)
+    con.execute('DELETE FROM timeseriespower')
+    con.commit()
+    con.close()
+    cur = an.get_cursor(file_name)
+    x = an.evaluate_metrics(cur, ['entered_power'])
+    assert np.array_equal(x['entered_power'], np.zeros(10))
+
+
+def test_time_bucket():
+    """Test if time_bucket returns the sqlite expression
+       for every resolution"""
+    assert an.time_bucket('month') == 'time'
+    assert an.time_bucket('quarter') == '(time / 3)'
+    assert an.time_bucket('year', 'entertime') == '(entertime / 12)'
+    assert an.time_bucket(6) == '(time / 6)'
+    with pytest.raises(Exception):
+        an.time_bucket('week')
+
+
+def test_get_timesteps_resolution():
+    """Test if get_timesteps returns timesteps of a resolution
+       that stay consistent with timestep_to_years"""
+    cur = get_sqlite()
+    init_year, init_month, duration, timestep = an.get_timesteps(
+        cur, 'quarter')
+    assert duration == 4
+    assert np.array_equal(timestep, np.array([0, 3, 6, 9]))
+    years = an.timestep_to_years(init_year, timestep)
+    assert np.allclose(years, [2000, 2000.25, 2000.5, 2000.75])
+    numpy_width = an.get_timesteps(cur, np.int64(3))
+    assert np.array_equal(numpy_width[3], timestep)
+
+
+def test_facility_commodity_flux_resolution():
+    """Tests if facility_commodity_flux sums months into quarters"""
+    cur = get_sqlite()
+    agent_ids = ['39', '40', '42']
+    x = an.facility_commodity_flux(cur, agent_ids, ['uox'], False,
+                                   False, 'quarter')
+    answer = [0.6, 0.4, 0, 0]
+    assert len(x['uox']) == len(answer)
+    for expected, actual in zip(x['uox'], answer):
+        assert expected == pytest.approx(actual, abs=1e-5)
+
+
+def test_get_power_dict_resolution():
+    """Tests if get_power_dict returns the capacity at the
+       end of every timestep of the resolution"""
+    cur = get_sqlite()
+    power_dict = an.get_power_dict(cur, 2)
+    assert np.array_equal(power_dict['lwr_inst'], [1, 2, 1, 0, 0])
+    deployment = an.get_deployment_dict(cur, 2)
+    assert np.array_equal(deployment['fr_inst'], [0, 0, 1, 2, 1])
+
+
+def test_get_power_dict_without_lifetime(tmpdir):
+    """Tests if an agent with lifetime -1 that enters at month 0
+       keeps its capacity until the end"""
+    file_name = str(tmpdir.join('output.sqlite'))
+    shutil.copy(test_sqlite_path, file_name)
+    con = lite.connect(file_name)
+    con.execute('UPDATE agententry SET entertime = 0, lifetime = -1 '
+                'WHERE agentid = 39')
+    con.commit()
+    con.close()
+    cur = an.get_cursor(file_name)
+    answer = [1, 1, 2, 3, 3, 2, 2, 1, 1, 1]
+    assert np.allclose(an.get_power_dict(cur)['lwr_inst'], answer)
+    assert np.allclose(an.get_power_dict(cur, start=2)['lwr_inst'],
+                       answer[2:])
+    x = an.evaluate_metrics(cur, ['power'])
+    assert np.allclose(x['power']['lwr_inst'], answer)
+
+
+def test_scenario_query():
+    """Test if scenario_query runs a query on every schema"""
+    query = an.scenario_query(['scenario0', 'scenario1'],
+                              'SELECT duration FROM {db}.info')
+    answer = ('SELECT 0 AS scenario, * FROM '
+              '(SELECT duration FROM scenario0.info) UNION ALL '
+              'SELECT 1 AS scenario, * FROM '
+              '(SELECT duration FROM scenario1.info)')
+    assert query == answer
+
+
+def test_compare_outputs():
+    """Tests if the comparison of attached outputs returns
+       the timeseries of every output"""
+    cur = get_sqlite()
+    compare_cur, schemas = an.attach_outputs([test_sqlite_path] * 2)
+    x = an.compare_commodity_flux(compare_cur, schemas, 'uox')
+    answer = an.fuel_usage_timeseries(cur, ['uox'])['uox']
+    assert x.shape == (2, 10)
+    for row in x:
+        assert np.allclose(row, answer)
+    power = an.compare_power(compare_cur, schemas)
+    answer_power = sum(an.get_power_dict(cur).values())
+    assert np.allclose(power[1], answer_power)
+    swu = an.compare_swu(compare_cur, schemas, resolution='quarter')
+    assert np.allclose(swu[0], [2288.615, 3814.358, 3814.358, 3814.358])
+    fuel = an.compare_fuel_into_reactors(compare_cur, schemas)
+    assert np.allclose(fuel[0], an.fuel_into_reactors(cur))
+    nat_u = an.compare_nat_u(compare_cur, schemas, False)
+    assert np.allclose(nat_u[1], an.nat_u_timeseries(cur, False))
+
+
+def test_get_swu_matrix():
+    """Tests if get_swu_matrix returns swu and feed of every
+       enrichment plant as matrices"""
+    cur = get_sqlite()
+    agentid, swu, feed = an.get_swu_matrix(cur, with_feed=True,
+                                           is_cum=False)
+    assert agentid == ['30']
+    assert swu.shape == (1, 10)
+    answer = [0, 1144.307, 1144.307, 1144.307, 381.436, 0, 0, 0, 0, 0]
+    assert np.allclose(swu[0], answer)
+    assert np.allclose(feed[0], an.nat_u_timeseries(cur, False))
+
+
+def test_power_summary():
+    """Tests if power_summary summarizes the power of every agent"""
+    cur = get_sqlite()
+    table = an.power_summary(cur)
+    assert table == 'temp.agentpowersummary'
+    summary = cur.execute('SELECT * FROM ' + table +
+                          ' WHERE agentid = 40').fetchone()
+    assert summary['parentid'] == 31
+    assert summary['maxpower'] == 1000
+    assert summary['firstpowertime'] == 2
+    assert summary['lastpowertime'] == 6
+    assert summary['exittime'] == 6
+    summary = cur.execute('SELECT * FROM ' + table +
+                          ' WHERE agentid = 44').fetchone()
+    assert summary['exittime'] is None
+
+
+def test_build_sidecar(tmpdir):
+    """Tests if build_sidecar writes a sidecar file
+       that get_cursor attaches"""
+    file_name = str(tmpdir.join('output.sqlite'))
+    with open(test_sqlite_path, 'rb') as src, open(file_name, 'wb') as dst:
+        dst.write(src.read())
+    sidecar_file = an.build_sidecar(file_name)
+    assert sidecar_file == str(tmpdir.join('output.sidecar.sqlite'))
+    cur = an.get_cursor(file_name)
+    assert an.power_summary(cur) == 'sidecar.agentpowersummary'
+    power_dict = an.get_power_dict(cur)
+    answer = an.get_power_dict(get_sqlite())
+    for key in answer:
+        assert np.array_equal(power_dict[key], answer[key])
+    cur.connection.close()
+    # a new output written to the same file makes the sidecar stale
+    con = lite.connect(file_name)
+    con.execute('INSERT INTO transactions SELECT * FROM transactions '
+                'LIMIT 1')
+    con.commit()
+    con.close()
+    cur = an.get_cursor(file_name)
+    assert an.power_summary(cur) == 'temp.agentpowersummary'
+    assert not an.has_table(an.read_only_cursor(file_name),
+                            'agentpowersummary', 'sidecar')
+
+
+def test_sidecar_flows(tmpdir):
+    """Tests if the transaction based functions give the same
+       results with the sidecar attached"""
+    file_name = str(tmpdir.join('output.sqlite'))
+    with open(test_sqlite_path, 'rb') as src, open(file_name, 'wb') as dst:
+        dst.write(src.read())
+    an.build_sidecar(file_name)
+    cur = an.get_cursor(file_name)
+    assert an.transaction_table(cur) == 'sidecar.commodityflow AS flows'
+    assert (an.fuel_into_reactors(cur) ==
+            an.fuel_into_reactors(get_sqlite()))
+    assert (an.commod_per_inst(cur, 'uox', 10) ==
+            an.commod_per_inst(get_sqlite(), 'uox', 10))
+    trade = an.get_trade_dict(cur, 'enrichment', 'lwr', True, True)
+    answer = an.get_trade_dict(get_sqlite(), 'enrichment', 'lwr',
+                               True, True)
+    assert list(trade.keys()) == ['U235', 'U238']
+    assert list(answer.keys()) == ['U235', 'U238']
+    for key in answer:
+        assert np.allclose(trade[key], answer[key])
+    assert an.archetype_table(cur) == 'sidecar.agentarchetypes'
+    assert an.get_agent_ids(cur, 'Reactor') == \
+        an.get_agent_ids(get_sqlite(), 'Reactor')
+
+
+def test_archetype_ids():
+    """Tests if the archetype table finds agents by part of their spec
+       and by prototype, in any case, through its indexes"""
+    cur = get_sqlite()
+    assert an.get_agent_ids(cur, 'reactor') == ['39', '40', '41', '42',
+                                                '43', '44']
+    assert an.get_agent_ids(cur, 'cycamore:Sink') == ['29']
+    assert an.get_agent_ids(cur, 'nothing') == []
+    assert an.get_prototype_id(cur, 'LWR') == ['39', '40', '42']
+    regions = cur.execute(an.prototype_ids(cur, ['usa'], 'Region'))
+    assert [row['agentid'] for row in regions] == [23]
+    plan = cur.execute('EXPLAIN QUERY PLAN ' +
+                       an.archetype_ids(cur, 'Reactor')).fetchall()
+    assert 'INDEX' in ' '.join(row[-1] for row in plan)
+
+
+def test_canonical_compositions():
+    """Tests if canonical_compositions maps every qualid
+       to a qualid of identical composition"""
+    cur = get_sqlite()
+    qualid_map, compositions = an.canonical_compositions(cur)
+    assert len(qualid_map) == len(cur.execute(
+        'SELECT DISTINCT qualid FROM compositions').fetchall())
+    canon_ids = set(canon_id for qualid, canon_id in qualid_map)
+    assert canon_ids == set(row[0] for row in compositions)
+    for qualid, canon_id in qualid_map:
+        assert canon_id <= qualid
+
+
+def test_fetch_array():
+    """Tests if fetch_array fills a structured array in chunks"""
+    cur = get_sqlite()
+    query = ('SELECT time, sum(value) FROM timeseriespower '
+             'GROUP BY time ORDER BY time')
+    array = an.fetch_array(cur, query, an.TIMESERIES_COLUMNS, chunk_size=3)
+    answer = cur.execute(query).fetchall()
+    assert array.dtype.names == ('time', 'value')
+    assert array['time'].tolist() == [row[0] for row in answer]
+    assert np.allclose(array['value'], [row[1] for row in answer])
+    assert (an.get_timeseries(array, 10, False) ==
+            an.get_timeseries(answer, 10, False))
+    empty = an.fetch_array(cur, query.replace('GROUP', 'WHERE 0 GROUP'),
+                           an.TIMESERIES_COLUMNS)
+    assert len(empty) == 0
+
+
+def test_run_queries():
+    """Tests if run_queries returns the results of the calls in order"""
+    cur = get_sqlite()
+    power_dict, deployment_dict, fuel = an.run_queries(
+        cur, [(an.get_power_dict, ()),
+              (an.get_deployment_dict, ('month',)),
+              (an.fuel_into_reactors, (False,))], max_workers=2)
+    answer = an.get_power_dict(cur)
+    for key in answer:
+        assert np.array_equal(power_dict[key], answer[key])
+    answer = an.get_deployment_dict(cur)
+    for key in answer:
+        assert np.array_equal(deployment_dict[key], answer[key])
+    assert fuel == an.fuel_into_reactors(cur, False)
+    # without sidecar the summary is built once, on cur
+    assert an.has_table(cur, 'agentpowersummary', 'temp')
+
+
+def test_run_queries_sidecar(tmpdir):
+    """Tests if run_queries gives the same results on threads
+       when the sidecar is attached"""
+    file_name = str(tmpdir.join('output.sqlite'))
+    shutil.copy(test_sqlite_path, file_name)
+    an.build_sidecar(file_name)
+    cur = an.get_cursor(file_name)
+    power_dict, fuel = an.run_queries(
+        cur, [(an.get_power_dict, ()),
+              (an.fuel_into_reactors, (False,))], max_workers=2)
+    answer = an.get_power_dict(get_sqlite())
+    for key in answer:
+        assert np.array_equal(power_dict[key], answer[key])
+    assert fuel == an.fuel_into_reactors(get_sqlite(), False)
+    assert not an.has_table(cur, 'agentpowersummary', 'temp')
+
+
+def test_compact_isotopics():
+    """Tests if compact isotopic results hold the same values
+       as float32 rows of one matrix"""
+    cur = get_sqlite()
+    answer = an.get_trade_dict(cur, 'enrichment', 'lwr', True, True)
+    compact = an.get_trade_dict(cur, 'enrichment', 'lwr', True, True,
+                                compact=True)
+    assert sorted(compact.keys()) == sorted(answer.keys())
+    for key in answer:
+        assert compact[key].dtype == np.float32
+        assert np.allclose(compact[key], answer[key], rtol=1e-6)
+    assert compact['U235'].base is compact['U238'].base
+    answer = an.facility_commodity_flux_isotopics(cur, ['39'], ['uox'],
+                                                  False, False)
+    compact = an.facility_commodity_flux_isotopics(cur, ['39'], ['uox'],
+                                                   False, False,
+                                                   compact=True)
+    assert sorted(compact.keys()) == sorted(answer.keys())
+    for key in answer:
+        assert np.allclose(compact[key], answer[key], rtol=1e-6)
+
+
+def test_timeseries():
+    """Tests if TimeSeries derives cumulative, unit and
+       resolution views from one set of values"""
+    series = an.TimeSeries([1000, 0, 2000, 0, 0, 3000],
+                           np.linspace(0, 5, num=6))
+    assert series.tolist() == [1000, 0, 2000, 0, 0, 3000]
+    assert series.cumulative().tolist() == [1000, 1000, 3000, 3000,
+                                            3000, 6000]
+    assert series.cumulative() is series.cumulative()
+    assert series.to_tons().tolist() == [1, 0, 2, 0, 0, 3]
+    assert series.to_tons().units == 'tons'
+    quarterly = series.resample('quarter')
+    assert quarterly.tolist() == [3000, 3000]
+    assert quarterly.timestep.tolist() == [0, 3]
+    assert series.cumulative().resample(3).tolist() == [3000, 6000]
+    assert np.allclose(series.years(2000), 2000 + np.arange(6) / 12)
+    with pytest.raises(Exception):
+        series.to_tons().to_tons().resample(2).resample(3)
+
+
+def test_lazy_timeseries():
+    """Tests if lazy results match the list results"""
+    cur = get_sqlite()
+    series = an.fuel_into_reactors(cur, lazy=True)
+    assert isinstance(series, an.TimeSeries)
+    assert np.allclose(series.cumulative().to_tons(),
+                       an.fuel_into_reactors(cur))
+    assert np.allclose(series.to_tons(), an.fuel_into_reactors(cur, False))
+    assert np.allclose(an.nat_u_timeseries(cur, lazy=True).to_tons(),
+                       an.nat_u_timeseries(cur, False))
+
+
+def test_mass_balance():
+    """Tests if mass_balance sums inflow and outflow of every agent"""
+    cur = get_sqlite()
+    balance = an.mass_balance(cur)
+    row = list(balance['agentid']).index(27)
+    assert balance['prototype'][row] == 'uox_reprocessing'
+    assert np.allclose(balance['inflow'][row],
+                       [0, 0, 300, 0, 400, 0, 300, 0, 0, 0])
+    assert np.allclose(balance['outflow'][row],
+                       [0, 0, 0, 20.56, 0, 30.74, 0, 20.56, 0, 0])
+    proto_dict = an.prototype_balance(balance)
+    assert np.allclose(proto_dict['lwr']['inflow'].sum(), 1000)
+    assert np.allclose(proto_dict['lwr']['net'].sum(), 0)
+
+
+def test_inventory_violations():
+    """Tests if inventory_violations flags only inventories
+       that do not match the mass balance"""
+    cur = get_sqlite()
+    violations = an.inventory_violations(cur, an.mass_balance(cur))
+    assert [(x[0], x[2]) for x in violations] == [(30, 0)]
+    violations = an.inventory_violations(cur, an.mass_balance(cur, end=5))
+    assert [(x[0], x[2]) for x in violations] == [(30, 0)]
+    with pytest.raises(Exception):
+        an.inventory_violations(cur, an.mass_balance(cur, start=4))
+
+
+def test_inventory_violations_resolution(tmpdir):
+    """Tests if monthly inventories that match the balance are not
+       flagged when the balance has a coarser resolution"""
+    file_name = str(tmpdir.join('output.sqlite'))
+    shutil.copy(test_sqlite_path, file_name)
+    con = lite.connect(file_name)
+    holdings = [0, 0, 300, 279.44, 679.44, 648.7, 948.7, 928.14]
+    for simtime, quantity in enumerate(holdings):
+        con.execute('INSERT INTO resources (resourceid, quantity) '
+                    'VALUES (?, ?)', (10000 + simtime, quantity))
+        con.execute('INSERT INTO agentstateinventories '
+                    '(agentid, simtime, resourceid) VALUES (27, ?, ?)',
+                    (simtime, 10000 + simtime))
+    con.commit()
+    con.close()
+    cur = an.get_cursor(file_name)
+    violations = an.inventory_violations(cur, an.mass_balance(cur))
+    assert [(x[0], x[2]) for x in violations] == [(30, 0)]
+    # month 0 is not the end of a coarser timestep
+    for resolution in ['quarter', 4]:
+        balance = an.mass_balance(cur, resolution)
+        assert an.inventory_violations(cur, balance,
+                                       resolution=resolution) == []
+    balance = an.mass_balance(cur, 'quarter', end=4)
+    assert an.inventory_violations(cur, balance, resolution='quarter') == []
+
+
+def test_audit_without_inventories(tmpdir, capsys):
+    """Tests if audit skips the inventory check of outputs
+       recorded without explicit_inventory"""
+    file_name = str(tmpdir.join('output.sqlite'))
+    shutil.copy(test_sqlite_path, file_name)
+    con = lite.connect(file_name)
+    con.execute('DROP TABLE agentstateinventories')
+    con.commit()
+    con.close()
+    cur = an.get_cursor(file_name)
+    assert an.audit(cur) == []
+    assert 'Inventories are not checked' in capsys.readouterr().out
+    with pytest.raises(Exception):
+        an.inventory_violations(cur, an.mass_balance(cur))
+
+
+def test_agent_tree():
+    """Tests if agent_tree finds the ancestors of every agent"""
+    cur = get_sqlite()
+    tree = an.agent_tree(cur)
+    assert tree is an.agent_tree(cur)
+    position = np.searchsorted(tree['agentid'], 39)
+    assert tree['agentid'][tree['ancestors'][:, position]].tolist() == \
+        [31, 23]
+    index = an.ancestor_index(tree, [39, 41, 26, 23], [31, 35, 24])
+    assert index.tolist() == [0, 1, 2, -1]
+    # 38 falls between agents of the tree, 100 after all of them
+    with pytest.raises(ValueError):
+        an.ancestor_index(tree, [39, 38], [31, 35, 24])
+    with pytest.raises(ValueError):
+        an.ancestor_index(tree, [39], [31, 100])
+    sums, has_values = an.rollup(tree, [39, 40, 41], [1, 2, 4], [31, 35, 24])
+    assert sums.tolist() == [3, 4, 0]
+    assert has_values.tolist() == [True, True, False]
+
+
+def test_commodity_flux_region():
+    """Tests if commodity_flux_region sums flux by institution"""
+    cur = get_sqlite()
+    x = an.commodity_flux_region(cur, ['30'], ['uox'], True, False)
+    assert x['sink_source_facilities'] == []
+    assert x['fr_inst'] == []
+    assert np.allclose(x['lwr_inst'], [0, 0.3, 0.3, 0.3, 0.1, 0, 0, 0, 0, 0])
+
+
+def test_composition_tables():
+    """Tests if composition_tables builds canonical compositions
+       once per connection"""
+    cur = get_sqlite()
+    tables = an.composition_tables(cur)
+    assert tables == ('temp.qualidmap', 'temp.canoncompositions')
+    assert an.composition_tables(cur) == tables
+    canon = cur.execute('SELECT count(DISTINCT canonid) '
+                        'FROM temp.qualidmap').fetchone()[0]
+    qualids = cur.execute('SELECT count(DISTINCT qualid) '
+                          'FROM compositions').fetchone()[0]
+    assert canon < qualids
+    assert cur.execute('SELECT count(DISTINCT qualid) '
+                       'FROM temp.canoncompositions').fetchone()[0] == canon
+
+
+def test_isotope_query():
+    """Tests if isotope_query sums the mass of every isotope
+       over all traded compositions"""
+    cur = get_sqlite()
+    rows = cur.execute(an.isotope_query(cur, 'time', 'receiverid = 27 '
+                                        'AND commodity = "uox_waste"')
+                       ).fetchall()
+    masses = dict(((row[0], row[2]), row[1]) for row in rows)
+    assert masses[(2, 922350000)] == pytest.approx(13.19967, abs=1e-4)
+    assert masses[(2, 942380000)] == pytest.approx(20)
+    assert masses[(4, 922380000)] == pytest.approx(351.80033, abs=1e-4)
+
+
+def test_nuclide_condition():
+    """Tests if nuclide_condition selects nuclides, elements and groups"""
+    assert (an.nuclide_condition(['Pu']) ==
+            '(nucid BETWEEN 940000000 AND 949999999)')
+    assert (an.nuclide_condition(['MA'], 'x') ==
+            '(x BETWEEN 930000000 AND 939999999 OR '
+            'x BETWEEN 950000000 AND 1189999999)')
+    assert an.nuclide_condition([922350000]) == '(nucid = 922350000)'
+    with pytest.raises(Exception):
+        an.nuclide_condition([])
+
+
+def test_isotopics_nuclides():
+    """Tests if the nuclide filter only returns the wanted nuclides"""
+    cur = get_sqlite()
+    x = an.facility_commodity_flux_isotopics(cur, ['27'], ['uox_waste'],
+                                             False, nuclides=['Pu'])
+    answer = an.facility_commodity_flux_isotopics(cur, ['27'],
+                                                  ['uox_waste'], False)
+    assert list(x.keys()) == ['Pu238']
+    assert x['Pu238'] == answer['Pu238']
+    x = an.get_trade_dict(cur, 'enrichment', 'lwr', True, True,
+                          nuclides=[922350000])
+    assert list(x.keys()) == ['U235']
+
+
+def test_time_window():
+    """Tests if time_window converts timesteps and years to months"""
+    cur = get_sqlite()
+    assert an.time_window(cur) == (0, 9)
+    assert an.time_window(cur, 2, 5) == (2, 5)
+    assert an.time_window(cur, None, 100) == (0, 9)
+    assert an.time_window(cur, 2000, 2000, in_years=True) == (0, 9)
+    assert an.window_condition(cur, 'x', 3) == 'x BETWEEN 3 AND 9'
+    with pytest.raises(Exception):
+        an.time_window(cur, 2001, None, in_years=True)
+    timestep = an.get_timesteps(cur, 'quarter', 2, 8)[3]
+    assert timestep.tolist() == [2, 5, 8]
+
+
+def test_time_window_results():
+    """Tests if windowed results are slices of the whole results"""
+    cur = get_sqlite()
+    agent_ids = an.get_agent_ids(cur, 'Reactor')
+    x = an.facility_commodity_flux(cur, agent_ids, ['uox'], False, False,
+                                   start=2, end=6)
+    answer = an.facility_commodity_flux(cur, agent_ids, ['uox'], False,
+                                        False)
+    assert np.allclose(x['uox'], answer['uox'][2:7])
+    x = an.facility_commodity_flux(cur, agent_ids, ['uox'], False, False,
+                                   lazy=True, start=1)['uox']
+    answer = an.facility_commodity_flux(cur, agent_ids, ['uox'], False,
+                                        False, 'quarter', lazy=True,
+                                        start=1)['uox']
+    assert np.allclose(x.resample('quarter'), answer)
+    assert np.allclose(x.resample('quarter').timestep, answer.timestep)
+    x = an.get_power_dict(cur, start=3, end=8)
+    answer = an.get_power_dict(cur)
+    for key in answer:
+        assert np.allclose(x[key], answer[key][3:9])
+    x = an.get_deployment_dict(cur, start=3)
+    answer = an.get_deployment_dict(cur)
+    for key in answer:
+        assert np.allclose(x[key], answer[key][3:])
+    x = an.nat_u_timeseries(cur, False, 'quarter', start=1)
+    answer = an.nat_u_timeseries(cur, False)
+    assert np.allclose(x, [sum(answer[1:4]), sum(answer[4:7]),
+                           sum(answer[7:10])])
+
+
+def test_preview_commodity_flux():
+    """Test if a full sample gives the exact flux with no error,
+    and a time stride scales the sampled months"""
+    cur = get_sqlite()
+    agent_ids = an.get_agent_ids(cur, 'Reactor')
+    answer = an.facility_commodity_flux(cur, agent_ids, ['uox'], False)
+    x, error = an.preview_commodity_flux(cur, agent_ids, ['uox'], False,
+                                         fraction=1)
+    assert np.allclose(x['uox'], answer['uox'])
+    assert np.allclose(error['uox'], 0)
+    x, error = an.preview_commodity_flux(cur, agent_ids, ['uox'], False,
+                                         fraction=None, stride=2,
+                                         is_cum=False, resolution=4)
+    assert np.allclose(x['uox'], [0.6, 0.2, 0.0])
+    assert np.isfinite(error['uox'][:2]).all()
+    with pytest.raises(Exception):
+        an.preview_trade(cur, 'enrichment', 'lwr', True, fraction=0.5,
+                         stride=2)
+
+
+def test_scenario_diff(tmp_path):
+    """Test if outputs starting in different months are aligned
+    and the divergence of a changed output is found"""
+    variant = str(tmp_path / 'variant.sqlite')
+    shutil.copy(test_sqlite_path, variant)
+    con = lite.connect(variant)
+    con.execute('UPDATE info SET initialmonth = initialmonth + 2')
+    con.commit()
+    con.close()
+    cur = get_sqlite()
+    cache = {}
+    x = an.diff_outputs(test_sqlite_path, [variant], ['power', 'nat_u'],
+                        cache)[variant]
+    power = an.get_power_dict(cur)
+    assert x['labels'] == ['power/' + key for key in power] + ['nat_u']
+    assert len(x['years']) == 12
+    assert np.isnan(x['variant'][:, :2]).all()
+    assert np.isnan(x['baseline'][:, -2:]).all()
+    for row, key in enumerate(power):
+        assert np.allclose(x['variant'][row, 2:], power[key])
+        assert np.allclose(x['difference'][row, 2:-2],
+                           power[key][:-2] - power[key][2:])
+    assert len(cache) == 2
+
+    x = an.scenario_diff(cur, cur, ['power', 'deployment'])
+    assert np.allclose(x['difference'], 0)
+    assert np.isnan(x['divergence']).all()
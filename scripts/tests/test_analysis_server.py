@@ -0,0 +1,107 @@
+import asyncio
+import numpy as np
+import os
+import sys
+path = os.path.realpath(__file__)
+sys.path.append(os.path.dirname(os.path.dirname(path)))
+import analysis as an
+import analysis_server as server
+
+dir = os.path.dirname(__file__)
+test_sqlite_path = os.path.join(dir, 'test.sqlite')
+
+
+def test_handle_request():
+    """Test if handle_request answers a metric and caches it"""
+    service = server.new_service()
+    server.register_output(service, test_sqlite_path)
+    request = {'file': test_sqlite_path, 'metric': 'power'}
+    response = server.run(server.handle_request(service, request))
+    answer = [0, 1, 2, 2, 2, 1, 1, 0, 0, 0]
+    assert np.allclose(response['result']['lwr_inst'], answer)
+    assert server.request_key(request) in service['cache']
+    server.close_service(service)
+
+
+def test_handle_request_lazy():
+    """Test if lazy TimeSeries results are sent as lists and
+       results that cannot be sent as json are not cached"""
+    service = server.new_service()
+    server.register_output(service, test_sqlite_path)
+    request = {'file': test_sqlite_path, 'metric': 'fuel_into_reactors',
+               'kwargs': {'lazy': True}}
+    response = server.run(server.handle_request(service, request))
+    cur = an.get_cursor(test_sqlite_path)
+    answer = an.fuel_into_reactors(cur, lazy=True)
+    assert response['result'] == answer.tolist()
+    server.SERVED['cursor'] = lambda cur: cur
+    request = {'file': test_sqlite_path, 'metric': 'cursor'}
+    response = server.run(server.handle_request(service, request))
+    del server.SERVED['cursor']
+    assert 'error' in response
+    assert server.request_key(request) not in service['cache']
+    server.close_service(service)
+
+
+def test_handle_request_coalesce():
+    """Test if concurrent requests for the same metric
+       are computed only once"""
+    calls = []
+
+    def count_power(cur):
+        calls.append(1)
+        return an.get_power_dict(cur)
+
+    server.SERVED['count_power'] = count_power
+    service = server.new_service()
+    server.register_output(service, test_sqlite_path)
+    request = {'file': test_sqlite_path, 'metric': 'count_power'}
+
+    async def run():
+        return await asyncio.gather(
+            *[server.handle_request(service, request) for i in range(5)])
+
+    responses = server.run(run())
+    del server.SERVED['count_power']
+    server.close_service(service)
+    assert len(calls) == 1
+    for response in responses:
+        assert response['result'] == responses[0]['result']
+
+
+def test_handle_request_error():
+    """Test if unknown metrics and files return an error"""
+    service = server.new_service()
+    response = server.run(server.handle_request(
+        service, {'file': test_sqlite_path, 'metric': 'power'}))
+    assert 'error' in response
+    response = server.run(server.handle_request(
+        service, {'file': test_sqlite_path, 'metric': 'foo'}))
+    assert 'error' in response
+
+
+def test_serve():
+    """Test if a client gets results from a running service"""
+    service = server.new_service()
+
+    async def run():
+        tcp_server = await server.serve(service, port=0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        await server.send_request({'register': test_sqlite_path},
+                                  port=port)
+        response = await server.send_request(
+            {'file': test_sqlite_path, 'metric': 'swu',
+             'kwargs': {'is_cum': False, 'resolution': 'quarter'}},
+            port=port)
+        lazy = await server.send_request(
+            {'file': test_sqlite_path, 'metric': 'nat_u',
+             'kwargs': {'is_cum': False, 'lazy': True}}, port=port)
+        tcp_server.close()
+        await tcp_server.wait_closed()
+        return response, lazy
+
+    response, lazy = server.run(run())
+    server.close_service(service)
+    assert len(lazy['result']) == 10
+    answer = [2288.615, 1525.743, 0, 0]
+    assert np.allclose(response['result']['Enrichment_30'], answer)
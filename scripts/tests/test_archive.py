@@ -0,0 +1,63 @@
+import numpy as np
+import os
+import sys
+path = os.path.realpath(__file__)
+sys.path.append(os.path.dirname(os.path.dirname(path)))
+import analysis as an
+import archive as ar
+
+dir = os.path.dirname(__file__)
+test_sqlite_path = os.path.join(dir, 'test.sqlite')
+
+
+def get_sqlite():
+    return an.get_cursor(test_sqlite_path)
+
+
+def test_compress_chunk():
+    """Test if compressed chunks are read back unchanged"""
+    for values in [np.linspace(0, 1, 37), np.arange(5, dtype=np.int32),
+                   np.zeros(0)]:
+        x = ar.decompress_chunk(ar.compress_chunk(values), values.dtype.str)
+        assert x.dtype == values.dtype
+        assert np.array_equal(x, values)
+
+
+def test_read_array(tmpdir):
+    """Test if parts of a timeseries are read from the chunks holding them
+    and rewriting a timeseries replaces it"""
+    cur = ar.open_archive(str(tmpdir.join('archive.sqlite')))
+    values = np.arange(250, dtype=float)
+    ar.write_array(cur, 'base', 'power', values, 'usa', 'GWe', 2000, 1,
+                   chunk_size=100)
+    assert cur.execute('SELECT count(*) FROM chunks').fetchone()[0] == 3
+    assert np.array_equal(ar.read_array(cur, 'base', 'power', 'usa'),
+                          values)
+    assert np.array_equal(ar.read_array(cur, 'base', 'power', 'usa',
+                                        95, 105), values[95:105])
+    x = ar.read_array(cur, 'base', 'power', 'usa', 2001, 2002, True)
+    assert np.array_equal(x, values[12:36])
+    ar.write_array(cur, 'base', 'power', values[:10], 'usa', chunk_size=100)
+    assert cur.execute('SELECT count(*) FROM chunks').fetchone()[0] == 1
+    assert len(ar.archive_index(cur)) == 1
+
+
+def test_archive_output(tmpdir):
+    """Test if archived metrics are read back with their metadata"""
+    archive_file = str(tmpdir.join('archive.sqlite'))
+    ar.archive_output(archive_file, test_sqlite_path,
+                      ['power', 'nat_u'], 'test')
+    cur = ar.open_archive(archive_file)
+    index = ar.archive_index(cur, metric='power')
+    assert set(row['key'] for row in index) == set(
+        an.get_power_dict(get_sqlite()).keys())
+    assert index[0]['units'] == 'GWe'
+    assert index[0]['inityear'] == 2000
+    assert index[0]['fingerprint'] == ar.file_fingerprint(test_sqlite_path)
+    power = ar.read_metric(cur, 'test', 'power', 2, 5)
+    answer = an.get_power_dict(get_sqlite())
+    for key in answer:
+        assert np.allclose(power[key], answer[key][2:5])
+    nat_u = ar.read_metric(cur, 'test', 'nat_u')
+    assert np.allclose(nat_u, an.evaluate_metrics(get_sqlite(),
+                                                  ['nat_u'])['nat_u'])
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import os
+import sys
+path = os.path.realpath(__file__)
+sys.path.append(os.path.dirname(os.path.dirname(path)))
+import ensemble as en
+
+dir = os.path.dirname(__file__)
+test_sqlite_path = os.path.join(dir, 'test.sqlite')
+
+
+def test_sketch_quantiles_exact():
+    """Test if a sketch with few runs returns the exact median"""
+    sketch = en.new_sketch(2)
+    for run in [[1, 10], [3, 30], [2, 20]]:
+        en.add_run(sketch, run)
+    x = en.sketch_quantiles(sketch, [0, 0.5, 1])
+    answer = np.array([[1, 10], [2, 20], [3, 30]])
+    assert np.allclose(x, answer)
+
+
+def test_sketch_bounded_memory():
+    """Test if a sketch stays bounded and estimates percentiles
+       of many runs"""
+    np.random.seed(1)
+    sketch = en.new_sketch(3, size=50)
+    runs = np.random.normal(100, 10, size=(2000, 3))
+    for run in runs:
+        en.add_run(sketch, run)
+    assert sketch['means'].shape[1] <= 100
+    x = en.sketch_quantiles(sketch, [0.05, 0.5, 0.95])
+    answer = np.percentile(runs, [5, 50, 95], axis=0)
+    assert np.allclose(x, answer, atol=1)
+
+
+def test_merge_sketches():
+    """Test if merging two sketches equals one sketch of all runs"""
+    np.random.seed(2)
+    runs = np.random.uniform(0, 1, size=(400, 4))
+    sketch1 = en.new_sketch(4, size=50)
+    sketch2 = en.new_sketch(4, size=50)
+    for run in runs[:200]:
+        en.add_run(sketch1, run)
+    for run in runs[200:]:
+        en.add_run(sketch2, run)
+    merged = en.merge_sketches(sketch1, sketch2)
+    assert merged['count'] == 400
+    x = en.sketch_quantiles(merged, [0.05, 0.5, 0.95])
+    answer = np.percentile(runs, [5, 50, 95], axis=0)
+    assert np.allclose(x, answer, atol=0.02)
+
+
+def test_add_run_duration():
+    """Test if add_run refuses runs of a different duration"""
+    sketch = en.new_sketch(3)
+    with pytest.raises(Exception):
+        en.add_run(sketch, [1, 2])
+
+
+def test_ensemble_sketches():
+    """Test if ensemble_sketches builds capacity and
+       deployment bands from output files"""
+    sketch_dict = en.ensemble_sketches([test_sqlite_path] * 3)
+    bands = en.percentile_bands(sketch_dict['capacity'])
+    assert list(bands.keys()) == ['5%', '50%', '95%']
+    answer = np.array([0, 1, 2, 2, 2, 1, 1, 0, 0, 0])
+    for key in bands:
+        assert np.allclose(bands[key], answer)
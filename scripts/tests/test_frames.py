@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import os
+import sys
+path = os.path.realpath(__file__)
+sys.path.append(os.path.dirname(os.path.dirname(path)))
+import analysis as an
+import frames as fr
+
+pd = pytest.importorskip('pandas')
+
+dir = os.path.dirname(__file__)
+test_sqlite_path = os.path.join(dir, 'test.sqlite')
+
+
+def get_sqlite():
+    return an.get_cursor(test_sqlite_path)
+
+
+def test_read_frame_chunks():
+    """Test if read_frame merges chunks into compact dtypes"""
+    cur = get_sqlite()
+    query = ('SELECT time, commodity, quantity '
+             'FROM transactions INNER JOIN resources '
+             'ON resources.resourceid = transactions.resourceid '
+             'WHERE quantity < 1e9')
+    frame = fr.read_frame(cur, query, fr.FLUX_COLUMNS, chunk_size=2)
+    assert str(frame['time'].dtype) == 'int32'
+    assert str(frame['commodity'].dtype) == 'category'
+    answer = fr.read_frame(cur, query, fr.FLUX_COLUMNS)
+    assert frame['commodity'].tolist() == answer['commodity'].tolist()
+    assert str(frame['mass'].dtype) == 'float32'
+    assert len(frame) == len(cur.execute(query).fetchall())
+    assert set(frame['commodity']) == set(
+        row[1] for row in cur.execute(query).fetchall())
+    with pytest.raises(MemoryError):
+        fr.read_frame(cur, query, fr.FLUX_COLUMNS, chunk_size=2,
+                      max_bytes=100)
+
+
+def test_commodity_flux_frame():
+    """Test if commodity_flux_frame matches facility_commodity_flux"""
+    cur = get_sqlite()
+    agent_ids = an.get_agent_ids(cur, 'Reactor')
+    frame = fr.commodity_flux_frame(cur, agent_ids, ['uox', 'mox'], False)
+    answer = an.facility_commodity_flux(cur, agent_ids, ['uox', 'mox'],
+                                        False, False)
+    for comm in ['uox', 'mox']:
+        flux = frame[frame['commodity'] == comm]
+        x = np.zeros(10)
+        x[flux['time']] = flux['mass'] * 0.001
+        assert np.allclose(x, answer[comm] or np.zeros(10))
+
+
+def test_frame_window():
+    """Test if frames restricted to a time window match the
+       windowed analysis results"""
+    cur = get_sqlite()
+    agent_ids = an.get_agent_ids(cur, 'Reactor')
+    frame = fr.commodity_flux_frame(cur, agent_ids, ['uox'], False,
+                                    'quarter', start=2, end=8)
+    answer = an.facility_commodity_flux(cur, agent_ids, ['uox'], False,
+                                        False, 'quarter', lazy=True,
+                                        start=2, end=8)
+    x = np.zeros(len(answer['uox']))
+    x[frame['time']] = frame['mass']
+    assert np.allclose(x, answer['uox'])
+    frame = fr.fuel_into_reactors_frame(cur, start=3, end=5)
+    answer = an.fuel_into_reactors(cur, False, lazy=True, start=3, end=5)
+    x = np.zeros(len(answer))
+    x[frame['time']] = frame['mass']
+    assert np.allclose(x, answer)
+    frame = fr.power_frame(cur, start=2, end=5)
+    assert frame['time'].max() == 3
+
+
+def test_power_frame():
+    """Test if power_frame matches get_power_dict"""
+    cur = get_sqlite()
+    frame = fr.power_frame(cur)
+    answer = an.get_power_dict(cur)
+    for key in answer:
+        power = frame[frame['government'] == key]
+        assert power['time'].tolist() == list(range(10))
+        assert np.allclose(power['power'], answer[key])
@@ -0,0 +1,53 @@
+import numpy as np
+import os
+import sys
+path = os.path.realpath(__file__)
+sys.path.append(os.path.dirname(os.path.dirname(path)))
+import analysis as an
+import spatial as sp
+
+dir = os.path.dirname(__file__)
+test_sqlite_path = os.path.join(dir, 'test.sqlite')
+coordinates = {'LWR': (40.0, -88.0), 'fr': (40.0004, -88.2)}
+
+
+def get_sqlite():
+    return an.get_cursor(test_sqlite_path)
+
+
+def test_site_index():
+    """Test if facilities are grouped by site and by grid cell"""
+    latitude = np.array([40.0, 40.0001, 41.2, -10.0])
+    longitude = np.array([-88.0, -88.0, -88.3, 20.0])
+    site_lat, site_lon, index = sp.site_index(latitude, longitude)
+    assert len(site_lat) == 3
+    assert index[0] == index[1]
+    site_lat, site_lon, index = sp.site_index(latitude, longitude, 5)
+    assert len(site_lat) == 2
+    assert index[0] == index[2]
+    assert np.allclose(site_lat, [-7.5, 42.5])
+    assert np.allclose(site_lon, [22.5, -87.5])
+
+
+def test_spatial_capacity():
+    """Test if site capacities add up to the capacity of the governments"""
+    cur = get_sqlite()
+    sites = sp.spatial_capacity(cur, coordinates)
+    assert np.allclose(sites['longitude'], [-88.2, -88.0])
+    answer = an.get_power_dict(cur)
+    assert np.allclose(sites['values'].sum(axis=0),
+                       sum(answer.values(), np.zeros(10)))
+    sites = sp.spatial_capacity(cur, coordinates, grid=10)
+    assert sites['values'].shape == (1, 10)
+    assert len(sp.spatial_capacity(cur)['latitude']) == 0
+
+
+def test_spatial_discharge():
+    """Test if site discharges add up to the outflux of the reactors"""
+    cur = get_sqlite()
+    sites = sp.spatial_discharge(cur, ['uox_waste'], coordinates,
+                                 is_cum=False)
+    reactors = an.get_agent_ids(cur, 'Reactor')
+    answer = an.facility_commodity_flux(cur, reactors, ['uox_waste'],
+                                        True, False)
+    assert np.allclose(sites['values'].sum(axis=0), answer['uox_waste'])
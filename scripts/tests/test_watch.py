@@ -0,0 +1,84 @@
+import numpy as np
+import os
+import shutil
+import sqlite3 as lite
+import sys
+path = os.path.realpath(__file__)
+sys.path.append(os.path.dirname(os.path.dirname(path)))
+import analysis as an
+import watch as wa
+
+dir = os.path.dirname(__file__)
+test_sqlite_path = os.path.join(dir, 'test.sqlite')
+
+
+def get_sqlite():
+    return an.get_cursor(test_sqlite_path)
+
+
+def partial_output(tmp_path):
+    """Copies the test output, keeping half of its transactions
+    and none of its agent exits, like a simulation still running"""
+    file_name = str(tmp_path / 'running.sqlite')
+    shutil.copy(test_sqlite_path, file_name)
+    con = lite.connect(file_name)
+    half = con.execute('SELECT max(rowid) FROM transactions').fetchone()[0]
+    con.execute('DELETE FROM transactions WHERE rowid > ' + str(half // 2))
+    con.execute('DELETE FROM agentexit')
+    con.execute('DELETE FROM finish')
+    con.commit()
+    return file_name, con
+
+
+def test_poll(tmp_path):
+    """Test if polling a growing output reads only the new rows
+    and gives the results of the finished output"""
+    file_name, con = partial_output(tmp_path)
+    state = wa.new_watch(file_name)
+    assert wa.poll(state)
+    first = dict(state['last'])
+    con.execute('ATTACH DATABASE "' + test_sqlite_path + '" AS done')
+    for table in ['transactions', 'agentexit', 'finish']:
+        con.execute('INSERT INTO ' + table + ' SELECT * FROM done.' +
+                    table + ' WHERE rowid NOT IN '
+                    '(SELECT rowid FROM main.' + table + ')')
+    con.commit()
+    assert wa.poll(state, max_rows=1)
+    assert state['last']['transactions'] == first['transactions'] + 1
+    while state['last'] != first:
+        first = dict(state['last'])
+        assert wa.poll(state)
+    assert state['finished']
+    power_dict, deployment, flux_dict = wa.watch_results(state)
+    cur = get_sqlite()
+    answer = an.get_power_dict(cur)
+    for key in answer:
+        assert np.allclose(power_dict[key], answer[key])
+    answer = an.get_deployment_dict(cur)
+    for key in answer:
+        assert np.allclose(deployment[key], answer[key])
+    agent_ids = [str(row['agentid']) for row in
+                 cur.execute('SELECT agentid FROM agententry')]
+    answer = an.facility_commodity_flux(cur, agent_ids, ['uox'], False)
+    assert np.allclose(flux_dict['uox'], answer['uox'])
+    con.close()
+
+
+def test_poll_locked(tmp_path):
+    """Test if a poll gives up while the writer holds a lock"""
+    file_name, con = partial_output(tmp_path)
+    state = wa.new_watch(file_name, timeout=0.01)
+    con.execute('BEGIN EXCLUSIVE')
+    assert not wa.poll(state)
+    con.rollback()
+    assert wa.poll(state)
+    con.close()
+
+
+def test_watch(tmp_path):
+    """Test if watching a finished output draws its plots once"""
+    outputname = str(tmp_path / 'watch')
+    state = wa.watch(test_sqlite_path, interval=0, outputname=outputname,
+                     max_polls=5)
+    assert os.path.isfile(outputname + '.png')
+    assert state['finished']
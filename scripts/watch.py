@@ -0,0 +1,313 @@
+import collections
+import numpy as np
+import matplotlib.pyplot as plt
+import sqlite3 as lite
+import sys
+import time
+import analysis as an
+
+
+# tables read by poll, with the last rowid seen kept per table
+WATCHED = ['agententry', 'agentexit', 'timeseriespower', 'transactions']
+
+
+def new_watch(file_name, timeout=1.0):
+    """Returns the state of a watched output file
+
+    The file is opened read-only and every read waits at most
+    timeout seconds for the simulation to release its locks.
+
+    Parameters
+    ----------
+    file_name: str
+        Cyclus output file (.sqlite), possibly still being written
+    timeout: float
+        seconds to wait for a lock before giving up on a poll
+
+    Returns
+    -------
+    state: dictionary
+        cur: read-only cursor in autocommit mode
+        last: key=table, value=last rowid read
+        timestep: timesteps of the simulation, None until known
+        agents: key=agentid, value=(parentid, kind, prototype,
+            entertime, lifetime)
+        maxpower: key=agentid, value=largest power produced
+        exits: key=agentid, value=exittime
+        flux: key=commodity, value=numpy array of mass traded [kg]
+        changed: True if rows were read since the last draw
+        finished: True once the simulation has written its finish row
+        drawn: time of the last draw, figure: figure drawn on
+    """
+    con = lite.connect('file:' + file_name + '?mode=ro', uri=True,
+                       timeout=timeout, check_same_thread=False)
+    con.row_factory = lite.Row
+    # transactions are opened and closed by poll itself
+    con.isolation_level = None
+    return {'cur': con.cursor(),
+            'last': collections.OrderedDict((table, 0)
+                                            for table in WATCHED),
+            'timestep': None,
+            'agents': collections.OrderedDict(),
+            'maxpower': {},
+            'exits': {},
+            'flux': collections.OrderedDict(),
+            'changed': False,
+            'finished': False,
+            'drawn': 0.0,
+            'figure': None}
+
+
+def is_locked(error):
+    """Returns True if an sqlite error means the writer holds a lock
+
+    Parameters
+    ----------
+    error: sqlite3.OperationalError
+
+    Returns
+    -------
+    bool
+    """
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def poll(state, max_rows=10000):
+    """Reads the rows written since the last poll and updates the state
+
+    At most max_rows rows are read per table, so a poll keeps the
+    file's read lock only briefly, the rest is read by the next polls.
+
+    Parameters
+    ----------
+    state: dictionary
+        state from new_watch
+    max_rows: int
+        maximum number of rows read per table
+
+    Returns
+    -------
+    bool
+        True if the poll read every table, False if the file was
+        locked by the simulation or is not initialized yet
+    """
+    cur = state['cur']
+    try:
+        cur.execute('BEGIN')
+        try:
+            if state['timestep'] is None:
+                if not an.has_table(cur, 'info') or \
+                        cur.execute('SELECT count(*) FROM info'
+                                    ).fetchone()[0] == 0:
+                    return False
+                state['timestep'] = an.get_timesteps(cur)[3]
+            for table in WATCHED:
+                if an.has_table(cur, table):
+                    read_table(state, table, max_rows)
+            if an.has_table(cur, 'finish'):
+                state['finished'] = cur.execute(
+                    'SELECT count(*) FROM finish').fetchone()[0] > 0
+        finally:
+            cur.execute('COMMIT')
+    except lite.OperationalError as error:
+        if not is_locked(error):
+            raise
+        return False
+    return True
+
+
+def read_table(state, table, max_rows):
+    """Reads the new rows of a watched table into the state
+
+    Parameters
+    ----------
+    state: dictionary
+        state from new_watch
+    table: str
+        one of WATCHED
+    max_rows: int
+        maximum number of rows read
+    """
+    cur = state['cur']
+    last = state['last'][table]
+    after = (' WHERE ' + table + '.rowid > ' + str(last) +
+             ' ORDER BY ' + table + '.rowid LIMIT ' + str(int(max_rows)))
+    if table == 'agententry':
+        rows = cur.execute('SELECT rowid, agentid, parentid, kind, '
+                           'prototype, entertime, lifetime '
+                           'FROM agententry' + after).fetchall()
+        for row in rows:
+            state['agents'][row[1]] = tuple(row[2:])
+    elif table == 'agentexit':
+        rows = cur.execute('SELECT rowid, agentid, exittime '
+                           'FROM agentexit' + after).fetchall()
+        for row in rows:
+            state['exits'][row[1]] = row[2]
+    elif table == 'timeseriespower':
+        rows = cur.execute('SELECT rowid, agentid, value '
+                           'FROM timeseriespower' + after).fetchall()
+        for row in rows:
+            state['maxpower'][row[1]] = max(
+                state['maxpower'].get(row[1], row[2]), row[2])
+    else:
+        rows = cur.execute('SELECT transactions.rowid, time, commodity, '
+                           'quantity FROM transactions '
+                           'LEFT OUTER JOIN resources '
+                           'ON resources.resourceid = '
+                           'transactions.resourceid' + after).fetchall()
+        # a transaction whose resource is not written yet is read
+        # again, with the ones after it, by the next poll
+        for i, row in enumerate(rows):
+            if row[3] is None:
+                rows = rows[:i]
+                break
+        duration = len(state['timestep'])
+        for row in rows:
+            if row[2] not in state['flux']:
+                state['flux'][row[2]] = np.zeros(duration)
+            if 0 <= row[1] < duration:
+                state['flux'][row[2]][row[1]] += row[3]
+    if len(rows) > 0:
+        state['last'][table] = rows[-1][0]
+        state['changed'] = True
+
+
+def watch_results(state):
+    """Returns the results read so far, like the analysis functions
+
+    Parameters
+    ----------
+    state: dictionary
+        state from new_watch, polled at least once
+
+    Returns
+    -------
+    power_dict: dictionary
+        "dictionary with key=government, and
+        value=timeseries of installed capacity" (see get_power_dict)
+    deployment: dictionary
+        "dictionary with key=government, and
+        value=timeseries number of reactors" (see get_deployment_dict)
+    flux_dict: dictionary
+        "dictionary with key=commodity, and
+        value=cumulative timeseries of mass traded in tons"
+    """
+    governments = [{'prototype': agent[2], 'agentid': agentid}
+                   for agentid, agent in state['agents'].items()
+                   if agent[1] == 'Inst']
+    power_ids = [agentid for agentid in state['maxpower']
+                 if agentid in state['agents']]
+    entry = np.zeros(len(power_ids), dtype=an.CAPACITY_COLUMNS)
+    for i, agentid in enumerate(power_ids):
+        agent = state['agents'][agentid]
+        entry[i] = (state['maxpower'][agentid], agentid, agent[0],
+                    agent[3], agent[3] + agent[4])
+    exit_ids = [agentid for agentid in power_ids
+                if agentid in state['exits']]
+    exit_step = np.zeros(len(exit_ids), dtype=an.EXIT_COLUMNS)
+    for i, agentid in enumerate(exit_ids):
+        exit_step[i] = (state['maxpower'][agentid], agentid,
+                        state['agents'][agentid][0], state['exits'][agentid])
+    timestep = state['timestep']
+    power_dict = an.capacity_calc(governments, timestep, entry)
+    deployment = an.reactor_deployments(
+        governments, timestep, entry[[name for name, dtype
+                                      in an.ENTRY_COLUMNS]], exit_step)
+    flux_dict = collections.OrderedDict(
+        (commodity, np.cumsum(values) * 0.001)
+        for commodity, values in state['flux'].items())
+    return power_dict, deployment, flux_dict
+
+
+def draw_watch(state, outputname='watch'):
+    """Draws the power, deployment and flux read so far
+    and saves them to outputname.png
+
+    The figure is kept in the state and redrawn in place.
+
+    Parameters
+    ----------
+    state: dictionary
+        state from new_watch, polled at least once
+    outputname: str
+        name of the png file
+    """
+    if state['figure'] is None:
+        state['figure'], axes = plt.subplots(3, 1, figsize=(12, 12))
+    figure = state['figure']
+    titles = [('Installed Capacity', 'Capacity [GWe]'),
+              ('Reactors Deployed', 'Number of Reactors'),
+              ('Cumulative Commodity Flux', 'Mass [MTHM]')]
+    for ax, values, (title, ylabel) in zip(figure.axes,
+                                           watch_results(state), titles):
+        ax.clear()
+        for key, series in values.items():
+            ax.plot(state['timestep'], series, label=key)
+        ax.set_title(title)
+        ax.set_ylabel(ylabel)
+        ax.grid(True)
+        if len(values) > 0:
+            ax.legend(loc='upper left', fontsize='small')
+    figure.axes[-1].set_xlabel('Time [months]')
+    figure.savefig(outputname + '.png', format='png', bbox_inches='tight')
+    state['changed'] = False
+    state['drawn'] = time.time()
+
+
+def watch(file_name, interval=5.0, min_redraw=30.0, outputname='watch',
+          max_rows=10000, max_polls=None):
+    """Polls a running simulation's output file and redraws its plots
+    until the simulation finishes
+
+    The plots are redrawn when new rows were read, at most
+    once every min_redraw seconds, and once more at the end.
+
+    Parameters
+    ----------
+    file_name: str
+        Cyclus output file (.sqlite)
+    interval: float
+        seconds between polls
+    min_redraw: float
+        smallest number of seconds between redraws
+    outputname: str
+        name of the png file
+    max_rows: int
+        maximum number of rows read per table and poll
+    max_polls: int
+        if given, stop after this number of polls
+
+    Returns
+    -------
+    state: dictionary
+        state from new_watch
+    """
+    state = new_watch(file_name)
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        polls += 1
+        last = dict(state['last'])
+        # the simulation is done once a poll after its finish row
+        # finds nothing new
+        done = (poll(state, max_rows) and state['finished'] and
+                dict(state['last']) == last)
+        if state['changed'] and \
+                time.time() - state['drawn'] >= min_redraw:
+            draw_watch(state, outputname)
+        if done:
+            break
+        time.sleep(interval)
+    if state['changed'] and state['timestep'] is not None:
+        draw_watch(state, outputname)
+    state['cur'].connection.close()
+    return state
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python watch.py [cyclus_output_file] '
+              '[poll_interval]')
+    else:
+        interval = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+        watch(sys.argv[1], interval)